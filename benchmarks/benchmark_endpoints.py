@@ -0,0 +1,250 @@
+#!/usr/bin/env python
+# Benchmarks every endpoint of the generator app through the Flask test client, against fake schema sets of
+# increasing size (see fake_schemas.py) so that no network access is needed. Each endpoint is run in its own
+# process so that its peak RSS can be told apart from the other endpoints'. For each endpoint and size it reports
+# latency percentiles, peak RSS, and the peak memory allocated by a single request and how many allocations it
+# leaves behind.
+#
+# Run from the repo root with, eg
+#   python benchmarks/benchmark_endpoints.py
+#   python benchmarks/benchmark_endpoints.py --sizes small --endpoints upload_xls --iterations 20
+#   python benchmarks/benchmark_endpoints.py --output results.json
+#   python benchmarks/benchmark_endpoints.py --baseline results.json --max-regression 0.25
+# The last form exits with a non-zero status if the median latency of any endpoint has regressed by more than 25%.
+import argparse
+import configparser
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+GENERATOR_DIR = os.path.join(os.path.dirname(BENCHMARK_DIR), 'generator')
+
+# (schemas, columns per schema, spreadsheet rows per tab)
+SIZES = {
+    'small': (23, 10, 100),
+    'medium': (50, 30, 2000),
+    'large': (100, 60, 20000)
+}
+
+ENDPOINTS = ['load_all', 'load_all_selected', 'load_select', 'upload', 'generate_yaml', 'generate_xlsx',
+             'upload_yaml_to_xls', 'upload_xls']
+
+
+# returns a function that makes a request to the named endpoint, with a request body that selects everything
+def _request(client, endpoint, schema_template, spreadsheet_path):
+    schemas = []
+    properties = []
+    references = []
+    for tab in schema_template.tabs:
+        for key, detail in tab.items():
+            schemas.append(key)
+            for column in detail['columns']:
+                properties.append(key + ':' + column)
+                reference = key + ':' + column.split('.')[1]
+                if reference not in references:
+                    references.append(reference)
+    tabs_yaml = json.dumps({'tabs': schema_template.tabs}).encode('utf-8')
+
+    if endpoint == 'load_all':
+        return lambda: client.get('/load_all')
+    if endpoint == 'load_all_selected':
+        return lambda: client.post('/load_all', data={'schema': schemas, 'reference': references})
+    if endpoint == 'load_select':
+        return lambda: client.get('/load_select')
+    if endpoint == 'upload':
+        return lambda: client.post('/upload', data={'yamlfile': (io.BytesIO(tabs_yaml), 'tabs.yaml')},
+                                   content_type='multipart/form-data')
+    if endpoint == 'generate_yaml':
+        return lambda: client.post('/generate', data={'schema': schemas, 'property': properties,
+                                                      'submitButton': 'yaml'})
+    if endpoint == 'generate_xlsx':
+        return lambda: client.post('/generate', data={'schema': schemas, 'property': properties,
+                                                      'submitButton': 'spreadsheet'})
+    if endpoint == 'upload_yaml_to_xls':
+        return lambda: client.post('/upload_yaml_to_xls', data={'yamlfile': (io.BytesIO(tabs_yaml), 'tabs.yaml')},
+                                   content_type='multipart/form-data')
+    if endpoint == 'upload_xls':
+        with open(spreadsheet_path, 'rb') as file:
+            spreadsheet = file.read()
+        return lambda: client.post('/upload_xls', data={'xlsfile': (io.BytesIO(spreadsheet), 'old.xlsx')},
+                                   content_type='multipart/form-data')
+    raise ValueError("Unknown endpoint " + endpoint)
+
+
+def _percentile(timings, percentile):
+    ordered = sorted(timings)
+    index = min(len(ordered) - 1, int(round(percentile / 100.0 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def _peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024.0 * 1024.0) if sys.platform == 'darwin' else peak / 1024.0
+
+
+# runs one endpoint at one size - called in a fresh process
+def _run_case(endpoint, size, iterations, use_cache):
+    sys.path.insert(0, GENERATOR_DIR)
+    sys.path.insert(0, BENCHMARK_DIR)
+    os.chdir(GENERATOR_DIR)
+
+    import fake_schemas
+    from schema_snapshot import save_snapshot
+
+    schemas, columns, rows = size
+    workdir = tempfile.mkdtemp(prefix='generator-benchmark-')
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        # the app is started from a snapshot of the fake schemas, so it never goes to the network
+        schema_template = fake_schemas.make_template(schemas, columns)
+        snapshot_path = os.path.join(workdir, 'schemas.snapshot')
+        save_snapshot(snapshot_path, schema_template)
+
+        config = configparser.ConfigParser(allow_no_value=True)
+        config.read('config.ini')
+        config['snapshot'] = {'mode': 'snapshot', 'file': snapshot_path}
+        # building the template presets in the background would skew the startup time, latencies and RSS
+        config.remove_section('presets')
+        if not use_cache:
+            config['cache'] = {'max_entries': '0', 'max_memory_mb': '0', 'disk_dir': ''}
+        config_path = os.path.join(workdir, 'config.ini')
+        with open(config_path, 'w') as file:
+            config.write(file)
+
+        # the spreadsheet to migrate is generated from older versions of every schema
+        spreadsheet_path = os.path.join(workdir, 'old.xlsx')
+        if endpoint == 'upload_xls':
+            old_versions = {}
+            for tab in schema_template.tabs:
+                old_versions.update((key, '0.1.0') for key in tab)
+            fake_schemas.make_spreadsheet(spreadsheet_path, fake_schemas.make_template(schemas, columns, old_versions),
+                                          rows)
+
+        import template_generator_app
+        start = time.perf_counter()
+        app = template_generator_app.init_app(config_path)
+        startup = time.perf_counter() - start
+
+        client = app.test_client()
+        request = _request(client, endpoint, schema_template, spreadsheet_path)
+
+        # warm up, and check the endpoint actually works
+        response = request()
+        if response.status_code != 200:
+            raise RuntimeError(endpoint + " returned " + str(response.status_code))
+        response_size = len(response.data)
+        base_rss = _peak_rss_mb()
+
+        timings = []
+        for _ in range(iterations):
+            start = time.perf_counter()
+            request().data
+            timings.append(time.perf_counter() - start)
+
+        # the blocks still allocated after the request, counted from tracemalloc snapshots taken around it
+        tracemalloc.start()
+        before = tracemalloc.take_snapshot()
+        request().data
+        after = tracemalloc.take_snapshot()
+        _, allocation_peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        allocations = sum(stat.count_diff for stat in after.compare_to(before, 'filename'))
+
+        template_generator_app.JOB_QUEUE.shutdown()
+
+    return {
+        'endpoint': endpoint,
+        'schemas': schemas,
+        'columns': columns,
+        'rows': rows,
+        'iterations': iterations,
+        'startup_ms': startup * 1000,
+        'p50_ms': _percentile(timings, 50) * 1000,
+        'p90_ms': _percentile(timings, 90) * 1000,
+        'p99_ms': _percentile(timings, 99) * 1000,
+        'max_ms': max(timings) * 1000,
+        'response_kb': response_size / 1024.0,
+        'base_rss_mb': base_rss,
+        'peak_rss_mb': _peak_rss_mb(),
+        'allocation_peak_kb': allocation_peak / 1024.0,
+        'allocations': allocations
+    }
+
+
+def _case_key(result):
+    return '%s/%d/%d/%d' % (result['endpoint'], result['schemas'], result['columns'], result['rows'])
+
+
+def _print_results(results):
+    columns = ['endpoint', 'schemas', 'columns', 'rows', 'p50_ms', 'p90_ms', 'p99_ms', 'peak_rss_mb',
+               'allocation_peak_kb', 'allocations']
+    print(' '.join('%18s' % column for column in columns))
+    for result in results:
+        print(' '.join('%18s' % (('%.1f' % result[column]) if isinstance(result[column], float) else result[column])
+                       for column in columns))
+
+
+def _compare(results, baseline_path, max_regression):
+    with open(baseline_path) as file:
+        baseline = dict((_case_key(result), result) for result in json.load(file))
+
+    regressions = []
+    for result in results:
+        previous = baseline.get(_case_key(result))
+        if previous and result['p50_ms'] > previous['p50_ms'] * (1 + max_regression):
+            regressions.append('%s: median %.1fms, was %.1fms' % (_case_key(result), result['p50_ms'],
+                                                                 previous['p50_ms']))
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the generator app's endpoints")
+    parser.add_argument('--sizes', nargs='+', choices=sorted(SIZES), default=sorted(SIZES, key=lambda s: SIZES[s]))
+    parser.add_argument('--schemas', type=int, help="run a single custom size with this many schemas")
+    parser.add_argument('--columns', type=int, default=10, help="columns per schema for a custom size")
+    parser.add_argument('--rows', type=int, default=1000, help="spreadsheet rows per tab for a custom size")
+    parser.add_argument('--endpoints', nargs='+', choices=ENDPOINTS, default=ENDPOINTS)
+    parser.add_argument('--iterations', type=int, default=10)
+    parser.add_argument('--cache', action='store_true', help="leave the generated file cache on")
+    parser.add_argument('--output', help="write the results to this JSON file")
+    parser.add_argument('--baseline', help="compare the results with this JSON file from an earlier run")
+    parser.add_argument('--max-regression', type=float, default=0.25,
+                        help="fraction the median latency may grow by compared with the baseline")
+    args = parser.parse_args()
+
+    if args.schemas:
+        sizes = [(args.schemas, args.columns, args.rows)]
+    else:
+        sizes = [SIZES[size] for size in args.sizes]
+
+    # every case gets a fresh process, so that peak RSS and the schema catalogue are per endpoint
+    context = multiprocessing.get_context('spawn')
+    results = []
+    for size in sizes:
+        for endpoint in args.endpoints:
+            with context.Pool(1) as pool:
+                result = pool.apply(_run_case, (endpoint, size, args.iterations, args.cache))
+            results.append(result)
+            print('%s %s: median %.1fms' % (endpoint, size, result['p50_ms']), file=sys.stderr)
+
+    _print_results(results)
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+
+    if args.baseline:
+        regressions = _compare(results, args.baseline, args.max_regression)
+        for regression in regressions:
+            print("REGRESSION " + regression)
+        if regressions:
+            sys.exit(1)
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# Benchmarks preselecting properties in the schema catalogue against the "select all" submissions the UI can make:
+# every schema and every module reference ticked on the preselection page (the POST to /load_all) and every property
+# of every schema in an uploaded YAML file (/upload). The catalogue's indexed preselection is compared with the
+# original nested-loop implementation, which is kept here as the reference - both must mark up the same properties.
+#
+# Run from the repo root with, eg
+#   python benchmarks/benchmark_preselect.py
+#   python benchmarks/benchmark_preselect.py --schemas 200 --columns 100
+import argparse
+import contextlib
+import io
+import os
+import sys
+import time
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+GENERATOR_DIR = os.path.join(os.path.dirname(BENCHMARK_DIR), 'generator')
+sys.path.insert(0, GENERATOR_DIR)
+
+import fake_schemas
+from benchmark_endpoints import SIZES
+from generator_config import load_config
+from schema_catalogue import build_catalogue
+
+
+# the preselection as it was before the catalogue had a property index
+def _legacy_preselect(schema_properties, selected_schemas, selected_references, selected_properties):
+    for schema in schema_properties:
+        if schema["name"] in selected_schemas:
+            schema["pre-selected"] = True
+            properties = schema["properties"]
+
+            if selected_references:
+                for ref in selected_references:
+                    t = ref.split(':')[0]
+                    val = ref.split(':')[1]
+                    if schema["name"] == t or schema["name"] == val:
+                        for prop in properties.keys():
+                            if (val == prop.split('.')[1] or (
+                                    len(prop.split('.')) == 2 and prop.split('.')[0] != 'process')) and properties[
+                                prop] == "not required":
+                                schema["properties"][prop] = "pre-selected"
+            if selected_properties:
+                if schema["name"] in selected_properties:
+                    sel_props = selected_properties[schema["name"]]
+
+                    for prop in sel_props:
+                        if prop in list(properties.keys()) and properties[prop] == "not required":
+                                schema["properties"][prop] = "pre-selected"
+                        elif prop not in list(properties.keys()):
+                            schema["properties"][prop] = "pre-selected"
+    return schema_properties
+
+
+# the form the preselection page sends with everything ticked, and an upload of every property
+def _select_all(catalogue):
+    schemas = []
+    references = []
+    properties = {}
+    for schema in catalogue.schemas:
+        schemas.append(schema["name"])
+        properties[schema["name"]] = list(schema["properties"])
+        for prop in schema["properties"]:
+            reference = schema["name"] + ':' + prop.split('.')[1]
+            if reference not in references:
+                references.append(reference)
+    # uploaded YAML files can have properties that are no longer in the schemas
+    properties[schemas[0]].append(schemas[0] + '.deleted_property')
+    return schemas, references, properties
+
+
+def _marked(schema_properties):
+    return [(schema["name"], schema.get("pre-selected"), dict(schema["properties"])) for schema in schema_properties]
+
+
+def _time(function, iterations):
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return sorted(timings)[len(timings) // 2] * 1000
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark preselecting properties in the schema catalogue")
+    parser.add_argument('--sizes', nargs='+', choices=sorted(SIZES), default=sorted(SIZES, key=lambda s: SIZES[s]))
+    parser.add_argument('--schemas', type=int, help="run a single custom size with this many schemas")
+    parser.add_argument('--columns', type=int, default=10, help="columns per schema for a custom size")
+    parser.add_argument('--iterations', type=int, default=20)
+    args = parser.parse_args()
+
+    if args.schemas:
+        sizes = [(args.schemas, args.columns)]
+    else:
+        sizes = [SIZES[size][:2] for size in args.sizes]
+
+    config = load_config(os.path.join(GENERATOR_DIR, 'config.ini'))
+
+    print('%8s %8s %10s %12s %12s %8s' % ('schemas', 'columns', 'form', 'legacy_ms', 'indexed_ms', 'speedup'))
+    for schemas, columns in sizes:
+        with contextlib.redirect_stdout(io.StringIO()):
+            catalogue = build_catalogue(fake_schemas.make_template(schemas, columns), config)
+        selected_schemas, selected_references, selected_properties = _select_all(catalogue)
+
+        forms = [('load_all', (selected_schemas, selected_references, None)),
+                 ('upload', (selected_schemas, None, selected_properties))]
+        for form, selection in forms:
+            if _marked(_legacy_preselect(catalogue.view(), *selection)) != _marked(catalogue.preselect(*selection)):
+                raise RuntimeError("Indexed preselection differs from the original for the " + form + " form")
+
+            legacy = _time(lambda: _legacy_preselect(catalogue.view(), *selection), args.iterations)
+            indexed = _time(lambda: catalogue.preselect(*selection), args.iterations)
+            print('%8d %8d %10s %12.2f %12.2f %7.1fx' % (schemas, columns, form, legacy, indexed, legacy / indexed))
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+# Benchmarks loading and dumping YAML files of tabs with yaml_io.py against the way the app used to do it
+# (yaml.load with the FullLoader and yaml.dump with the default dumper), for a YAML file of every column of every
+# schema in fake schema sets of increasing size. Both must load and dump the same tabs. How much faster yaml_io is
+# mostly depends on whether PyYAML was built with libyaml, which is reported first.
+#
+# Run from the repo root with, eg
+#   python benchmarks/benchmark_yaml.py
+#   python benchmarks/benchmark_yaml.py --sizes large --repeat 10
+import argparse
+import os
+import sys
+import time
+
+import yaml
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+GENERATOR_DIR = os.path.join(os.path.dirname(BENCHMARK_DIR), 'generator')
+sys.path.insert(0, GENERATOR_DIR)
+
+import fake_schemas
+from benchmark_endpoints import SIZES
+from yaml_io import SafeLoader, dump_yaml, load_tabs
+
+
+def _legacy_load(content):
+    return yaml.load(content, Loader=yaml.FullLoader)
+
+
+def _legacy_dump(tabs):
+    return yaml.dump(tabs, default_flow_style=False).encode('utf-8')
+
+
+def _time(function, iterations):
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return sorted(timings)[len(timings) // 2] * 1000
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark loading and dumping YAML files of tabs")
+    parser.add_argument('--sizes', nargs='+', choices=sorted(SIZES), default=sorted(SIZES, key=lambda s: SIZES[s]))
+    parser.add_argument('--repeat', type=int, default=1, help="repeat the tabs this many times to make bigger files")
+    parser.add_argument('--iterations', type=int, default=5)
+    args = parser.parse_args()
+
+    print('loader: ' + SafeLoader.__name__ + (' (libyaml)' if yaml.__with_libyaml__ else ' (pure Python)'))
+    print('%8s %8s %10s %12s %12s %8s %12s %12s %8s' % ('schemas', 'columns', 'kB', 'load_ms', 'yaml_io_ms',
+                                                        'speedup', 'dump_ms', 'yaml_io_ms', 'speedup'))
+    for size in args.sizes:
+        schemas, columns = SIZES[size][:2]
+        tabs = {'tabs': fake_schemas.make_template(schemas, columns).tabs * args.repeat}
+        content = dump_yaml(tabs)
+
+        if _legacy_dump(tabs) != content:
+            raise RuntimeError("yaml_io dumps the " + size + " tabs differently")
+        if _legacy_load(content) != load_tabs(content):
+            raise RuntimeError("yaml_io loads the " + size + " tabs differently")
+
+        legacy_load = _time(lambda: _legacy_load(content), args.iterations)
+        new_load = _time(lambda: load_tabs(content), args.iterations)
+        legacy_dump = _time(lambda: _legacy_dump(tabs), args.iterations)
+        new_dump = _time(lambda: dump_yaml(tabs), args.iterations)
+        print('%8d %8d %10d %12.1f %12.1f %7.1fx %12.1f %12.1f %7.1fx' % (
+            schemas, columns, len(content) // 1024, legacy_load, new_load, legacy_load / new_load,
+            legacy_dump, new_dump, legacy_dump / new_dump))
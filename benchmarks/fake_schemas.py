@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+# Synthetic HCA metadata schemas for benchmarking the generator without any network access. The schema set always
+# contains every schema named in the generator's config.ini (so the linking, ordering and sub-tab rules all get
+# exercised) and can be padded out with extra schemas and extra columns per schema.
+from ingest.template.schema_template import SchemaTemplate
+from ingest.template.vanilla_spreadsheet_builder import VanillaSpreadsheetBuilder
+
+BASE_URL = "https://schema.humancellatlas.org"
+
+BIOMATERIALS = ["donor_organism", "specimen_from_organism", "cell_suspension", "organoid", "imaged_specimen",
+                "cell_line"]
+PROTOCOLS = ["analysis_protocol", "collection_protocol", "dissociation_protocol", "differentiation_protocol",
+             "enrichment_protocol", "aggregate_generation_protocol", "ipsc_induction_protocol",
+             "imaging_preparation_protocol", "imaging_protocol", "library_preparation_protocol", "sequencing_protocol"]
+FILES = ["supplementary_file", "sequence_file", "image_file", "analysis_file"]
+
+# sub-tabs from the ordering section of config.ini, other than the project ones
+SUB_TABS = {"donor_organism": ["familial_relationships"], "ipsc_induction_protocol": ["reagents"],
+            "imaging_protocol": ["channel", "probe"]}
+
+MIGRATIONS = [{"source_schema": "donor_organism", "property": "old_field", "target_schema": "donor_organism",
+               "replaced_by": "field_0", "effective_from": "10.0.0", "reason": "renamed", "type": "renamed property"}]
+
+# the number of schemas every fake schema set has, before any extra schemas are added
+STANDARD_SCHEMA_COUNT = 1 + len(BIOMATERIALS) + len(PROTOCOLS) + len(FILES) + 1
+
+
+def _field(name, user_friendly=None):
+    return {"type": "string", "user_friendly": user_friendly or name.replace("_", " ").capitalize(),
+            "description": "Description of " + name, "example": "eg " + name, "guidelines": "Guidelines for " + name}
+
+
+def _module(url, user_friendly, properties, required=()):
+    return {"$schema": "http://json-schema.org/draft-07/schema#", "$id": url, "type": "object",
+            "user_friendly": user_friendly, "description": user_friendly, "required": list(required),
+            "properties": properties}
+
+
+def _ontology(name):
+    return {"type": "array", "user_friendly": name.replace("_", " ").capitalize(),
+            "items": _module(BASE_URL + "/module/ontology/5.0.0/" + name + "_ontology", name,
+                             {"text": _field("text"), "ontology": _field("ontology"),
+                              "ontology_label": _field("ontology_label")}, ["text"])}
+
+
+def _array_of(url, name, properties, required):
+    user_friendly = name.replace("_", " ").capitalize()
+    return {"type": "array", "user_friendly": user_friendly,
+            "items": _module(url, user_friendly, dict((p, _field(p)) for p in properties), required)}
+
+
+def _type_schema(key, entity, version, columns, id_field):
+    core = entity + "_core"
+    properties = {
+        "describedBy": {"type": "string"},
+        "schema_type": {"type": "string"},
+        core: _module(BASE_URL + "/core/" + entity + "/5.0.0/" + core, entity.capitalize() + " core",
+                      {id_field: _field(id_field, entity.capitalize() + " ID"),
+                       entity + "_name": _field(entity + "_name", entity.capitalize() + " name")}, [id_field]),
+        "genus_species": _ontology("species")
+    }
+    for sub_tab in SUB_TABS.get(key, []):
+        properties[sub_tab] = _array_of(BASE_URL + "/module/" + entity + "/2.0.0/" + sub_tab, sub_tab,
+                                        [sub_tab + "_name", sub_tab + "_value"], [sub_tab + "_name"])
+    for i in range(columns):
+        properties["field_" + str(i)] = _field("field_" + str(i))
+    return _module(BASE_URL + "/type/" + entity + "/" + version + "/" + key, key, properties, [core])
+
+
+def _project(version):
+    properties = {
+        "describedBy": {"type": "string"},
+        "project_core": _module(BASE_URL + "/core/project/5.0.0/project_core", "Project core",
+                                {"project_short_name": _field("project_short_name")}, ["project_short_name"]),
+        "contributors": _array_of(BASE_URL + "/module/project/8.0.0/contact", "contributors", ["name", "email"],
+                                  ["name"]),
+        "publications": _array_of(BASE_URL + "/module/project/5.0.0/publication", "publications", ["title"],
+                                  ["title"]),
+        "funders": _array_of(BASE_URL + "/module/project/2.0.0/funder", "funders", ["grant_id"], ["grant_id"])
+    }
+    return _module(BASE_URL + "/type/project/" + version + "/project", "project", properties, ["project_core"])
+
+
+# returns the JSON of a fake schema set. schemas is the total number of schemas - anything beyond the standard set
+# is made up of extra biomaterial schemas. versions can override the version of individual schemas
+def make_schemas(schemas=STANDARD_SCHEMA_COUNT, columns=10, versions=None):
+    versions = versions or {}
+    docs = [_project(versions.get("project", "14.0.0"))]
+    for key in BIOMATERIALS:
+        docs.append(_type_schema(key, "biomaterial", versions.get(key, "10.0.0"), columns, "biomaterial_id"))
+    for key in PROTOCOLS:
+        docs.append(_type_schema(key, "protocol", versions.get(key, "6.0.0"), columns, "protocol_id"))
+    for key in FILES:
+        docs.append(_type_schema(key, "file", versions.get(key, "9.0.0"), columns, "file_name"))
+    docs.append(_type_schema("process", "process", versions.get("process", "9.0.0"), 2, "process_id"))
+
+    for i in range(schemas - STANDARD_SCHEMA_COUNT):
+        key = "extra_biomaterial_" + str(i)
+        docs.append(_type_schema(key, "biomaterial", versions.get(key, "1.0.0"), columns, "biomaterial_id"))
+    return docs
+
+
+def make_template(schemas=STANDARD_SCHEMA_COUNT, columns=10, versions=None):
+    return SchemaTemplate(json_schema_docs=make_schemas(schemas, columns, versions), property_migrations=MIGRATIONS)
+
+
+# writes a filled in spreadsheet generated from schema_template, with stale header rows so that migrating it has
+# something to do, and rows rows of data in every tab
+def make_spreadsheet(path, schema_template, rows):
+    builder = VanillaSpreadsheetBuilder(path, True)
+    builder.include_schemas_tab = True
+    builder.build(schema_template)
+
+    for worksheet in builder.spreadsheet.worksheets():
+        if worksheet.name == 'Schemas':
+            continue
+        worksheet.write(0, 0, 'STALE TITLE')
+        for row in range(5, 5 + rows):
+            for column in range(4):
+                worksheet.write(row, column, 'value ' + str(row) + ' ' + str(column))
+
+    builder.save_spreadsheet()
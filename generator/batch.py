@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+# Batch migration and generation of spreadsheets. A batch is a zip file or directory of spreadsheets to migrate
+# and/or YAML files to turn into spreadsheets. The files are shared out between the processes of a process pool
+# (each of which has the schemas and schema index already loaded) and the results are written to a zip file,
+# together with report.json saying what happened to each file.
+#
+# Batches can be sent to the /batch endpoint of the app, or run from the command line with
+#   python batch.py old_spreadsheets/ -o migrated.zip
+import argparse
+import concurrent.futures
+import json
+import multiprocessing
+import os
+import posixpath
+import zipfile
+
+BATCH_EXTENSIONS = ('.xlsx', '.xls', '.yaml', '.yml')
+
+REPORT_NAME = 'report.json'
+
+# limits on zip files of batches - the files are decompressed into memory, so a small zip file that expands to
+# something huge (a zip bomb) is turned away before any of it is read
+MAX_BATCH_MEMBERS = 1000
+MAX_BATCH_FILE_SIZE = 100 * 1024 * 1024
+MAX_BATCH_SIZE = 500 * 1024 * 1024
+
+
+class BatchException(Exception):
+    pass
+
+
+def _is_batch_file(name):
+    base_name = posixpath.basename(name)
+    return name.lower().endswith(BATCH_EXTENSIONS) and not base_name.startswith(('.', '~$')) \
+        and not name.startswith('__MACOSX/')
+
+
+# reads the files of a batch as a list of (name, content). source is the path of a directory or zip file, or a
+# zip file object. Raises BatchException if a zip file has more than max_members members, or its files would
+# uncompress to more than max_file_size bytes each or max_size bytes in all
+def read_batch(source, max_members=MAX_BATCH_MEMBERS, max_file_size=MAX_BATCH_FILE_SIZE, max_size=MAX_BATCH_SIZE):
+    if isinstance(source, str) and os.path.isdir(source):
+        files = []
+        for directory, _, names in os.walk(source):
+            for name in sorted(names):
+                path = os.path.join(directory, name)
+                relative_name = os.path.relpath(path, source).replace(os.sep, '/')
+                if _is_batch_file(relative_name):
+                    with open(path, 'rb') as file:
+                        files.append((relative_name, file.read()))
+        return sorted(files)
+
+    try:
+        with zipfile.ZipFile(source) as archive:
+            members = archive.infolist()
+            if len(members) > max_members:
+                raise BatchException("A batch can't have more than " + str(max_members) + " files")
+
+            batch_members = [info for info in members if not info.is_dir() and _is_batch_file(info.filename)]
+            total_size = 0
+            for info in batch_members:
+                if info.file_size > max_file_size:
+                    raise BatchException(info.filename + " is bigger than the limit of "
+                                         + str(max_file_size // 1024 // 1024) + " MB for a file in a batch")
+                total_size += info.file_size
+                if total_size > max_size:
+                    raise BatchException("The files of a batch can't add up to more than "
+                                         + str(max_size // 1024 // 1024) + " MB")
+
+            # zipfile never reads more than the file size a member claims to have, so the limits hold
+            return [(info.filename, archive.read(info)) for info in batch_members]
+    except zipfile.BadZipFile:
+        raise BatchException("A batch must be a directory or a zip file")
+
+
+# processes the files of a batch in the pool executor and writes the results and report to target (a file name or
+# file object). function(name, content, *args) is called for each file in a pool process and returns
+# (result name, result content, report). Returns the report of each file, in the order of the files
+def run_batch(executor, files, target, function, args=()):
+    futures = {}
+    for index, (name, content) in enumerate(files):
+        futures[executor.submit(function, name, content, *args)] = (index, name)
+
+    reports = [None] * len(files)
+    result_names = set()
+    with zipfile.ZipFile(target, 'w', zipfile.ZIP_DEFLATED, allowZip64=True) as archive:
+        # results are added to the zip as they come in, so only a few are ever held in memory at once
+        for future in concurrent.futures.as_completed(futures):
+            index, name = futures.pop(future)
+            try:
+                result_name, result, report = future.result()
+            except Exception as e:
+                reports[index] = {'file': name, 'status': 'failed', 'error': str(e)}
+                print("Batch file " + name + " failed: " + str(e))
+                continue
+
+            # two inputs can map to the same result name, eg foo.yaml and foo.yml
+            if result_name in result_names:
+                result_name = _unique_name(result_name, result_names)
+            result_names.add(result_name)
+
+            archive.writestr(result_name, result)
+            reports[index] = dict(report, file=name, status='done', result=result_name)
+
+        archive.writestr(REPORT_NAME, json.dumps(reports, indent=2))
+
+    return reports
+
+
+def _unique_name(name, taken):
+    base, extension = posixpath.splitext(name)
+    counter = 2
+    while base + '_' + str(counter) + extension in taken:
+        counter += 1
+    return base + '_' + str(counter) + extension
+
+
+# command line tool to migrate or generate a batch of spreadsheets with the schemas from the config file
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Migrate spreadsheets and generate spreadsheets from YAML files "
+                                                 "in bulk")
+    parser.add_argument('source', help="directory or zip file of spreadsheets and/or YAML files")
+    parser.add_argument('-o', '--output', required=True, help="zip file to write the results and report to")
+    parser.add_argument('-c', '--config', default='config.ini', help="config file of the generator app")
+    parser.add_argument('-w', '--workers', type=int, default=os.cpu_count(), help="number of worker processes")
+    args = parser.parse_args()
+
+    import template_generator
+
+    template_generator.init(args.config)
+    _, initargs = template_generator.job_worker_state()
+    latest_schemas = list(template_generator.latest_schema_urls())
+
+    batch_files = read_batch(args.source)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=args.workers,
+                                                mp_context=multiprocessing.get_context('spawn'),
+                                                initializer=template_generator.init_job_worker,
+                                                initargs=initargs) as pool:
+        batch_reports = run_batch(pool, batch_files, args.output, template_generator.process_batch_file,
+                                  (latest_schemas,))
+
+    failed = [report for report in batch_reports if report['status'] != 'done']
+    print("Processed " + str(len(batch_reports)) + " files, " + str(len(failed)) + " failed, results in " + args.output)
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# Command line tool to generate and migrate spreadsheets without running the web app, eg in a pipeline
+#   python cli.py generate --tabs tabs.yaml -o spreadsheet.xlsx
+#   python cli.py migrate old.xlsx -o migrated.xlsx
+#
+# The schemas are loaded the same way as the app's, from the config file - with the schemas kept in a snapshot
+# (see schema_snapshot.py) the tool never goes to the Ingest API, and starts in a fraction of a second. Progress
+# goes to stderr, and a JSON report of what was done to stdout.
+import argparse
+import contextlib
+import json
+import sys
+
+
+def _generate(template_generator, args):
+    with open(args.tabs) as file:
+        yaml_json = template_generator.load_yaml(file)
+
+    content = template_generator.build_spreadsheet(yaml_json, template_generator.latest_schema_urls())
+    with open(args.output, 'wb') as file:
+        file.write(content)
+    return {'type': 'generation', 'tabs': len(yaml_json['tabs']), 'result': args.output}
+
+
+def _migrate(template_generator, args):
+    report = template_generator.migrate_workbook(args.source, args.output, template_generator.latest_schema_urls())
+    return dict(report, type='migration', result=args.output)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate and migrate HCA metadata spreadsheets")
+    parser.add_argument('-c', '--config', default='config.ini', help="config file of the generator app")
+    schemas = parser.add_mutually_exclusive_group()
+    schemas.add_argument('--snapshot', help="load the schemas from this snapshot file")
+    schemas.add_argument('--live', action='store_true', help="load the latest schemas from the Ingest API, even if "
+                                                              "the config file says to use a snapshot")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    generate = commands.add_parser('generate', help="generate a spreadsheet from a YAML file of tabs")
+    generate.add_argument('--tabs', required=True, help="YAML file of the tabs and columns to generate")
+    generate.add_argument('-o', '--output', required=True, help="spreadsheet to write")
+    generate.set_defaults(function=_generate)
+
+    migrate = commands.add_parser('migrate', help="migrate a spreadsheet to the latest schemas")
+    migrate.add_argument('source', help="spreadsheet to migrate")
+    migrate.add_argument('-o', '--output', required=True, help="migrated spreadsheet to write")
+    migrate.set_defaults(function=_migrate)
+
+    args = parser.parse_args(argv)
+
+    mode = None
+    if args.snapshot:
+        mode = 'snapshot'
+    elif args.live:
+        mode = 'live'
+
+    # the library prints its progress, which would get mixed up with the report
+    with contextlib.redirect_stdout(sys.stderr):
+        # imported here rather than up front so that --help doesn't have to wait for the schema libraries to load
+        import template_generator
+        from yaml_io import YamlException
+
+        template_generator.init(args.config, mode=mode, snapshot_file=args.snapshot)
+        try:
+            report = args.function(template_generator, args)
+        except YamlException as e:
+            sys.exit(str(e))
+
+    print(json.dumps(report))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# Index of the user-friendly header rows (name, description, guidelines/example) for every spreadsheet column,
+# keyed by the column's programmatic name. It is built once per schema template so that rewriting the headers
+# of a migrated spreadsheet is a dictionary read per column rather than a dozen schema template lookups.
+#
+# WARNING: This code duplicates a large section of the ingest-client spreadsheet builder. Updates to the
+# relevant spreadsheet builder code should be mimicked here!
+from collections import namedtuple
+
+
+class ColumnHeader(namedtuple('ColumnHeader', ['schema', 'user_friendly', 'description', 'required', 'example',
+                                               'guidelines', 'title', 'input_title'])):
+    __slots__ = ()
+
+    # the title for the column in row 1 of a tab - linking columns to other biomaterials are marked as inputs
+    def title_for(self, tab_schema):
+        return self.title if tab_schema == self.schema else self.input_title
+
+    # the text for the column in row 3 of a tab
+    @property
+    def guide(self):
+        if self.example:
+            return self.guidelines + ' For example: ' + self.example
+        return self.guidelines
+
+
+class ColumnHeaderIndex:
+
+    # the headers of a column only depend on the schema it belongs to, so the headers of columns of the unchanged
+    # schemas are taken from previous, the index for an earlier version of the schemas, rather than resolved again
+    def __init__(self, schema_template, previous=None, unchanged=()):
+        self.schema_template = schema_template
+
+        self.display_names = {}
+        for tab in schema_template.tabs:
+            for schema_name, detail in tab.items():
+                self.display_names[schema_name] = detail['display_name']
+
+        self._headers = {}
+        if previous is not None:
+            unchanged = set(unchanged)
+            for column, header in list(previous._headers.items()):
+                if header.schema in unchanged:
+                    self._headers[column] = header
+
+        for tab in schema_template.tabs:
+            for detail in tab.values():
+                for column in detail['columns']:
+                    if column not in self._headers:
+                        self._headers[column] = self._resolve(column)
+
+    def __contains__(self, column):
+        return column in self._headers
+
+    # returns the ColumnHeader for a column - columns that aren't part of any tab in the schema template
+    # (eg linking columns or properties that were migrated) are resolved on first use and remembered
+    def lookup(self, column):
+        header = self._headers.get(column)
+        if header is None:
+            header = self._resolve(column)
+            self._headers[column] = header
+        return header
+
+    def _resolve(self, column):
+        # any .text field from an ontology module should actually use the user-friendly name/description/example/
+        # required status of its wrapper property
+        is_text = column.split(".")[-1] == "text"
+        base = column.replace('.text', '') if is_text else column
+
+        uf = self._get_value(base, "user_friendly").upper()
+        required = bool(self._get_value(base, "required"))
+        desc = self._get_value(base, "description")
+        example_text = self._get_value(base, "example")
+        guidelines = self._get_value(base, "guidelines")
+        if is_text:
+            desc = desc or self._get_value(column, "description")
+            example_text = example_text or self._get_value(column, "example")
+            guidelines = guidelines or self._get_value(column, "guidelines")
+
+        # correct labelling of barcode and kit imports (eg UMI barcode - foo vs cell barcode - foo)
+        wrapper = self._get_attributes(".".join(column.split(".")[:-1]))
+        module = (wrapper.get('schema') or {}).get('module')
+        if module in ('purchased_reagents', 'barcode') and wrapper.get('multivalue') is False:
+            uf = (wrapper['user_friendly'] + " - " + uf).upper()
+
+        # core fields like ID and name for biomaterial and protocol should be referred to by the schema name,
+        # eg donor organism id rather than biomaterial id
+        schema_name = column.split(".")[0]
+        schema_uf = self.display_names.get(schema_name, schema_name).upper()
+        is_input = False
+        if "BIOMATERIAL " in uf:
+            uf = uf.replace("BIOMATERIAL", schema_uf)
+            is_input = True
+        if "PROTOCOL " in uf:
+            uf = uf.replace("PROTOCOL", schema_uf)
+
+        title = uf + " (Required)" if required else uf
+        input_title = "INPUT " + title if is_input else title
+
+        return ColumnHeader(schema_name, uf, desc, required, example_text, guidelines, title, input_title)
+
+    def _get_attributes(self, key):
+        try:
+            return self.schema_template.lookup_property_from_template(key)
+        except Exception:
+            return {}
+
+    # look up a property (user friendly name, description etc) for a column from the schema template library
+    def _get_value(self, column, property):
+        try:
+            value = self.schema_template.lookup_property_from_template(column + "." + property)
+            return str(value) if value else ""
+        except Exception:
+            return ""
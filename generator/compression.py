@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# Compression of the HTML pages, JSON and YAML files the app sends back, with brotli or gzip depending on what the
+# client accepts. Pages and JSON are compressed in one go; files that are streamed back in chunks are compressed
+# chunk by chunk as they are sent, so a download never has to be held in memory whole to be compressed. Spreadsheets
+# and zip files are compressed already, so they are sent as they are.
+#
+# A compressed response is a different set of bytes from the uncompressed one, so it gets its own ETag - the ETag
+# of the content with the encoding appended, eg "<etag>-gzip". Brotli is only used if the Brotli package is
+# installed, otherwise clients get gzip.
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# the media types worth compressing
+COMPRESSIBLE_TYPES = frozenset(['text/html', 'application/json', 'application/x-yaml'])
+
+# responses smaller than this aren't worth compressing
+MIN_SIZE = 1024
+
+GZIP_LEVEL = 6
+# brotli's higher qualities compress a little better but are much slower, too slow to do on every request
+BROTLI_QUALITY = 4
+
+# zlib window size for a gzip header and trailer around the compressed data
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+
+# the encodings the app can compress with, best first
+def available_encodings():
+    if brotli is not None:
+        return ['br', 'gzip']
+    return ['gzip']
+
+# the best encoding that is both available and accepted by the client (a werkzeug accept_encodings), None if there
+# isn't one
+def choose_encoding(accept_encodings):
+    return accept_encodings.best_match(available_encodings())
+
+class Compressor:
+
+    def __init__(self, encoding, gzip_level=GZIP_LEVEL, brotli_quality=BROTLI_QUALITY):
+        self.encoding = encoding
+        if encoding == 'br':
+            self._compressor = brotli.Compressor(quality=brotli_quality)
+        elif encoding == 'gzip':
+            self._compressor = zlib.compressobj(gzip_level, zlib.DEFLATED, GZIP_WBITS)
+        else:
+            raise ValueError("Can't compress with " + encoding)
+
+    # compresses the next part of the content, returning whatever compressed data is ready
+    def compress(self, data):
+        if self.encoding == 'br':
+            return self._compressor.process(data)
+        return self._compressor.compress(data)
+
+    # the rest of the compressed data, once all the content has been compressed
+    def finish(self):
+        if self.encoding == 'br':
+            return self._compressor.finish()
+        return self._compressor.flush()
+
+# compresses the whole of a response body
+def compress(data, encoding, gzip_level=GZIP_LEVEL, brotli_quality=BROTLI_QUALITY):
+    compressor = Compressor(encoding, gzip_level, brotli_quality)
+    return compressor.compress(data) + compressor.finish()
+
+# compresses a response body as it is streamed, chunk by chunk. The chunks are closed when the compressed stream is,
+# so a file being streamed is closed once it has been sent, or the client goes away
+def compress_chunks(chunks, encoding, gzip_level=GZIP_LEVEL, brotli_quality=BROTLI_QUALITY):
+    compressor = Compressor(encoding, gzip_level, brotli_quality)
+    try:
+        for chunk in chunks:
+            data = compressor.compress(chunk)
+            # small chunks are buffered by the compressor until it has enough for a block
+            if data:
+                yield data
+        yield compressor.finish()
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+# the ETag of a response compressed with encoding
+def encoded_etag(etag, encoding):
+    return etag + '-' + encoding
+
+# the ETag a client already has a response as (a werkzeug if_none_match), with or without compression, None if it
+# doesn't have it
+def matching_etag(etag, if_none_match):
+    for candidate in [etag] + [encoded_etag(etag, encoding) for encoding in available_encodings()]:
+        if candidate in if_none_match:
+            return candidate
+    return None
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+# The config file compiled into read-only structures once, when it is loaded, rather than the ordering and linking
+# sections being looked up and their comma separated values split every time a catalogue is built or a request
+# handled. The compiled config can be checked against the loaded schemas, and a ConfigWatcher can reload it when
+# the file changes.
+#
+# Only the ordering, linking, blacklist and system sections are compiled - the rest of the file (cache, tracing,
+# jobs etc.) is only read at start-up and stays available through the config's parser.
+import configparser
+import os
+import threading
+from collections import namedtuple
+from types import MappingProxyType
+
+# a tab in the ordering section: its schema key and the value it was given - empty for a tab of its own, 'process'
+# for a schema that gets the process fields, or the key of the parent schema for a sub-tab
+OrderedTab = namedtuple('OrderedTab', ['key', 'parent'])
+
+# ordering is the tabs in the order they appear in the file, children is {parent: keys of the tabs that name it}.
+# The linking sections are {schema key: keys of the schemas it links to}, and excluded_schemas the blacklisted
+# schemas. mtime is the modification time of the file when it was loaded, None if it wasn't loaded from a file
+GeneratorConfig = namedtuple('GeneratorConfig', ['parser', 'path', 'mtime', 'environment', 'ordering', 'children',
+                                                 'biomaterial_linking', 'protocol_linking', 'excluded_schemas'])
+
+
+# loads and compiles the config file at path. Raises ValueError if the file can't be compiled
+def load_config(path):
+    mtime = config_mtime(path)
+    parser = configparser.ConfigParser(allow_no_value=True)
+    try:
+        parser.read(path)
+    except configparser.Error as e:
+        raise ValueError("Couldn't read config file " + path + ": " + str(e))
+    return compile_config(parser, path, mtime)
+
+# the modification time of the config file at path, None if there isn't one
+def config_mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+# compiles the sections of a config parser used in building the catalogue and handling requests
+def compile_config(parser, path=None, mtime=None):
+    environment = ''
+    if 'system' in parser:
+        environment = parser['system'].get('environment') or ''
+
+    ordering = []
+    children = {}
+    if 'ordering' in parser:
+        for key, parent in parser['ordering'].items():
+            parent = (parent or '').strip()
+            if parent == key:
+                raise ValueError("Tab " + key + " in the ordering section can't be its own parent")
+            ordering.append(OrderedTab(key, parent))
+            if parent:
+                children.setdefault(parent, []).append(key)
+
+    excluded_schemas = frozenset()
+    if 'blacklist' in parser and parser['blacklist'].get('schema_list'):
+        excluded_schemas = frozenset(name.strip() for name in parser['blacklist']['schema_list'].split(',')
+                                     if name.strip())
+
+    return GeneratorConfig(parser, path, mtime, environment, tuple(ordering),
+                           MappingProxyType(dict((parent, tuple(keys)) for parent, keys in children.items())),
+                           _compile_links(parser, 'biomaterial_linking'), _compile_links(parser, 'protocol_linking'),
+                           excluded_schemas)
+
+# checks the compiled config against the schemas of a schema template, returning a description of every tab, link
+# and blacklisted schema that doesn't match up with them. These are ignored when building the catalogue, so they
+# aren't errors, but usually mean the config file needs updating for a new schema release
+def validate_config(config, schema_template):
+    schemas = set(list(tab.keys())[0] for tab in schema_template.tabs)
+
+    problems = []
+    for tab in config.ordering:
+        if tab.key in schemas:
+            continue
+        if not tab.parent or tab.parent == 'process':
+            problems.append(tab.key + " in the ordering section isn't a schema")
+        elif tab.parent not in schemas:
+            problems.append("the parent of sub-tab " + tab.key + ", " + tab.parent + ", isn't a schema")
+        elif tab.key not in schema_template.lookup_property_from_template(tab.parent):
+            problems.append("sub-tab " + tab.key + " isn't a property of " + tab.parent)
+
+    for section, links in [('biomaterial_linking', config.biomaterial_linking),
+                           ('protocol_linking', config.protocol_linking)]:
+        for key, linked in links.items():
+            for name in (key,) + linked:
+                if name not in schemas:
+                    problems.append(name + " in the " + section + " section isn't a schema")
+
+    for name in sorted(config.excluded_schemas):
+        if name not in schemas:
+            problems.append("blacklisted schema " + name + " isn't a schema")
+
+    # a schema can be listed more than once in the linking sections
+    return list(dict.fromkeys(problems))
+
+# helper function to compile a linking section into {schema key: keys of the schemas it links to}
+def _compile_links(parser, section):
+    links = {}
+    if section in parser:
+        for key, value in parser[section].items():
+            linked = tuple(name.strip() for name in (value or '').split(',') if name.strip())
+            if not linked:
+                raise ValueError(key + " in the " + section + " section doesn't link to any schemas")
+            links[key] = linked
+    return MappingProxyType(links)
+
+
+class ConfigWatcher:
+
+    # on_change() is called from a background thread whenever the config file at path has changed, checking every
+    # interval seconds. mtime is the modification time of the file as it was loaded
+    def __init__(self, path, interval, on_change, mtime=None):
+        self.path = path
+        self.interval = interval
+        self._on_change = on_change
+        self._mtime = mtime
+        self._stopped = threading.Event()
+        self._thread = None
+
+    # checks whether the config file has changed, calling on_change if it has. Returns whether it changed
+    def check(self):
+        mtime = config_mtime(self.path)
+        if mtime is None or mtime == self._mtime:
+            return False
+        # only tried once per change to the file, a file that can't be loaded is reported once rather than every check
+        self._mtime = mtime
+        self._on_change()
+        return True
+
+    def start(self):
+        if self._thread is None and self.interval > 0:
+            self._thread = threading.Thread(target=self._run, name='config-watcher', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            self.check()
@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+# Background jobs for large spreadsheet migrations and generations. A job's input is saved to the job store and
+# the work runs in a process pool, so the request that submits it returns straight away with the job's id and
+# CPU-bound work doesn't hold up other requests. Clients then poll the job's status and download the result once
+# it is done.
+#
+# The job store is a directory holding a status file, the input and the result of each job. Because it's on disk,
+# any worker process of a multi-worker server can report on or serve any job. It holds at most max_jobs jobs and
+# jobs are removed ttl seconds after they were submitted.
+import concurrent.futures
+import datetime
+import json
+import multiprocessing
+import os
+import re
+import threading
+import time
+import uuid
+
+_JOB_ID = re.compile(r'^[0-9a-f]{32}$')
+
+# the number of pool processes a job queue has unless it is given another number. Every worker process of the app
+# has a job queue of its own, so this is kept small rather than one per CPU
+DEFAULT_WORKERS = 2
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class JobStore:
+
+    def __init__(self, directory, ttl=3600, max_jobs=100):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_jobs = max_jobs
+        os.makedirs(directory, exist_ok=True)
+
+    # creates a new queued job and returns its status
+    def create(self, kind, filename, content_type):
+        self.sweep()
+
+        job = {
+            'id': uuid.uuid4().hex,
+            'kind': kind,
+            'status': QUEUED,
+            'filename': filename,
+            'content_type': content_type,
+            'submitted': time.time()
+        }
+        self._write(job)
+        return job
+
+    # returns the status of a job, or None if there is no such job or it has expired
+    def get(self, job_id):
+        if not _JOB_ID.match(job_id):
+            return None
+        try:
+            with open(self._status_path(job_id)) as file:
+                job = json.load(file)
+        except (OSError, ValueError):
+            return None
+
+        if time.time() - job['submitted'] > self.ttl:
+            self.remove(job_id)
+            return None
+        return job
+
+    def update(self, job_id, **fields):
+        job = self.get(job_id)
+        if job is not None:
+            job.update(fields)
+            self._write(job)
+        return job
+
+    def input_path(self, job_id):
+        return os.path.join(self.directory, job_id + '.input')
+
+    def result_path(self, job_id):
+        return os.path.join(self.directory, job_id + '.result')
+
+    def remove(self, job_id):
+        for path in (self._status_path(job_id), self.input_path(job_id), self.result_path(job_id)):
+            _remove(path)
+
+    # removes expired jobs, and the oldest finished jobs if there are too many
+    def sweep(self):
+        jobs = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.json'):
+                job = self.get(name[:-len('.json')])
+                if job is not None:
+                    jobs.append(job)
+
+        finished = sorted((job for job in jobs if job['status'] in (DONE, FAILED)), key=lambda job: job['submitted'])
+        while len(jobs) >= self.max_jobs and finished:
+            job = finished.pop(0)
+            self.remove(job['id'])
+            jobs.remove(job)
+
+    def _status_path(self, job_id):
+        return os.path.join(self.directory, job_id + '.json')
+
+    def _write(self, job):
+        # written to a temp file and renamed, so other processes never read a half written status
+        temp_path = self._status_path(job['id']) + '.' + str(os.getpid()) + '.tmp'
+        with open(temp_path, 'w') as file:
+            json.dump(job, file)
+        os.replace(temp_path, self._status_path(job['id']))
+
+
+# runs a job in a pool process. function is called with the paths of the job's input and of the file to write the
+# result to, plus args, and returns a report of what it did which is added to the job's status
+def run_job(store, job_id, function, args):
+    if store.update(job_id, status=RUNNING, started=time.time()) is None:
+        # the job expired before it got to run
+        return
+
+    temp_path = store.result_path(job_id) + '.tmp'
+    try:
+        report = function(store.input_path(job_id), temp_path, *args)
+        os.replace(temp_path, store.result_path(job_id))
+        store.update(job_id, status=DONE, finished=time.time(), report=report)
+    except Exception as e:
+        _remove(temp_path)
+        store.update(job_id, status=FAILED, finished=time.time(), error=str(e))
+        print("Job " + job_id + " failed: " + str(e))
+    finally:
+        _remove(store.input_path(job_id))
+
+
+class JobQueue:
+
+    # initializer(*initargs) is run in each pool process to load whatever state the jobs need
+    def __init__(self, store, workers=DEFAULT_WORKERS, initializer=None):
+        self.store = store
+        self.workers = workers
+        self.initializer = initializer
+        self._executor = None
+        self._state_version = None
+        self._lock = threading.Lock()
+
+    # queues a job. state is (version, initargs) for the pool processes - see executor()
+    def submit(self, job_id, function, args, state):
+        return self.executor(state).submit(run_job, self.store, job_id, function, args)
+
+    # the process pool, for running jobs or other work that needs the same state. state is (version, initargs) for
+    # the pool processes - if the version has changed since the pool was started (eg the schemas have been updated),
+    # a new pool is started
+    def executor(self, state):
+        version, initargs = state
+        with self._lock:
+            if self._executor is None or self._state_version != version:
+                if self._executor is not None:
+                    # work already queued on the old pool still runs, with the state it was submitted with
+                    self._executor.shutdown(wait=False)
+                # pool processes are spawned rather than forked, as forking a process with threads running can
+                # leave locks held in the child
+                self._executor = concurrent.futures.ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'),
+                    initializer=self.initializer, initargs=initargs)
+                self._state_version = version
+            return self._executor
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+
+
+# the status of a job as returned to clients
+def job_status(job):
+    status = dict(job)
+    for field in ('submitted', 'started', 'finished'):
+        if field in status:
+            status[field] = datetime.datetime.fromtimestamp(status[field]).isoformat()
+    return status
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+# Cache of generated spreadsheets and YAML files. Most users pick one of a handful of standard templates, so the
+# same files get generated over and over. Entries are addressed by a hash of the selected tabs and the set of
+# schemas they were generated from, which also doubles as the ETag of the download. Recently used entries are
+# kept in memory, and optionally also on disk so that they survive the memory tier evicting them. The disk tier can
+# be shared by several worker processes.
+#
+# Every key starts with the version of the set of schemas its file was generated from. When the set of latest schemas
+# changes, only the entries of other versions are removed - another worker may have picked up the new schemas first
+# and already cached files generated from them.
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+from schema_catalogue import catalogue_version
+
+
+# the version of a set of schema URLs, which output keys start with
+def output_version(schema_urls):
+    return catalogue_version(schema_urls)[:16]
+
+# helper function to compute the content address of a generated file from the tabs it contains, the set of schema
+# URLs it was generated from and the kind of file (eg xlsx or yaml)
+def output_key(tabs, schema_urls, kind):
+    # only the tab keys, display names and columns end up in the generated file
+    normalised = []
+    for tab in tabs:
+        for key, detail in tab.items():
+            normalised.append([key, detail.get("display_name"), list(detail.get("columns") or [])])
+
+    digest = hashlib.sha256()
+    digest.update(kind.encode('utf-8'))
+    digest.update(b'\n')
+    digest.update(json.dumps(normalised, separators=(',', ':')).encode('utf-8'))
+    return output_version(schema_urls) + '-' + digest.hexdigest()
+
+
+class OutputCache:
+
+    def __init__(self, max_entries=64, max_bytes=64 * 1024 * 1024, disk_dir=None, max_disk_entries=512):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self.max_disk_entries = max_disk_entries
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._entries = OrderedDict()
+        self._size = 0
+        self._schema_version = None
+        self._lock = threading.Lock()
+
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    # removes the files generated from other schemas if the set of latest schemas has changed since it was last called
+    def sync(self, schema_urls):
+        version = output_version(schema_urls)
+        with self._lock:
+            if self._schema_version != version:
+                removed = self._remove_other_versions(version)
+                if self._schema_version is not None:
+                    print("Latest schemas have changed, removed " + str(removed) + " cached files")
+                self._schema_version = version
+
+    def get(self, key):
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+            else:
+                data = self._read_disk(key)
+                if data is not None:
+                    self._put_memory(key, data)
+
+            if data is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return data
+
+    # whether a file of this size would be kept at all - if not, there's no point reading it into memory to put it
+    def accepts(self, size):
+        return bool(self.disk_dir) or size <= self.max_bytes // 2
+
+    def put(self, key, data):
+        with self._lock:
+            self._put_memory(key, data)
+            self._write_disk(key, data)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'bytes': self._size
+            }
+
+    def _put_memory(self, key, data):
+        # files that would take up most of the memory tier on their own are only kept on disk
+        if len(data) > self.max_bytes // 2:
+            return
+
+        if key in self._entries:
+            self._size -= len(self._entries.pop(key))
+        self._entries[key] = data
+        self._size += len(data)
+
+        while len(self._entries) > self.max_entries or self._size > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._size -= len(evicted)
+            self.evictions += 1
+
+    # removes the entries of every version other than the given one, returning how many were removed
+    def _remove_other_versions(self, version):
+        prefix = version + '-'
+        removed = 0
+        for key in [key for key in self._entries if not key.startswith(prefix)]:
+            self._size -= len(self._entries.pop(key))
+            removed += 1
+
+        if self.disk_dir:
+            for name in os.listdir(self.disk_dir):
+                if name.endswith('.cache') and not name.startswith(prefix):
+                    _remove(os.path.join(self.disk_dir, name))
+                    removed += 1
+        return removed
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, key + '.cache')
+
+    def _read_disk(self, key):
+        if not self.disk_dir:
+            return None
+        try:
+            with open(self._disk_path(key), 'rb') as file:
+                data = file.read()
+        except OSError:
+            return None
+        # touch the file so the least recently used files are the ones removed when the disk tier is full
+        os.utime(self._disk_path(key))
+        return data
+
+    def _write_disk(self, key, data):
+        if not self.disk_dir:
+            return
+
+        # write to a temp name and rename so other workers never read a partially written file
+        temp_path = self._disk_path(key) + '.' + str(os.getpid()) + '.tmp'
+        with open(temp_path, 'wb') as file:
+            file.write(data)
+        os.replace(temp_path, self._disk_path(key))
+
+        files = [os.path.join(self.disk_dir, name) for name in os.listdir(self.disk_dir) if name.endswith('.cache')]
+        if len(files) > self.max_disk_entries:
+            files.sort(key=_modified_time)
+            for path in files[:len(files) - self.max_disk_entries]:
+                _remove(path)
+                self.evictions += 1
+
+
+def _modified_time(path):
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return 0
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
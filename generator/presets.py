@@ -0,0 +1,308 @@
+#!/usr/bin/env python
+# Template presets - named selections of tabs and columns for the standard shapes of project (eg sequencing or
+# imaging) that users would otherwise pick out on the schemas page and generate over and over. The spreadsheet and
+# YAML file of every preset are built ahead of time in the job pool whenever the schemas or the config change, so
+# they can be served straight away from /templates/<name>.
+#
+# A preset is defined in the [presets] section of the config file as either a comma separated list of schemas, each
+# of which gets all its properties, or the path of a YAML file of tabs (relative to the config file) for a selection
+# of columns. As soon as a rebuild starts the builds for the old schemas are dropped, so a preset is never served
+# for anything but the latest schemas - until its new build is ready, it is generated on request like any other
+# template.
+#
+# The builds are written to a directory shared by all the worker processes of the app, with a directory per version
+# of the schemas and config. Whichever worker gets the lock file of a version first builds its presets, and the
+# others serve them from there, so each set of presets is only built once. If that worker goes away mid-build its
+# lock is released, and the next worker to look for the presets takes over. Only max_parallel presets are built in
+# the job pool at once, so a rebuild never holds up background jobs for long.
+import concurrent.futures
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import namedtuple
+from urllib.parse import quote
+
+from output_cache import output_key
+from yaml_io import load_tabs
+
+PRESET_EXTENSIONS = ('.yaml', '.yml')
+
+# the files in a version's directory that mark it as being built, and as built
+LOCK_FILE = '.lock'
+DONE_FILE = '.done'
+
+# a built preset. files is {kind: (etag, content)} for the 'xlsx' and 'yaml' files, built is when it was built and
+# seconds how long building it took
+PresetBuild = namedtuple('PresetBuild', ['name', 'version', 'tabs', 'files', 'built', 'seconds'])
+
+
+# the tabs of a preset ({'tabs': [...]}, as in a YAML file of tabs) from its definition in the config file. Raises
+# ValueError if it names a schema that isn't in the catalogue
+def preset_tabs(definition, catalogue, base_dir):
+    definition = (definition or '').strip()
+    if definition.lower().endswith(PRESET_EXTENSIONS):
+        with open(os.path.join(base_dir, definition), 'rb') as file:
+            return load_tabs(file)
+
+    tabs = []
+    for name in definition.split(','):
+        name = name.strip()
+        if not name:
+            continue
+        properties = catalogue.properties(name)
+        if properties is None:
+            raise ValueError(name + " isn't a schema")
+        tabs.append({name: {'display_name': catalogue.display_names.get(name, name),
+                            'columns': [prop for prop, status in properties]}})
+
+    if not tabs:
+        raise ValueError("a preset must list some schemas or a YAML file of tabs")
+    return {'tabs': tabs}
+
+
+class PresetLibrary:
+
+    # directory is shared by all the worker processes of the app - leave it empty to use a directory in the system
+    # temp directory. The builds of other versions are removed max_age seconds after they were made
+    def __init__(self, directory=None, max_parallel=1, max_age=3600):
+        self.directory = directory or os.path.join(tempfile.gettempdir(), 'generator-presets')
+        self.max_parallel = max(1, max_parallel)
+        self.max_age = max_age
+        # the version of the schemas and config the presets are (being) built for
+        self.version = None
+        self._definitions = {}
+        self._builds = {}
+        self._errors = {}
+        # the arguments to build the presets of the current version with, if this process has to build them
+        self._build_args = None
+        self._building = False
+        self._lock = threading.Lock()
+
+    def names(self):
+        with self._lock:
+            return list(self._definitions)
+
+    def definition(self, name):
+        with self._lock:
+            return self._definitions.get(name)
+
+    # the build of a preset for the given version, None if it hasn't been built for it (yet)
+    def get(self, name, version):
+        with self._lock:
+            build = self._builds.get(name)
+            if build is not None or version != self.version or name not in self._definitions:
+                return build if build is not None and build.version == version else None
+
+        # another worker process may have built it
+        build = self._load(name, version)
+        if build is None:
+            self._claim()
+            return None
+        with self._lock:
+            if self.version == version:
+                self._builds[name] = build
+        return build
+
+    # the state of every preset: ready (with when it was built and how long that took), building or failed
+    def status(self):
+        with self._lock:
+            version = self.version
+            names = list(self._definitions)
+
+        status = []
+        for name in names:
+            build = self.get(name, version)
+            if build is not None:
+                status.append({'name': name, 'status': 'ready', 'tabs': len(build.tabs['tabs']),
+                               'built': build.built, 'build_seconds': round(build.seconds, 3)})
+                continue
+            error = self._error(name, version)
+            if error is not None:
+                status.append({'name': name, 'status': 'failed', 'error': error})
+            else:
+                status.append({'name': name, 'status': 'building'})
+        return status
+
+    # rebuilds the presets ({name: definition}) if the version of the schemas and config has changed since they were
+    # last built, unless another worker process is building them or has built them already. Each preset is built by
+    # function(tabs, latest_schemas) in a pool process of executor, which returns the content of its spreadsheet and
+    # YAML file. Returns whether the version changed
+    def sync(self, version, definitions, catalogue, latest_schemas, base_dir, executor, function):
+        with self._lock:
+            if version == self.version:
+                return False
+            self.version = version
+            self._definitions = dict(definitions)
+            self._builds = {}
+            self._errors = {}
+            self._build_args = None
+            if definitions:
+                self._build_args = (version, dict(definitions), catalogue, list(latest_schemas), base_dir, executor,
+                                    function)
+
+        self._claim()
+        return True
+
+    # helper function to start building the presets of the current version in a background thread, if they haven't
+    # been built and no other process (or thread) is building them
+    def _claim(self):
+        with self._lock:
+            build_args = self._build_args
+            if build_args is None or self._building:
+                return
+            version_dir = self._version_dir(build_args[0])
+            if os.path.exists(os.path.join(version_dir, DONE_FILE)):
+                return
+
+            try:
+                os.makedirs(version_dir, exist_ok=True)
+                lock_file = open(os.path.join(version_dir, LOCK_FILE), 'a')
+            except OSError as e:
+                print("Couldn't open the template preset directory " + version_dir + ": " + str(e))
+                return
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                # another process is building them
+                lock_file.close()
+                return
+            # they may have been finished between looking and getting the lock
+            if os.path.exists(os.path.join(version_dir, DONE_FILE)):
+                lock_file.close()
+                return
+            self._building = True
+
+        threading.Thread(target=self._build_all, name='preset-build', daemon=True,
+                         args=(lock_file,) + build_args).start()
+
+    def _build_all(self, lock_file, version, definitions, catalogue, latest_schemas, base_dir, executor, function):
+        try:
+            self._build_each(version, definitions, catalogue, latest_schemas, base_dir, executor, function)
+        except Exception as e:
+            print("Couldn't build the template presets: " + str(e))
+        finally:
+            with self._lock:
+                self._building = False
+            # closing the file releases the lock
+            lock_file.close()
+
+    def _build_each(self, version, definitions, catalogue, latest_schemas, base_dir, executor, function):
+        start = time.perf_counter()
+        pending = list(definitions.items())
+        futures = {}
+        built = 0
+        while pending or futures:
+            # only a few presets at a time go into the job pool, so that jobs queued meanwhile get a look in
+            while pending and len(futures) < self.max_parallel:
+                name, definition = pending.pop(0)
+                try:
+                    tabs = preset_tabs(definition, catalogue, base_dir)
+                    futures[executor.submit(function, tabs, latest_schemas)] = (name, tabs)
+                except Exception as e:
+                    self._failed(version, name, e)
+            if not futures:
+                continue
+
+            done, _ = concurrent.futures.wait(futures, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                name, tabs = futures.pop(future)
+                try:
+                    xlsx, yaml_content, seconds = future.result()
+                except Exception as e:
+                    self._failed(version, name, e)
+                    continue
+
+                files = {
+                    'xlsx': (output_key(tabs['tabs'], latest_schemas, 'xlsx'), xlsx),
+                    'yaml': (output_key(tabs['tabs'], latest_schemas, 'yaml'), yaml_content)
+                }
+                build = PresetBuild(name, version, tabs, files, time.time(), seconds)
+                self._save(build)
+                with self._lock:
+                    # the schemas or config may have changed again while it was building
+                    if self.version != version:
+                        return
+                    self._builds[name] = build
+                built += 1
+
+        _write_file(os.path.join(self._version_dir(version), DONE_FILE), b'')
+        print("Built " + str(built) + " of " + str(len(definitions)) + " template presets in "
+              + str(round(time.perf_counter() - start, 2)) + "s")
+        self._sweep(version)
+
+    def _failed(self, version, name, e):
+        print("Template preset " + name + " couldn't be built: " + str(e))
+        try:
+            _write_file(self._path(version, name, '.error'), str(e).encode('utf-8'))
+        except OSError:
+            pass
+        with self._lock:
+            if self.version == version:
+                self._errors[name] = str(e)
+
+    def _error(self, name, version):
+        with self._lock:
+            if name in self._errors:
+                return self._errors[name]
+        try:
+            with open(self._path(version, name, '.error'), encoding='utf-8') as file:
+                return file.read()
+        except OSError:
+            return None
+
+    # helper function to write a build to the preset directory - its files first and then its details, so a build
+    # whose details can be read has all its files
+    def _save(self, build):
+        try:
+            for kind, (etag, content) in build.files.items():
+                _write_file(self._path(build.version, build.name, '.' + kind), content)
+            details = {'tabs': build.tabs, 'etags': dict((kind, etag) for kind, (etag, content) in build.files.items()),
+                       'built': build.built, 'seconds': build.seconds}
+            _write_file(self._path(build.version, build.name, '.json'), json.dumps(details).encode('utf-8'))
+        except OSError as e:
+            print("Couldn't save template preset " + build.name + ": " + str(e))
+
+    # helper function to read a build from the preset directory, None if it isn't there
+    def _load(self, name, version):
+        try:
+            with open(self._path(version, name, '.json'), encoding='utf-8') as file:
+                details = json.load(file)
+            files = {}
+            for kind, etag in details['etags'].items():
+                with open(self._path(version, name, '.' + kind), 'rb') as file:
+                    files[kind] = (etag, file.read())
+        except (OSError, ValueError, KeyError):
+            return None
+        return PresetBuild(name, version, details['tabs'], files, details['built'], details['seconds'])
+
+    # helper function to remove the builds of other versions once they are older than max_age - until then, worker
+    # processes that haven't seen the new schemas or config yet can still serve them
+    def _sweep(self, version):
+        current = os.path.basename(self._version_dir(version))
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                if name != current and time.time() - os.path.getmtime(path) > self.max_age:
+                    shutil.rmtree(path)
+            except OSError:
+                pass
+
+    def _version_dir(self, version):
+        return os.path.join(self.directory, hashlib.sha1(version.encode('utf-8')).hexdigest()[:16])
+
+    def _path(self, version, name, extension):
+        return os.path.join(self._version_dir(version), quote(name, safe='') + extension)
+
+
+# helper function to write a file whole - it is written to a temp file and renamed, so other processes never read a
+# half written file
+def _write_file(path, content):
+    temp_path = path + '.' + str(os.getpid()) + '.' + str(threading.get_ident()) + '.tmp'
+    with open(temp_path, 'wb') as file:
+        file.write(content)
+    os.replace(temp_path, path)
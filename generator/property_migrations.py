@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# The property migrations of the schemas compiled into a graph from each property of an older schema version to
+# where it ended up in the latest schemas. Properties can be renamed more than once across schema versions, so
+# every chain of renames is followed to its end once, when the graph is built, and looking up an old property is a
+# dictionary read rather than walking the chain (and catching the schema template library's exceptions) every time.
+#
+# It is built with the schema catalogue and used wherever old property names have to be mapped onto the latest
+# schemas - migrating spreadsheets and preselecting the properties of an uploaded YAML file.
+
+# what an old property migrates to when it was removed from the schemas rather than renamed
+DELETED = object()
+
+
+class PropertyMigrations:
+
+    # property_migrations are the migrations as listed in the property migrations file. properties are the
+    # {schema: {property: attributes}} dictionaries of the schema template (its metadata and custom properties,
+    # which include the uuid of every schema), whose paths are the properties of the latest schemas. The paths keep
+    # their case, as in the spreadsheets - the schema template's labels have them lowercased
+    def __init__(self, property_migrations, *properties):
+        current = set()
+        for schema_properties in properties:
+            for schema_name, attributes in schema_properties.items():
+                _add_paths(attributes, schema_name, current)
+        self.current = frozenset(current)
+
+        replaced_by = {}
+        for migration in property_migrations or []:
+            source = migration["source_schema"] + "." + migration["property"]
+            if "target_schema" in migration and "replaced_by" in migration:
+                replaced_by[source] = migration["target_schema"] + "." + migration["replaced_by"]
+            else:
+                replaced_by[source] = DELETED
+
+        # follow each chain of renames to its end, pointing every property along the way straight at the end of it
+        self._latest = {}
+        circular = set()
+        for source in replaced_by:
+            chain = []
+            key = source
+            while key in replaced_by and key not in self._latest and key not in chain and key not in circular:
+                chain.append(key)
+                key = replaced_by[key]
+
+            if key in chain or key in circular:
+                if key in chain:
+                    print("Property migrations of " + key + " go round in a circle, ignoring them")
+                circular.update(chain)
+                continue
+            latest = self._latest.get(key, key)
+            for key in chain:
+                self._latest[key] = latest
+
+    def __len__(self):
+        return len(self._latest)
+
+    # whether a property is in the latest schemas, so doesn't need migrating
+    def is_current(self, key):
+        return key in self.current
+
+    # the property an old property has become in the latest schemas, DELETED if it was removed, or None if it was
+    # never migrated. Properties under a migrated property (eg the text field of an ontology) move with it
+    def lookup(self, key):
+        latest = self._latest.get(key)
+        if latest is not None:
+            return latest
+
+        path = key.split('.')
+        for end in range(len(path) - 1, 1, -1):
+            latest = self._latest.get('.'.join(path[:end]))
+            if latest is DELETED:
+                return DELETED
+            if latest is not None:
+                return latest + '.' + '.'.join(path[end:])
+        return None
+
+
+# helper function to add the path of every property under path in a dictionary of property attributes to paths
+def _add_paths(attributes, path, paths):
+    for key, value in attributes.items():
+        # the schema of a module is a description of it rather than a property
+        if isinstance(value, dict) and key != 'schema':
+            paths.add(path + '.' + key)
+            _add_paths(value, path + '.' + key, paths)
@@ -0,0 +1,396 @@
+#!/usr/bin/env python
+# The schema catalogue is the list of schemas and their properties as presented in the generator UI.
+# Building it means walking every tab in the schema template and applying the linking and ordering rules
+# from the config file, so it is built once per set of latest schemas and then shared between requests.
+# The shared version is read-only - each request gets a cheap copy-on-write view it can mark up instead.
+#
+# When only some schemas change version, a new catalogue can be built from the previous one: only the changed
+# schemas are resolved against the schema template again, and everything that doesn't come out different (including
+# the spreadsheet column headers of unchanged schemas) is carried over from the previous catalogue.
+#
+# The catalogue also holds the module references of each schema shown on the preselection page, which likewise
+# only depend on the set of latest schemas.
+import hashlib
+from collections import ChainMap, namedtuple
+from types import MappingProxyType
+
+from column_index import ColumnHeaderIndex
+from property_migrations import DELETED, PropertyMigrations
+from schema_index import split_schema_url
+
+# properties of a schema that are never offered as references on the preselection page
+EXCLUDED_PROPERTIES = ["describedBy", "schema_version", "schema_type", "provenance"]
+
+
+# helper function to compute a stable version key for a set of schema URLs
+def catalogue_version(schema_urls):
+    digest = hashlib.sha1()
+    for url in sorted(set(schema_urls)):
+        digest.update(url.encode('utf-8'))
+        digest.update(b'\n')
+    return digest.hexdigest()
+
+
+# the properties of a schema that can be preselected, by how they get selected. optional is every "not required"
+# property, top_level the optional ones directly on the schema (eg donor_organism.genus_species) other than
+# appended process fields, and modules the optional ones under each module or core name (the second part of the
+# property path, eg biomaterial_core)
+PropertyIndex = namedtuple('PropertyIndex', ['properties', 'optional', 'top_level', 'modules'])
+
+_NO_PROPERTIES = frozenset()
+
+
+class SchemaCatalogue:
+
+    # resolved is {schema name: (schema URL, schema as resolved from the schema template)}, for building the next
+    # catalogue from this one. Schemas that are the same as in the previous catalogue share its read-only copy
+    # and property index. references are the schemas as shown on the preselection page, in page order, each with
+    # the modules it references
+    def __init__(self, schema_urls, schemas, display_names, column_headers, config=None, resolved=None,
+                 previous=None, references=(), migrations=None):
+        self.schema_urls = frozenset(schema_urls)
+        self.version = catalogue_version(self.schema_urls)
+        self.display_names = MappingProxyType(dict(display_names))
+        # spreadsheet header rows for every column, and where old properties have moved to in the latest schemas,
+        # used when migrating spreadsheets
+        self.column_headers = column_headers
+        self.migrations = migrations if migrations is not None else PropertyMigrations([])
+        self.config = config
+        self.resolved = MappingProxyType(dict(resolved or {}))
+
+        frozen_schemas = []
+        # index of the properties of every schema, so preselecting properties is a few set operations per schema
+        property_index = {}
+        for schema in schemas:
+            name = schema["name"]
+            unchanged = previous._schemas_by_name.get(name) if previous is not None else None
+            if unchanged is not None and _same_schema(unchanged, schema):
+                frozen_schemas.append(unchanged)
+                property_index[name] = previous.property_index[name]
+            else:
+                frozen_schemas.append(_freeze_schema(schema))
+                property_index[name] = _index_properties(schema["properties"])
+
+        self.schemas = tuple(frozen_schemas)
+        self.property_index = MappingProxyType(property_index)
+        self._schemas_by_name = dict((schema["name"], schema) for schema in self.schemas)
+
+        self.references = tuple(references)
+        self._references_by_name = dict((schema["name"], schema) for schema in self.references)
+
+    # the name, title and number of properties of every schema, in page order
+    def summaries(self):
+        return [{"name": schema["name"], "title": schema["title"], "properties": len(schema["properties"])}
+                for schema in self.schemas]
+
+    # the properties of a schema as [property, "required" or "not required"] pairs, in page order, or None if there
+    # is no such schema
+    def properties(self, name):
+        schema = self._schemas_by_name.get(name)
+        if schema is None:
+            return None
+        return [[prop, status] for prop, status in schema["properties"].items()]
+
+    # returns a per-request view of the catalogue - writes to a schema or its properties (eg "pre-selected"
+    # flags) only land in the view's own top layer, reads fall through to the shared catalogue
+    def view(self):
+        return [ChainMap({"properties": ChainMap({}, schema["properties"])}, schema) for schema in self.schemas]
+
+    # returns a view of the catalogue with the given schemas and properties marked as preselected.
+    # selected_references are "schema:module" and select the module's optional properties, together with the
+    # schema's own top level optional properties, of both the schema and the module's tab.
+    # selected_properties are {schema: [property]} - properties of older schema versions are migrated to the latest
+    # ones, and properties not in the schema at all are added to it as preselected.
+    def preselect(self, selected_schemas, selected_references, selected_properties):
+        schema_properties = self.view()
+        selected_schemas = set(selected_schemas)
+
+        # the modules each schema has references to, keyed by both the referencing schema and the module
+        referenced_modules = {}
+        for ref in selected_references or ():
+            parts = ref.split(':')
+            referenced_modules.setdefault(parts[0], set()).add(parts[1])
+            referenced_modules.setdefault(parts[1], set()).add(parts[1])
+
+        for schema in schema_properties:
+            name = schema["name"]
+            if name not in selected_schemas:
+                continue
+
+            schema["pre-selected"] = True
+            index = self.property_index[name]
+            properties = schema["properties"]
+
+            preselected = set()
+            modules = referenced_modules.get(name)
+            if modules:
+                preselected.update(index.top_level)
+                for module in modules:
+                    preselected.update(index.modules.get(module, _NO_PROPERTIES))
+
+            if selected_properties and name in selected_properties:
+                for prop in selected_properties[name]:
+                    # eg a YAML file generated from older schemas, whose properties may have been renamed or deleted
+                    if prop not in index.properties and not self.migrations.is_current(prop):
+                        migrated = self.migrations.lookup(prop)
+                        if migrated is DELETED:
+                            continue
+                        if migrated is not None:
+                            prop = migrated
+
+                    # Required properties will be pre-selected anyway so don't need to be marked again
+                    if prop in index.optional:
+                        preselected.add(prop)
+                    # This clause deals with linking properties etc, and properties that aren't in the latest
+                    # schemas or the migrations
+                    elif prop not in index.properties:
+                        properties[prop] = "pre-selected"
+
+            for prop in preselected:
+                properties[prop] = "pre-selected"
+
+        return schema_properties
+
+
+# builds the catalogue for a schema template, using the blacklist, linking and ordering rules of the compiled config
+# (see generator_config.py). If previous is the catalogue for an earlier version of the schemas (built with the same
+# config), only the schemas whose URL has changed are resolved again
+def build_catalogue(schema_template, config, previous=None):
+    if previous is not None and previous.config is not config:
+        previous = None
+    previously_resolved = previous.resolved if previous is not None else {}
+
+    resolved = _resolve_schemas(schema_template, config.excluded_schemas, previously_resolved)
+    schemas, display_names = _process_schemas(resolved, schema_template, config)
+
+    # the column headers and references of a schema only depend on the schema itself, so those of unchanged schemas
+    # carry over
+    unchanged = [name for name, entry in resolved.items() if previously_resolved.get(name) is entry]
+    column_headers = ColumnHeaderIndex(schema_template, previous.column_headers if previous is not None else None,
+                                       unchanged)
+    references = _extract_references(resolved, schema_template, config,
+                                     previous._references_by_name if previous is not None else {}, unchanged)
+
+    migrations = PropertyMigrations(schema_template.property_migrations, schema_template.meta_data_properties,
+                                    schema_template.custom_properties)
+
+    return SchemaCatalogue(schema_template.metadata_schema_urls, schemas, display_names, column_headers, config,
+                           resolved, previous, references, migrations)
+
+
+def _index_properties(properties):
+    optional = set()
+    top_level = set()
+    modules = {}
+    for prop, status in properties.items():
+        if status != "not required":
+            continue
+        optional.add(prop)
+        path = prop.split('.')
+        if len(path) == 2 and path[0] != 'process':
+            top_level.add(prop)
+        if len(path) > 1:
+            modules.setdefault(path[1], set()).add(prop)
+
+    return PropertyIndex(frozenset(properties), frozenset(optional), frozenset(top_level),
+                         MappingProxyType(dict((module, frozenset(props)) for module, props in modules.items())))
+
+
+def _same_schema(frozen, schema):
+    return frozen["title"] == schema["title"] \
+        and list(frozen["properties"].items()) == list(schema["properties"].items())
+
+
+def _freeze_schema(schema):
+    frozen = dict(schema)
+    frozen["properties"] = MappingProxyType(dict(schema["properties"]))
+    return MappingProxyType(frozen)
+
+
+# helper function to resolve the properties of each schema in the tab config against the schema template, as
+# {schema name: (schema URL, properties as presented in the UI)}. Schemas at the same URL as in previously_resolved
+# aren't resolved again
+def _resolve_schemas(schema_template, excluded_schemas, previously_resolved):
+    schema_urls = {}
+    for url in schema_template.metadata_schema_urls or []:
+        schema_urls[split_schema_url(url)[0]] = url
+
+    resolved = {}
+    # go through the schemas from the tab config one by one
+    for schema in schema_template.tabs:
+        schema_name = list(schema.keys())[0]
+        if schema_name in excluded_schemas:
+            continue
+
+        url = schema_urls.get(schema_name)
+        previous = previously_resolved.get(schema_name)
+        if url is not None and previous is not None and previous[0] == url:
+            resolved[schema_name] = previous
+        else:
+            resolved[schema_name] = (url, _resolve_schema(schema_template, schema_name, schema[schema_name]))
+
+    return resolved
+
+
+# helper function to convert the properties of a schema as presented in the schema template library
+# to a format readable by the generator UI
+def _resolve_schema(schema_template, schema_name, tab):
+    property = {}
+
+    # set the schema title, name and selection status
+    property["title"] = tab["display_name"]
+    property["name"] = schema_name
+    property["select"] = False
+    property["properties"] = {}
+
+    # go through all the properties in the schema
+    for p in tab['columns']:
+        # this deals with core and module properties
+        if len(p.split(".")) > 2:
+            parent = ".".join(p.split(".")[:-1])
+
+            # special case for modules with ontology imports where the field is required if the module is used,
+            # eg donor.timecourse.unit.text
+            if len(p.split(".")) == 4:
+                if schema_template.lookup_property_from_template(parent)["required"]:
+                    parent = ".".join(parent.split(".")[:-1])
+            if schema_template.lookup_property_from_template(parent)["required"]:
+                if schema_template.lookup_property_from_template(p)["required"]:
+                    property["properties"][p] = "required"
+                else:
+                    property["properties"][p] = "not required"
+            else:
+                property["properties"][p] = "not required"
+        else:
+            if schema_template.lookup_property_from_template(p)["required"]:
+                property["properties"][p] = "required"
+            else:
+                property["properties"][p] = "not required"
+
+    return property
+
+
+# helper function to apply the linking and ordering rules in the config file to the resolved schemas, returning
+# the schemas in page order and a map of schema name to title. The resolved schemas are left as they are
+def _process_schemas(resolved, schema_template, config):
+
+    # dictionary of schema to tab names
+    # as tab names can be hard to get hold of from the schema template library,esp for sub-tabs
+    display_names = {}
+
+    unordered = {}
+    all_properties = []
+    process = {}
+    for _, resolved_schema in resolved.values():
+        property = dict(resolved_schema, properties=dict(resolved_schema["properties"]))
+
+        # create a separate process object for appending to other properties below
+        if property["name"] == "process":
+            process = property["properties"]
+            for k in process.keys():
+                if process[k] == "required":
+                    process[k] = "not required"
+
+        unordered[property["name"]] = property
+
+        # add the title of the schema to the display name map
+        display_names[property["name"]] = property["title"]
+
+    # add default biomaterial and protocol linking columns
+    for links in (config.biomaterial_linking, config.protocol_linking):
+        for key, linked in links.items():
+            if key in unordered.keys():
+                for linked_schema in linked:
+                    if linked_schema in unordered.keys():
+                        linking_field = list(unordered[linked_schema]['properties'].keys())[0]
+                        unordered[key]['properties'][linking_field] = "not required"
+
+    # schemas should be ordered as per the ordering in the config file
+    for tab in config.ordering:
+        key = tab.key
+        if key in unordered.keys():
+            # if the schema should have process fields appended according to the config file, append these
+            if tab.parent == 'process' and process:
+                unordered[key]["properties"].update(process)
+
+            all_properties.append(unordered[key])
+        # deal with sub-tabs
+        elif tab.parent:
+            parent = tab.parent
+            # eg a blacklisted biomaterial, which is ordered after process but isn't one of its properties
+            if parent in unordered.keys() and key in schema_template.lookup_property_from_template(parent):
+                new_property = {}
+                new_property["title"] = schema_template.lookup_property_from_template(parent)[key]['user_friendly']
+
+                # tabs can't have a name that's longer than 32 characteres
+                if len(display_names[parent] + " - " + new_property["title"]) < 32:
+                    new_property["title"] = display_names[parent] + " - " + new_property["title"]
+                new_property["name"] = key
+                new_property["select"] = False
+                new_property["properties"] = {}
+
+                for prop in unordered[parent]['properties']:
+                    if key in prop:
+                        new_property["properties"][prop] = unordered[parent]['properties'][prop]
+
+                for moved_prop in new_property["properties"]:
+                    unordered[parent]['properties'].pop(moved_prop)
+
+                display_names[new_property["name"]] = new_property["title"]
+
+                all_properties.append(new_property)
+
+                print(key + " is a recorded sub-property")
+        # anything else in the ordering that isn't a schema is reported when the config is loaded
+
+    return all_properties, display_names
+
+
+# helper function to extract the $ref properties (core and module references) of each schema for the preselection
+# page, in the order of the config file. The references of unchanged schemas are taken from previous_references
+def _extract_references(resolved, schema_template, config, previous_references, unchanged):
+    unchanged = set(unchanged)
+
+    references = []
+    for tab in config.ordering:
+        if tab.key not in resolved:
+            continue
+        if tab.key in unchanged and tab.key in previous_references:
+            references.append(previous_references[tab.key])
+            continue
+
+        resolved_schema = resolved[tab.key][1]
+        schema = schema_template.lookup_property_attributes_in_metadata(tab.key)
+        references.append(_schema_references(resolved_schema["properties"], tab.key, resolved_schema["title"], schema))
+
+    return references
+
+
+# helper function to extract the $ref properties (core and module references) from a schema
+def _schema_references(properties, name, title, schema):
+
+    # direct property = properties of the schema (incl wrapper properties for imports)
+    direct_properties = []
+    for property in properties:
+        prop = property.split('.')[1]
+        direct_properties.append(prop)
+
+    structure = {}
+    structure["title"] = title
+    structure["name"] = name
+
+    references = {}
+
+    for dp in direct_properties:
+        if dp not in EXCLUDED_PROPERTIES:
+            # if the property exists and has a 'value_type' field and 'value_type' is an object and
+            # the property isn't already on the list of references
+            if schema[dp] and schema[dp]['value_type'] \
+                    and schema[dp]['value_type'] == 'object' \
+                    and dp not in references.keys():
+                if schema[dp]['required']:
+                    references[dp] = "required"
+                else:
+                    references[dp] = "not required"
+    structure["references"] = MappingProxyType(references)
+    return MappingProxyType(structure)
@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+# Index from schema key (eg donor_organism) to the latest URL and version of that schema, its tab name and the
+# sub-tabs that hang off it (eg Project - Contributors). It is built once per set of latest schemas so that
+# spreadsheet migration can dispatch on an exact dictionary lookup rather than substring matches on URLs.
+from collections import namedtuple
+
+LatestSchema = namedtuple('LatestSchema', ['key', 'url', 'version', 'tab_name', 'linked_tabs'])
+
+# a sub-tab can be named either by its own title or, if that fits, "Parent title - Sub-tab title"
+LinkedTab = namedtuple('LinkedTab', ['key', 'tab_name', 'full_tab_name'])
+
+
+# the key and version of a schema URL, eg https://schema.humancellatlas.org/type/project/14.0.0/project
+def split_schema_url(url):
+    parts = url.rstrip('/').split('/')
+    return parts[-1], parts[-2]
+
+
+class SchemaUrlIndex:
+
+    def __init__(self, schema_urls, schema_template, config):
+        latest_urls = {}
+        for url in schema_urls:
+            latest_urls[split_schema_url(url)[0]] = url
+
+        # keep the order of the tab config so migrations run in the same order as before
+        self.schemas = {}
+        for tab in schema_template.tabs:
+            for key, detail in tab.items():
+                if key not in latest_urls:
+                    continue
+
+                url = latest_urls[key]
+                tab_name = detail['display_name']
+                properties = schema_template.lookup_property_from_template(key)
+
+                # sub-tabs are entries in the ordering section whose parent is another schema
+                linked_tabs = []
+                for child in config.children.get(key, ()):
+                    # schemas that are only ordered after this one (eg biomaterials after process) aren't sub-tabs
+                    if child not in properties:
+                        continue
+                    child_name = properties[child]['user_friendly']
+                    full_name = tab_name + " - " + child_name
+                    linked_tabs.append(LinkedTab(child, child_name, full_name if len(full_name) < 32 else child_name))
+
+                self.schemas[key] = LatestSchema(key, url, split_schema_url(url)[1], tab_name, tuple(linked_tabs))
+
+    def __contains__(self, key):
+        return key in self.schemas
+
+    def get(self, key):
+        return self.schemas.get(key)
+
+    def values(self):
+        return self.schemas.values()
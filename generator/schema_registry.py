@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+# Registry of the latest submittable schema URLs from the Ingest API. Asking the API for these is a remote round
+# trip, so rather than doing it in the middle of every request the registry refreshes the list in a background
+# thread every ttl seconds and requests are served whatever it last fetched. If the API is slow or down, the
+# previous list keeps being served until a refresh succeeds.
+import datetime
+import threading
+
+from ingest.api.ingestapi import IngestApi
+
+from schema_catalogue import catalogue_version
+from schema_index import split_schema_url
+
+
+# helper function to fetch the latest submittable schema URLs from the Ingest API, the same way the schema template
+# library does
+def fetch_latest_schema_urls(api_url):
+    ingest_api = IngestApi(url=api_url)
+    schemas = ingest_api.get_schemas(high_level_entity="type", latest_only=True)
+    return [schema["_links"]["json-schema"]["href"] for schema in schemas]
+
+
+class SchemaRegistry:
+
+    # on_refresh(schema_urls) is called after every successful refresh, eg to load any schemas that have changed. If
+    # it raises an exception, that is recorded in last_error and the registry carries on
+    def __init__(self, api_url, ttl=300, schema_urls=None, fetch=fetch_latest_schema_urls, on_refresh=None):
+        self.api_url = api_url
+        self.ttl = ttl
+        self._fetch = fetch
+        self._on_refresh = on_refresh
+
+        self.updated = None
+        self.last_error = None
+        self._schema_urls = None
+        self._version = None
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+        if schema_urls:
+            self._set(schema_urls)
+
+    # the latest schema URLs - only blocks on the Ingest API if nothing has ever been fetched
+    def schema_urls(self):
+        if self._schema_urls is None:
+            with self._lock:
+                if self._schema_urls is None:
+                    self._set(self._fetch(self.api_url))
+        return self._schema_urls
+
+    # a stable key for the current set of latest schemas, changes whenever any schema changes version
+    @property
+    def version(self):
+        self.schema_urls()
+        return self._version
+
+    # the current latest version of each schema as {schema key: version}
+    def versions(self):
+        versions = {}
+        for url in self.schema_urls():
+            key, version = split_schema_url(url)
+            versions[key] = version
+        return versions
+
+    # fetches the latest schema URLs, keeping the current ones if the Ingest API can't be reached.
+    # Returns whether the set of latest schemas changed
+    def refresh(self):
+        try:
+            schema_urls = self._fetch(self.api_url)
+        except Exception as e:
+            self.last_error = str(e)
+            print("Couldn't refresh the latest schemas, keeping the current ones: " + str(e))
+            return False
+
+        if not schema_urls:
+            self.last_error = "No schemas returned"
+            print("No schemas returned from the Ingest API, keeping the current ones")
+            return False
+
+        self.last_error = None
+        with self._lock:
+            changed = self._version != catalogue_version(schema_urls)
+            self._set(schema_urls)
+        if changed:
+            print("Latest schemas updated, version " + self._version)
+        if self._on_refresh is not None:
+            try:
+                self._on_refresh(self._schema_urls)
+            except Exception as e:
+                self.last_error = str(e)
+                print("Couldn't load the refreshed latest schemas: " + str(e))
+        return changed
+
+    # starts refreshing the latest schemas in a background thread every ttl seconds
+    def start(self):
+        if self._thread is None and self.ttl > 0:
+            self._thread = threading.Thread(target=self._run, name='schema-registry', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stopped.wait(self.ttl):
+            # an error here would end the thread, and the latest schemas would never be refreshed again
+            try:
+                self.refresh()
+            except Exception as e:
+                self.last_error = str(e)
+                print("Couldn't refresh the latest schemas: " + str(e))
+
+    def _set(self, schema_urls):
+        # replaced as a whole so readers never see a half updated list
+        self._schema_urls = tuple(schema_urls)
+        self._version = catalogue_version(self._schema_urls)
+        self.updated = datetime.datetime.now()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# Snapshots of the schemas the generator runs on. Loading the schema template live means fetching every schema
+# and the property migrations over the network, which is slow and stops the app from starting if the Ingest API or
+# schema server is having a bad day. A snapshot file holds the JSON of every latest schema and the property
+# migrations, so the schema template (and from it the tab config and migrations) can be rebuilt without any network
+# access. Snapshots are written with: python schema_snapshot.py -c config.ini -o schemas.snapshot
+#
+# The file starts with a line identifying it and its format version, followed by a line of JSON describing the
+# snapshot, followed by the snapshot itself as zlib compressed JSON. Format 1 snapshots held the schemas as a pickle,
+# which isn't safe to load from a file that might have been tampered with - they have to be written again.
+import argparse
+import datetime
+import json
+import zlib
+
+from ingest.template.schema_template import SchemaTemplate
+
+from schema_catalogue import catalogue_version
+
+SNAPSHOT_MAGIC = b'HCA-SCHEMA-SNAPSHOT'
+SNAPSHOT_FORMAT_VERSION = 2
+
+MIGRATIONS_URL = 'https://schema.humancellatlas.org/property_migrations'
+
+
+class SnapshotException(Exception):
+    pass
+
+
+# writes a snapshot of a schema template to path
+def save_snapshot(path, schema_template, api_url=''):
+    schema_urls = list(schema_template.metadata_schema_urls)
+    header = {
+        'created': datetime.datetime.now().isoformat(),
+        'api_url': api_url,
+        'schemas': len(schema_urls),
+        'version': catalogue_version(schema_urls)
+    }
+    payload = {
+        'schema_urls': schema_urls,
+        'json_schemas': schema_template.json_schemas,
+        'property_migrations': schema_template.property_migrations
+    }
+
+    with open(path, 'wb') as file:
+        file.write(SNAPSHOT_MAGIC + b' ' + str(SNAPSHOT_FORMAT_VERSION).encode('ascii') + b'\n')
+        file.write(json.dumps(header).encode('utf-8') + b'\n')
+        file.write(zlib.compress(json.dumps(payload, separators=(',', ':')).encode('utf-8')))
+
+    return header
+
+
+# reads just the description of a snapshot, without loading the schemas
+def read_snapshot_header(path):
+    with open(path, 'rb') as file:
+        return _read_header(file)
+
+
+# loads the schema template from a snapshot
+def load_snapshot(path):
+    with open(path, 'rb') as file:
+        header = _read_header(file)
+        try:
+            payload = json.loads(zlib.decompress(file.read()))
+        except Exception as e:
+            raise SnapshotException("Snapshot " + path + " is corrupt: " + str(e))
+
+    schema_template = SchemaTemplate(json_schema_docs=payload['json_schemas'],
+                                     property_migrations=payload['property_migrations'])
+    # the schema template takes the URLs from the schemas' ids, keep the URLs they were actually fetched from
+    schema_template.metadata_schema_urls = payload['schema_urls']
+
+    print("Loaded " + str(header['schemas']) + " schemas from snapshot " + path + " created " + header['created'])
+    return schema_template
+
+
+def _read_header(file):
+    first_line = file.readline().split()
+    if len(first_line) != 2 or first_line[0] != SNAPSHOT_MAGIC:
+        raise SnapshotException("Not a schema snapshot file")
+    if int(first_line[1]) != SNAPSHOT_FORMAT_VERSION:
+        raise SnapshotException("Unsupported schema snapshot format " + first_line[1].decode('ascii')
+                                + ", write a new snapshot with schema_snapshot.py")
+    return json.loads(file.readline())
+
+
+# command line tool to fetch the latest schemas for the environment in the config file and write a snapshot of them
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Write a snapshot of the latest schemas for offline start-up")
+    parser.add_argument('-c', '--config', default='config.ini', help="config file to take the environment from")
+    parser.add_argument('-o', '--output', default='schemas.snapshot', help="snapshot file to write")
+    args = parser.parse_args()
+
+    # the Ingest API URL for the environment is worked out the same way as the app does it
+    import template_generator
+    from generator_config import load_config
+    template_generator.CONFIG = load_config(args.config)
+    api_url = template_generator.get_ingest_api_url()
+
+    template = SchemaTemplate(ingest_api_url=api_url, migrations_url=MIGRATIONS_URL)
+    header = save_snapshot(args.output, template, api_url)
+    print("Wrote " + str(header['schemas']) + " schemas from " + api_url + " to " + args.output)
@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+# Scratch space for uploaded files and the spreadsheets generated or migrated from them while a request is handled.
+# Each scratch file is kept in memory until it grows past a threshold, then moved to a uniquely named file in the
+# scratch directory, so concurrent requests never share a file. All the scratch files of a process count towards a
+# byte quota - a write that would go over it fails with a ScratchQuotaException rather than filling up the disk.
+#
+# A scratch file is removed as soon as it is closed, whether the request it was for succeeded or not. Files that are
+# left behind anyway (eg by a process that was killed) are removed by a background sweeper once they are older than
+# max_age. The store keeps counts of its usage for /metrics.
+import io
+import os
+import threading
+import time
+import uuid
+
+SCRATCH_PREFIX = 'scratch-'
+
+
+class ScratchQuotaException(Exception):
+    pass
+
+
+class ScratchStore:
+
+    def __init__(self, directory, spool_max_size=8 * 1024 * 1024, quota=2 * 1024 * 1024 * 1024, max_age=3600,
+                 sweep_interval=300):
+        self.directory = directory
+        self.spool_max_size = spool_max_size
+        self.quota = quota
+        self.max_age = max_age
+        self.sweep_interval = sweep_interval
+
+        self.files = 0
+        self.memory_bytes = 0
+        self.disk_bytes = 0
+        self.rollovers = 0
+        self.rejections = 0
+        self.swept = 0
+
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+        os.makedirs(directory, exist_ok=True)
+
+    # a new, empty scratch file, open for reading and writing
+    def spool(self):
+        with self._lock:
+            self.files += 1
+        return ScratchFile(self)
+
+    def stats(self):
+        with self._lock:
+            return {'files': self.files, 'memory_bytes': self.memory_bytes, 'disk_bytes': self.disk_bytes,
+                    'quota_bytes': self.quota, 'rollovers': self.rollovers, 'rejections': self.rejections,
+                    'swept': self.swept}
+
+    # removes scratch files older than max_age from the scratch directory, returning how many were removed
+    def sweep(self):
+        cutoff = time.time() - self.max_age
+        removed = 0
+        for entry in os.scandir(self.directory):
+            if not entry.name.startswith(SCRATCH_PREFIX):
+                continue
+            try:
+                if entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+                    removed += 1
+            except OSError:
+                # removed in the meantime, eg by the sweeper of another worker process
+                pass
+
+        if removed:
+            print("Swept " + str(removed) + " stale scratch files from " + self.directory)
+            with self._lock:
+                self.swept += removed
+        return removed
+
+    # sweeps the scratch directory straight away, then every sweep_interval seconds in a background thread
+    def start(self):
+        self.sweep()
+        if self._thread is None and self.sweep_interval > 0:
+            self._thread = threading.Thread(target=self._run, name='scratch-sweeper', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stopped.wait(self.sweep_interval):
+            self.sweep()
+
+    # takes size more bytes of the quota for a scratch file, in memory or on disk
+    def _reserve(self, size, on_disk):
+        with self._lock:
+            if self.memory_bytes + self.disk_bytes + size > self.quota:
+                self.rejections += 1
+                raise ScratchQuotaException("Not enough scratch space for the file, try again later")
+            if on_disk:
+                self.disk_bytes += size
+            else:
+                self.memory_bytes += size
+
+    # moves size bytes of a scratch file from memory to disk
+    def _rollover(self, size):
+        with self._lock:
+            self.memory_bytes -= size
+            self.disk_bytes += size
+            self.rollovers += 1
+
+    def _release(self, size, on_disk):
+        with self._lock:
+            self.files -= 1
+            if on_disk:
+                self.disk_bytes -= size
+            else:
+                self.memory_bytes -= size
+
+
+class ScratchFile(io.BufferedIOBase):
+
+    def __init__(self, store):
+        self._store = store
+        self._file = io.BytesIO()
+        self._size = 0
+        self.path = None
+
+    @property
+    def size(self):
+        return self._size
+
+    # the whole content of the file
+    def getvalue(self):
+        position = self._file.tell()
+        self._file.seek(0)
+        try:
+            return self._file.read()
+        finally:
+            self._file.seek(position)
+
+    def readable(self):
+        return True
+
+    def writable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def read(self, size=-1):
+        return self._file.read(size)
+
+    def read1(self, size=-1):
+        return self._file.read(size)
+
+    def write(self, data):
+        end = self._file.tell() + len(data)
+        if end > self._size:
+            if self.path is None and end > self._store.spool_max_size:
+                self._move_to_disk()
+            self._store._reserve(end - self._size, self.path is not None)
+            self._size = end
+        return self._file.write(data)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        return self._file.seek(offset, whence)
+
+    def tell(self):
+        return self._file.tell()
+
+    def flush(self):
+        if not self._file.closed:
+            self._file.flush()
+
+    # removes the file, in memory or on disk, and gives its space back to the quota
+    def close(self):
+        if self.closed:
+            return
+        try:
+            self._file.close()
+            if self.path is not None:
+                try:
+                    os.remove(self.path)
+                except OSError:
+                    # already swept up
+                    pass
+        finally:
+            self._store._release(self._size, self.path is not None)
+            super().close()
+
+    def _move_to_disk(self):
+        path = os.path.join(self._store.directory, SCRATCH_PREFIX + str(os.getpid()) + '-' + uuid.uuid4().hex)
+        disk_file = open(path, 'w+b')
+        try:
+            disk_file.write(self._file.getbuffer())
+            disk_file.seek(self._file.tell())
+        except Exception:
+            disk_file.close()
+            os.remove(path)
+            raise
+
+        self._file.close()
+        self._file = disk_file
+        self.path = path
+        self._store._rollover(self._size)
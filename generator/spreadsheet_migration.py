@@ -0,0 +1,327 @@
+#!/usr/bin/env python
+# Streaming access to xlsx workbooks for spreadsheet migration. An xlsx file is a zip of XML parts with one part
+# per worksheet. A migration only ever rewrites the header rows at the top of a tab, so instead of loading the
+# whole workbook into memory with openpyxl, the header rows are read and rewritten directly in the worksheet XML
+# and everything else - including all the data rows - is streamed through to the output unchanged. Memory use
+# stays flat however many rows the spreadsheet has.
+import html
+import posixpath
+import re
+import shutil
+import zipfile
+import xml.etree.ElementTree as ET
+from collections import namedtuple
+from xml.sax.saxutils import escape
+
+CHUNK_SIZE = 64 * 1024
+
+_SHEET_DATA = re.compile(rb'<((?:[\w.-]+:)?)sheetData\b[^>]*?(/?)>')
+_ROW = re.compile(rb'<((?:[\w.-]+:)?)row\b([^>]*?)(?:/>|>(.*?)</\1row>)', re.DOTALL)
+_CELL = re.compile(rb'<((?:[\w.-]+:)?)c\b([^>]*?)(?:/>|>(.*?)</\1c>)', re.DOTALL)
+_ATTRIBUTE = re.compile(rb'([\w:.-]+)\s*=\s*(?:"([^"]*)"|\'([^\']*)\')')
+_VALUE = re.compile(rb'<(?:[\w.-]+:)?v\b[^>]*>(.*?)</(?:[\w.-]+:)?v>', re.DOTALL)
+_TEXT = re.compile(rb'<(?:[\w.-]+:)?t\b[^>]*>(.*?)</(?:[\w.-]+:)?t>', re.DOTALL)
+_SPANS = re.compile(rb'\s+spans\s*=\s*(?:"[^"]*"|\'[^\']*\')')
+_WHITESPACE = re.compile(rb'\s*')
+_CELL_REFERENCE = re.compile(rb'([A-Za-z]+)(\d*)')
+
+_Row = namedtuple('_Row', ['number', 'prefix', 'attributes', 'cells'])
+_Cell = namedtuple('_Cell', ['column', 'attributes', 'xml'])
+
+
+class StreamingWorkbook:
+
+    def __init__(self, source):
+        self._zip = zipfile.ZipFile(source)
+        self._sheet_parts, self._shared_strings_part = self._read_workbook()
+        self._shared_strings = {}
+        self._edits = {}
+
+    @property
+    def sheetnames(self):
+        return list(self._sheet_parts)
+
+    def close(self):
+        self._zip.close()
+
+    # returns the values of the first max_row rows of a tab as {row number: {column index: value}}, reading only
+    # as far into the worksheet as needed
+    def read_rows(self, sheet_name, max_row):
+        with self._zip.open(self._sheet_parts[sheet_name]) as stream:
+            rows = _split_header(stream, max_row).rows
+
+        self._load_shared_strings(
+            int(_VALUE.search(cell.xml).group(1)) for row in rows for cell in row.cells
+            if _attributes(cell.attributes).get(b't') == b's' and _VALUE.search(cell.xml))
+
+        return {row.number: {cell.column: self._cell_value(cell) for cell in row.cells} for row in rows}
+
+    # sets the value of a cell in the header rows of a tab - edits are applied when the workbook is saved
+    def set_value(self, sheet_name, row, column, value):
+        self._edits.setdefault(sheet_name, {})[(row, column)] = value
+
+    # writes the migrated workbook to target (a file name or file object), copying all unchanged parts and rows
+    # straight through from the original
+    def save(self, target):
+        edited_parts = {self._sheet_parts[name]: edits for name, edits in self._edits.items() if edits}
+
+        with zipfile.ZipFile(target, 'w', zipfile.ZIP_DEFLATED, allowZip64=True) as output:
+            for info in self._zip.infolist():
+                output_info = zipfile.ZipInfo(info.filename, date_time=info.date_time)
+                output_info.compress_type = info.compress_type
+                output_info.external_attr = info.external_attr
+
+                with self._zip.open(info) as source, \
+                        output.open(output_info, 'w', force_zip64=info.file_size > (1 << 30)) as destination:
+                    if info.filename in edited_parts:
+                        _rewrite_sheet(source, destination, edited_parts[info.filename])
+                    else:
+                        shutil.copyfileobj(source, destination, CHUNK_SIZE)
+
+    def _read_workbook(self):
+        workbook_part = 'xl/workbook.xml'
+        for relationship_type, target in _relationships(self._zip, '').values():
+            if relationship_type.endswith('/officeDocument'):
+                workbook_part = target
+
+        relationships = _relationships(self._zip, workbook_part)
+
+        sheet_parts = {}
+        for element in ET.fromstring(self._zip.read(workbook_part)).iter():
+            if _local_name(element.tag) == 'sheet':
+                relationship_id = next(value for key, value in element.attrib.items() if _local_name(key) == 'id')
+                sheet_parts[element.get('name')] = relationships[relationship_id][1]
+
+        shared_strings_part = None
+        for relationship_type, target in relationships.values():
+            if relationship_type.endswith('/sharedStrings'):
+                shared_strings_part = target
+
+        return sheet_parts, shared_strings_part
+
+    # reads the requested entries of the shared strings table in a single streaming pass
+    def _load_shared_strings(self, indices):
+        wanted = set(indices) - set(self._shared_strings)
+        if not wanted or not self._shared_strings_part:
+            return
+
+        last = max(wanted)
+        index = 0
+        root = None
+        with self._zip.open(self._shared_strings_part) as stream:
+            for event, element in ET.iterparse(stream, events=('start', 'end')):
+                if root is None:
+                    root = element
+                if event == 'end' and _local_name(element.tag) == 'si':
+                    if index in wanted:
+                        self._shared_strings[index] = _rich_text(element)
+                    index += 1
+                    root.clear()
+                    if index > last:
+                        break
+
+    def _cell_value(self, cell):
+        cell_type = _attributes(cell.attributes).get(b't', b'n')
+
+        if cell_type == b'inlineStr':
+            return ''.join(_unescape(text) for text in _TEXT.findall(cell.xml))
+
+        value = _VALUE.search(cell.xml)
+        if value is None:
+            return None
+        value = _unescape(value.group(1))
+
+        if cell_type == b's':
+            return self._shared_strings.get(int(value))
+        if cell_type == b'b':
+            return value == '1'
+        if cell_type in (b'str', b'e'):
+            return value
+        try:
+            return int(value)
+        except ValueError:
+            return float(value)
+
+
+# converts a 1-based column index to its letters, eg 28 -> AB
+def column_letter(column):
+    letters = ''
+    while column > 0:
+        column, remainder = divmod(column - 1, 26)
+        letters = chr(65 + remainder) + letters
+    return letters
+
+
+def _column_index(letters):
+    column = 0
+    for letter in letters.upper():
+        column = column * 26 + ord(letter) - 64
+    return column
+
+
+def _local_name(tag):
+    return tag.rsplit('}', 1)[-1]
+
+
+def _unescape(raw):
+    return html.unescape(raw.decode('utf-8'))
+
+
+def _attributes(raw):
+    return {match.group(1): match.group(2) if match.group(2) is not None else match.group(3)
+            for match in _ATTRIBUTE.finditer(raw)}
+
+
+def _rich_text(element):
+    text = []
+    for child in element:
+        if _local_name(child.tag) == 't':
+            text.append(child.text or '')
+        elif _local_name(child.tag) == 'r':
+            text.extend(run.text or '' for run in child if _local_name(run.tag) == 't')
+    return ''.join(text)
+
+
+# reads the relationships of a part as {id: (type, target part)}
+def _relationships(archive, part):
+    directory, name = posixpath.split(part)
+    relationships_part = posixpath.join(directory, '_rels', name + '.rels')
+    if relationships_part not in archive.namelist():
+        return {}
+
+    relationships = {}
+    for element in ET.fromstring(archive.read(relationships_part)):
+        if element.get('TargetMode') == 'External':
+            continue
+        target = element.get('Target')
+        if target.startswith('/'):
+            target = target[1:]
+        else:
+            target = posixpath.normpath(posixpath.join(directory, target))
+        relationships[element.get('Id')] = (element.get('Type'), target)
+    return relationships
+
+
+_Header = namedtuple('_Header', ['head', 'rows', 'tail', 'prefix', 'empty'])
+
+
+# reads a worksheet stream up to and including its last row numbered max_row or lower. Returns everything
+# before the first row (head), the parsed header rows and whatever has been read beyond them (tail) - the rest
+# of the worksheet is left in the stream
+def _split_header(stream, max_row):
+    buffer = b''
+    exhausted = False
+    start = None
+    position = None
+    rows = []
+    last_row = 0
+
+    while True:
+        if start is None:
+            match = _SHEET_DATA.search(buffer)
+            if match:
+                prefix = match.group(1)
+                if match.group(2):
+                    # a tab without any rows at all
+                    return _Header(buffer[:match.start()], [], buffer[match.end():], prefix, True)
+                start = position = match.end()
+
+        if start is not None:
+            while True:
+                position = _WHITESPACE.match(buffer, position).end()
+                match = _ROW.match(buffer, position)
+                if not match:
+                    break
+
+                attributes = _attributes(match.group(2))
+                number = int(attributes[b'r']) if b'r' in attributes else last_row + 1
+                if number > max_row:
+                    return _Header(buffer[:start], rows, buffer[position:], prefix, False)
+
+                rows.append(_Row(number, match.group(1), match.group(2), _parse_cells(match.group(3) or b'')))
+                last_row = number
+                position = match.end()
+
+            # the next element is either the end of the rows or a row that hasn't been fully read yet
+            if buffer.startswith(b'</', position) or exhausted:
+                return _Header(buffer[:start], rows, buffer[position:], prefix, False)
+
+        if exhausted:
+            raise ValueError("Worksheet has no sheetData element")
+
+        chunk = stream.read(CHUNK_SIZE)
+        exhausted = not chunk
+        buffer += chunk
+
+
+def _parse_cells(row_xml):
+    cells = []
+    last_column = 0
+    for match in _CELL.finditer(row_xml):
+        reference = _attributes(match.group(2)).get(b'r')
+        if reference:
+            column = _column_index(_CELL_REFERENCE.match(reference).group(1).decode('ascii'))
+        else:
+            column = last_column + 1
+        cells.append(_Cell(column, match.group(2), match.group(0)))
+        last_column = column
+    return cells
+
+
+# copies a worksheet from source to destination, rewriting the cells in edits ({(row, column): value})
+def _rewrite_sheet(source, destination, edits):
+    edits_by_row = {}
+    for (row, column), value in edits.items():
+        edits_by_row.setdefault(row, {})[column] = value
+
+    header = _split_header(source, max(edits_by_row))
+    prefix = header.prefix
+
+    destination.write(header.head)
+    if header.empty:
+        destination.write(b'<%ssheetData>' % prefix)
+
+    existing_rows = {row.number: row for row in header.rows}
+    for number in sorted(set(existing_rows) | set(edits_by_row)):
+        destination.write(_render_row(existing_rows.get(number), number, edits_by_row.get(number, {}), prefix))
+
+    if header.empty:
+        destination.write(b'</%ssheetData>' % prefix)
+    destination.write(header.tail)
+    shutil.copyfileobj(source, destination, CHUNK_SIZE)
+
+
+def _render_row(row, number, edits, prefix):
+    if row is None:
+        row = _Row(number, prefix, b' r="%d"' % number, [])
+    if not edits:
+        cells = [cell.xml for cell in row.cells]
+    else:
+        cells_by_column = {cell.column: cell for cell in row.cells}
+        rendered = {column: cell.xml for column, cell in cells_by_column.items()}
+        for column, value in edits.items():
+            rendered[column] = _render_cell(cells_by_column.get(column), number, column, value, row.prefix)
+        cells = [rendered[column] for column in sorted(rendered)]
+
+    # spans are only an optimisation hint and may no longer be accurate once cells have been added
+    attributes = _SPANS.sub(b'', row.attributes)
+    if not cells:
+        return b'<%srow%s/>' % (row.prefix, attributes)
+    return b'<%srow%s>%s</%srow>' % (row.prefix, attributes, b''.join(cells), row.prefix)
+
+
+# new cell values are written as inline strings so that the shared strings table doesn't need to be rewritten.
+# The cell's style is kept
+def _render_cell(cell, row, column, value, prefix):
+    attributes = b' r="%s%d"' % (column_letter(column).encode('ascii'), row)
+    if cell is not None:
+        style = _attributes(cell.attributes).get(b's')
+        if style is not None:
+            attributes += b' s="%s"' % style
+
+    if value is None or value == '':
+        return b'<%sc%s/>' % (prefix, attributes)
+
+    text = escape(str(value)).encode('utf-8')
+    return b'<%sc%s t="inlineStr"><%sis><%st xml:space="preserve">%s</%st></%sis></%sc>' % (
+        prefix, attributes, prefix, prefix, text, prefix, prefix, prefix)
@@ -5,13 +5,85 @@ $(document).ready(function() {
 
     for (i = 0; i < coll.length; i++) {
       coll[i].addEventListener("click", function() {
-        this.classList.toggle("active");
+        var collapsible = this;
         var content = this.nextElementSibling;
-        if (content.style.maxHeight){
-          content.style.maxHeight = null;
-        } else {
-          content.style.maxHeight = content.scrollHeight + "px";
-        }
+        // the section's properties have to be there before its height can be worked out
+        loadSection($(content).find('.column[data-url]')).then(function() {
+          collapsible.classList.toggle("active");
+          if (content.style.maxHeight){
+            content.style.maxHeight = null;
+          } else {
+            content.style.maxHeight = content.scrollHeight + "px";
+          }
+        });
       });
     }
-});
\ No newline at end of file
+});
+
+// fetches the properties of a section from the schema API the first time they are needed and adds a checkbox for
+// each of them - ticked if the property is required or was preselected. Returns a promise that resolves once the
+// checkboxes are there
+function loadSection(column){
+    if (column.length == 0 || column.data('loaded')){
+        return $.when();
+    }
+
+    if (!column.data('request')){
+        var request = $.getJSON(column.data('url')).then(function(data){
+            var schema = column.prop('id');
+            var preselected = column.data('preselected') || [];
+            var marked = {};
+            $.each(preselected, function(i, property){
+                marked[property] = true;
+            });
+
+            var items = [];
+            var listed = {};
+            $.each(data.properties, function(i, entry){
+                var property = entry[0];
+                listed[property] = true;
+                var status = entry[1];
+                if (marked[property] && status != 'required'){
+                    status = 'pre-selected';
+                }
+                items.push(propertyItem(schema, property, status));
+            });
+
+            // properties from an uploaded YAML file that aren't in the schema are still listed, after the others
+            $.each(preselected, function(i, property){
+                if (!listed[property]){
+                    items.push(propertyItem(schema, property, 'pre-selected'));
+                }
+            });
+
+            column.find('ul li').last().before(items);
+            column.data('loaded', true);
+        });
+        column.data('request', request);
+    }
+
+    return column.data('request');
+}
+
+// loads every section that hasn't been loaded yet
+function loadAllSections(){
+    var requests = $('#data-items .column[data-url]').map(function(){
+        return loadSection($(this));
+    }).get();
+    return $.when.apply($, requests);
+}
+
+function propertyItem(schema, property, status){
+    var checkbox = $('<input type="checkbox" name="property" class="property">').val(schema + ':' + property);
+    var label = property;
+
+    if (status == 'required'){
+        checkbox.addClass('disabled').prop('checked', true).attr('onclick', 'this.checked=!this.checked;');
+        label = property + '*';
+    }
+    else if (status == 'pre-selected'){
+        checkbox.prop('checked', true);
+    }
+
+    return $('<li>').append(checkbox).append(document.createTextNode(label));
+}
@@ -20,27 +20,67 @@ $(document).ready(function() {
         addProperty($(this).prop("id"));
      })
 
-     $('input.property').change(function() {
+     // property checkboxes are only added once their section is loaded, so the handler is on the container
+     $('#data-items').on('change', 'input.property', function() {
         if ($(this).is(':checked')) {
             $(this).closest('ul').siblings('input:checkbox').prop('checked', true);
         }
      });
+
+     $('button[name=submitButton]').click(function() {
+        submitButton = $(this).val();
+     });
+
+     $('#data-items').closest('form').submit(function(event) {
+        submitSchemas(this, event);
+     });
 });
 
+// the generate button that was clicked
+var submitButton;
+
+// the properties of a ticked schema only get sent if its section has been loaded, so any that haven't are loaded
+// before the form is submitted
+function submitSchemas(form, event){
+    var pending = $('#data-items .column[data-url]').filter(function(){
+        return !$(this).data('loaded') && $(this).children('input.schema').is(':checked');
+    });
+
+    if (pending.length > 0){
+        event.preventDefault();
+        var requests = pending.map(function(){
+            return loadSection($(this));
+        }).get();
+
+        $.when.apply($, requests).then(function(){
+            // submitting the form from here doesn't send the button that was clicked, so it's sent as a hidden field
+            $('<input type="hidden" name="submitButton">').val(submitButton).appendTo(form);
+            form.submit();
+        });
+    }
+}
+
 function selectAll(){
 
+    var expanded = $.when();
     if(!$('#expandAll').hasClass('expanded')){
-        expandAll();
+        expanded = expandAll();
     }
 
+    expanded.then(function(){
+        $('#data-items .content input[type=checkbox]').each(function(){
+            $(this).prop('checked', true)
 
-    $('#data-items .content input[type=checkbox]').each(function(){
-        $(this).prop('checked', true)
-
+        });
     });
 }
 
+// expands or collapses every section, once they have all been loaded
 function expandAll(){
+    return loadAllSections().then(toggleAll);
+}
+
+function toggleAll(){
     var coll = document.getElementsByClassName("collapsible");
 
     $('#expandAll').toggleClass("expanded");
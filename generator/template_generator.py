@@ -0,0 +1,506 @@
+#!/usr/bin/env python
+# The core of the template generator without the web app - loading the config and the schemas, building the schema
+# catalogue, generating spreadsheets from a set of tabs and migrating old spreadsheets to the latest schemas. It is
+# used by the web app (template_generator_app.py), the command line tool (cli.py) and the job and batch pool
+# processes, none of which need anything else loaded to do their work.
+#
+# The schemas and everything built from them are held in module globals, set up once per process by init(). Only
+# the ingest schema template is imported up front - the spreadsheet builder is imported the first time a spreadsheet
+# is generated, so that migrating a spreadsheet from the command line starts as quickly as possible.
+import io
+import os
+import threading
+import time
+
+import requests
+from ingest.template.schema_template import SchemaTemplate
+from ingest.template.tab_config import TabConfig
+from generator_config import load_config, validate_config
+from property_migrations import DELETED
+from schema_catalogue import build_catalogue, catalogue_version
+from schema_index import SchemaUrlIndex, split_schema_url
+from schema_snapshot import MIGRATIONS_URL, load_snapshot
+from spreadsheet_migration import StreamingWorkbook
+from tracing import span
+from yaml_io import MAX_YAML_BYTES, MAX_YAML_NODES, dump_yaml, load_tabs
+
+INGEST_API_URL = "http://api.ingest.{env}.archive.data.humancellatlas.org"
+
+# the Schemas tab of a spreadsheet lists one schema URL per row, so it is never longer than this
+MAX_SCHEMAS_TAB_ROWS = 1000
+
+# the compiled config (see generator_config.py) - like the catalogue it is never modified, only swapped for a newly
+# loaded one. CONFIG_FILE is its parser, for the sections that are only read at start-up
+CONFIG = None
+CONFIG_FILE = ''
+CONFIG_PATH = ''
+
+SCHEMA_TEMPLATE = {}
+
+# the schema catalogue built from SCHEMA_TEMPLATE, shared between requests - it is never modified once built,
+# only swapped out for a new one, so request handlers should take a single reference to it and use that throughout
+CATALOGUE = None
+CATALOGUE_LOCK = threading.Lock()
+
+# only one schema refresh runs at a time
+REFRESH_LOCK = threading.Lock()
+
+# index of the latest schema URLs by schema key, rebuilt whenever the set of latest schemas changes
+SCHEMA_INDEX = None
+SCHEMA_INDEX_VERSION = None
+
+api_url = ''
+
+# how long (in seconds) to wait for a schema or the property migrations when refreshing the schemas, set from the
+# config file. Refreshes hold REFRESH_LOCK, so a server that never answers mustn't hold it forever
+FETCH_TIMEOUT = 30
+
+# limits on the YAML files of tabs that are loaded, set from the config file
+YAML_MAX_BYTES = MAX_YAML_BYTES
+YAML_MAX_NODES = MAX_YAML_NODES
+
+# the latest submittable schema URLs from the Ingest API, refreshed in the background. Only the web app keeps one -
+# without it, the latest schemas are taken to be the ones that were loaded
+SCHEMA_REGISTRY = None
+
+
+# sets up the config and loads the schemas. The schemas either come live from the Ingest API, or from a snapshot
+# file (see schema_snapshot.py) - mode and snapshot_file override the ones in the config file. Returns the mode
+# the schemas were actually loaded in, which is 'live' if the snapshot was to be refreshed but there wasn't one
+def init(config_file='config.ini', mode=None, snapshot_file=None):
+    global CONFIG, CONFIG_FILE, CONFIG_PATH, SCHEMA_TEMPLATE, FETCH_TIMEOUT, api_url
+
+    CONFIG_PATH = os.path.abspath(config_file)
+    CONFIG = load_config(CONFIG_PATH)
+    CONFIG_FILE = CONFIG.parser
+    _set_yaml_limits()
+    if 'schema_registry' in CONFIG_FILE:
+        FETCH_TIMEOUT = CONFIG_FILE['schema_registry'].getfloat('fetch_timeout', FETCH_TIMEOUT)
+
+    api_url = get_ingest_api_url()
+
+    if 'snapshot' in CONFIG_FILE:
+        mode = mode or CONFIG_FILE['snapshot'].get('mode')
+        snapshot_file = snapshot_file or CONFIG_FILE['snapshot'].get('file')
+    mode = mode or 'live'
+    snapshot_file = snapshot_file or 'schemas.snapshot'
+
+    if mode == 'live':
+        SCHEMA_TEMPLATE = SchemaTemplate(ingest_api_url=api_url, migrations_url=MIGRATIONS_URL)
+    elif mode == 'snapshot':
+        SCHEMA_TEMPLATE = load_snapshot(snapshot_file)
+    elif mode == 'snapshot_then_refresh':
+        if os.path.exists(snapshot_file):
+            SCHEMA_TEMPLATE = load_snapshot(snapshot_file)
+        else:
+            print("No snapshot found at " + snapshot_file + ", loading the latest schemas instead")
+            SCHEMA_TEMPLATE = SchemaTemplate(ingest_api_url=api_url, migrations_url=MIGRATIONS_URL)
+            mode = 'live'
+    else:
+        raise ValueError("Unknown snapshot mode " + mode)
+
+    _report_config_problems(CONFIG, SCHEMA_TEMPLATE)
+    return mode
+
+# loads the config file again and swaps it in, together with a schema catalogue rebuilt with its ordering, linking
+# and blacklist. If the file can't be compiled the current config is kept. Settings in other sections (cache, jobs
+# etc.) only take effect when the app is restarted. Returns whether the new config was swapped in
+def reload_config():
+    global CONFIG, CONFIG_FILE, CATALOGUE, SCHEMA_INDEX
+
+    with REFRESH_LOCK:
+        try:
+            config = load_config(CONFIG_PATH)
+        except ValueError as e:
+            print("Couldn't reload the config file, carrying on with the current config: " + str(e))
+            return False
+
+        _report_config_problems(config, SCHEMA_TEMPLATE)
+        try:
+            with span('catalogue_build'):
+                catalogue = build_catalogue(SCHEMA_TEMPLATE, config)
+        except Exception as e:
+            print("Couldn't build the schema catalogue with the reloaded config, carrying on with the current config: "
+                  + str(e))
+            return False
+
+        with CATALOGUE_LOCK:
+            CONFIG = config
+            CONFIG_FILE = config.parser
+            CATALOGUE = catalogue
+            # the sub-tabs of each schema come from the ordering section
+            SCHEMA_INDEX = None
+        print("Reloaded config file " + CONFIG_PATH)
+        return True
+
+# helper function to print the parts of the config that don't match up with the loaded schemas
+def _report_config_problems(config, schema_template):
+    for problem in validate_config(config, schema_template):
+        print("Config file: " + problem)
+
+# helper function to set the limits on YAML files of tabs from the config file
+def _set_yaml_limits():
+    global YAML_MAX_BYTES, YAML_MAX_NODES
+
+    if 'yaml' in CONFIG_FILE:
+        YAML_MAX_BYTES = int(CONFIG_FILE['yaml'].getfloat('max_size_mb', MAX_YAML_BYTES / 1024 / 1024) * 1024 * 1024)
+        YAML_MAX_NODES = CONFIG_FILE['yaml'].getint('max_nodes', MAX_YAML_NODES)
+
+# helper function to get the Ingest API URL
+def get_ingest_api_url():
+    env = CONFIG.environment
+
+    if env == 'prod':
+        url = INGEST_API_URL.replace("{env}.", '')
+    else:
+        url = INGEST_API_URL.replace("{env}", env)
+
+    return url
+
+# the latest submittable schema URLs
+def latest_schema_urls():
+    if SCHEMA_REGISTRY is not None:
+        return SCHEMA_REGISTRY.schema_urls()
+    return tuple(SCHEMA_TEMPLATE.metadata_schema_urls)
+
+# loads the latest versions of the schemas and swaps them in for the ones currently loaded, eg the ones from a
+# snapshot. Only the schemas that aren't already loaded are fetched, and only those and the schemas that depend on
+# them are rebuilt in the catalogue. Requests carry on using the current schemas and catalogue until the new ones are
+# ready, then both are swapped in together. latest_schemas defaults to fetching the latest schema URLs from the
+# Ingest API. Returns whether the schemas were swapped - if the latest schemas can't be loaded, the current ones are kept
+def refresh_schema_template(latest_schemas=None):
+    global SCHEMA_TEMPLATE, CATALOGUE, SCHEMA_INDEX
+
+    with REFRESH_LOCK:
+        try:
+            if latest_schemas is None:
+                from schema_registry import fetch_latest_schema_urls
+                latest_schemas = fetch_latest_schema_urls(api_url)
+
+            if set(latest_schemas) == set(SCHEMA_TEMPLATE.metadata_schema_urls):
+                return False
+
+            with span('schema_refresh'):
+                schema_template = _update_schema_template(SCHEMA_TEMPLATE, latest_schemas)
+            with span('catalogue_build'):
+                catalogue = build_catalogue(schema_template, CONFIG, previous=CATALOGUE)
+            _report_config_problems(CONFIG, schema_template)
+        except Exception as e:
+            print("Couldn't load the latest schemas, carrying on with the current ones: " + str(e))
+            return False
+
+        with CATALOGUE_LOCK:
+            SCHEMA_TEMPLATE = schema_template
+            CATALOGUE = catalogue
+            # an index built while the schemas were being refreshed may have the new latest schemas but the old
+            # schema template's tabs, and would otherwise be kept until the latest schemas change again
+            SCHEMA_INDEX = None
+        return True
+
+# helper function to build a schema template for the latest schemas, reusing the JSON of the schemas in the
+# current one and only fetching the ones that have changed. The property migrations are fetched again, as a new
+# schema version usually comes with new migrations
+def _update_schema_template(current, latest_schemas):
+    current_schemas = {}
+    for json_schema in current.json_schemas:
+        current_schemas[json_schema.get("$id") or json_schema.get("id")] = json_schema
+
+    json_schemas = []
+    fetched = []
+    for url in latest_schemas:
+        json_schema = current_schemas.get(url)
+        if json_schema is None:
+            json_schema = _fetch_json(url)
+            fetched.append(url)
+        json_schemas.append(json_schema)
+
+    try:
+        property_migrations = _fetch_json(MIGRATIONS_URL)["migrations"]
+    except Exception as e:
+        print("Couldn't load the property migrations, keeping the current ones: " + str(e))
+        property_migrations = current.property_migrations
+
+    schema_template = SchemaTemplate(json_schema_docs=json_schemas, property_migrations=property_migrations)
+    schema_template.metadata_schema_urls = list(latest_schemas)
+    print("Loaded the latest schemas, fetched " + str(len(fetched)) + " of " + str(len(json_schemas)) + ": "
+          + ", ".join(fetched))
+    return schema_template
+
+# helper function to fetch a JSON document, raising an exception if it takes longer than FETCH_TIMEOUT or the server
+# sends back an error rather than the document
+def _fetch_json(url):
+    response = requests.get(url, timeout=FETCH_TIMEOUT)
+    response.raise_for_status()
+    return response.json()
+
+# gets the schema catalogue for the current schema template, (re)building it when the set of latest schemas has
+# changed. The catalogue itself is read-only, use its view() to get properties that can be marked up
+def get_catalogue():
+    global CATALOGUE
+
+    catalogue = CATALOGUE
+    if catalogue is None or catalogue.version != catalogue_version(SCHEMA_TEMPLATE.metadata_schema_urls):
+        with CATALOGUE_LOCK:
+            # another thread may have rebuilt the catalogue, or swapped in a new schema template and catalogue,
+            # while this one was waiting for the lock
+            catalogue = CATALOGUE
+            if catalogue is None or catalogue.version != catalogue_version(SCHEMA_TEMPLATE.metadata_schema_urls):
+                with span('catalogue_build'):
+                    catalogue = build_catalogue(SCHEMA_TEMPLATE, CONFIG, previous=catalogue)
+                CATALOGUE = catalogue
+
+    return catalogue
+
+# gets the index of the given latest schema URLs, only rebuilding it when the set of URLs changes
+def get_schema_index(latest_schemas):
+    global SCHEMA_INDEX, SCHEMA_INDEX_VERSION
+
+    version = catalogue_version(latest_schemas)
+    with CATALOGUE_LOCK:
+        if SCHEMA_INDEX is None or SCHEMA_INDEX_VERSION != version:
+            SCHEMA_INDEX = SchemaUrlIndex(latest_schemas, SCHEMA_TEMPLATE, CONFIG)
+            SCHEMA_INDEX_VERSION = version
+        return SCHEMA_INDEX
+
+# builds a spreadsheet in memory from a pre-yaml data structure ({'tabs': [...]}) using the schema template
+# library's spreadsheet generator, and writes the xlsx file to target (a file object) or if there isn't one returns
+# its content
+def build_spreadsheet(yaml_json, latest_schemas, target=None):
+    from ingest.template.vanilla_spreadsheet_builder import VanillaSpreadsheetBuilder
+
+    # the tabs are passed straight to the schema template rather than via a YAML file, and if the latest schemas
+    # are the ones already loaded they are reused instead of being fetched again
+    with span('schema_template'):
+        if set(latest_schemas) == set(SCHEMA_TEMPLATE.metadata_schema_urls):
+            template = SchemaTemplate(json_schema_docs=SCHEMA_TEMPLATE.json_schemas,
+                                      tab_config=TabConfig(init=yaml_json),
+                                      property_migrations=SCHEMA_TEMPLATE.property_migrations)
+        else:
+            template = SchemaTemplate(metadata_schema_urls=latest_schemas, tab_config=TabConfig(init=yaml_json),
+                                      property_migrations=SCHEMA_TEMPLATE.property_migrations)
+
+    # the spreadsheet is built in memory - xlsxwriter would otherwise write each tab out to a temp file first
+    ssheet_file = target if target is not None else io.BytesIO()
+    spreadsheet_builder = VanillaSpreadsheetBuilder(ssheet_file, True)
+    spreadsheet_builder.spreadsheet.in_memory = True
+    # TO DO currently automatically building WITH schemas tab - this should be customisable
+    with span('spreadsheet_build'):
+        spreadsheet_builder.generate_spreadsheet(schema_template=template, include_schemas_tab=True)
+    with span('spreadsheet_save'):
+        spreadsheet_builder.save_spreadsheet()
+
+    if target is None:
+        return ssheet_file.getvalue()
+
+# migrates a spreadsheet from source to target (file names or file objects) and returns a report of which tabs
+# were rewritten and which were already at the latest version
+def migrate_workbook(source, target, latest_schemas):
+    with span('workbook_open'):
+        wb = StreamingWorkbook(source)
+
+    catalogue = get_catalogue()
+
+    tabs = wb.sheetnames
+
+    # the Schemas tab records the schema URLs the spreadsheet was generated from, so tabs whose columns all come
+    # from schemas already at their latest version can be left alone. Without a Schemas tab, every tab gets migrated
+    with span('read_schemas_tab'):
+        schemas_tab, spreadsheet_schemas = _read_schemas_tab(wb)
+
+    latest_urls = dict((split_schema_url(url)[0], url) for url in latest_schemas)
+
+    rewritten_tabs = []
+    skipped_tabs = []
+    migrated_schemas = {}
+
+    # go through each schema in the tab config and if it's present in the old spreadsheet and any of the schemas
+    # its columns come from aren't at the latest version, migrate it
+    for latest in get_schema_index(latest_schemas).values():
+        if latest.tab_name in tabs:
+            # a tab also has columns from other schemas - the process fields and the ids of linked biomaterials
+            # and protocols - and so do its sub-tabs
+            keys = _column_schemas(wb, [latest.tab_name] + [linked_tab.tab_name for linked_tab in latest.linked_tabs
+                                                            if linked_tab.tab_name in tabs])
+            keys.add(latest.key)
+            if all(key in spreadsheet_schemas and key in latest_urls
+                   and split_schema_url(spreadsheet_schemas[key][1]) == split_schema_url(latest_urls[key])
+                   for key in keys):
+                print("Skipping " + latest.tab_name + ", already at the latest version")
+                skipped_tabs.append(latest.tab_name)
+            else:
+                print("Migrating " + latest.tab_name)
+                rewritten_tabs.extend(_migrate_schema(wb, latest, catalogue))
+                for key in keys:
+                    if key in latest_urls:
+                        migrated_schemas[key] = latest_urls[key]
+
+    # record the new schema versions of the migrated tabs so they don't get migrated again on the next upload
+    for schema_name, schema in migrated_schemas.items():
+        if schema_name in spreadsheet_schemas:
+            wb.set_value(schemas_tab, spreadsheet_schemas[schema_name][0], 1, schema)
+
+    with span('spreadsheet_save'):
+        wb.save(target)
+    wb.close()
+
+    return {'rewritten': rewritten_tabs, 'skipped': skipped_tabs}
+
+# loads a YAML file of tabs from its content or a file object, raising a YamlException if it is too big or isn't a
+# valid list of tabs (see yaml_io.py)
+def load_yaml(content):
+    return load_tabs(content, YAML_MAX_BYTES, YAML_MAX_NODES)
+
+# helper function to read the schema URLs from the Schemas tab of a spreadsheet, as the name of the tab and
+# {schema name: (row, schema URL)}
+def _read_schemas_tab(workbook):
+    for tab_name in ('Schemas', 'schemas'):
+        if tab_name in workbook.sheetnames:
+            schemas = {}
+            for row, values in workbook.read_rows(tab_name, MAX_SCHEMAS_TAB_ROWS).items():
+                url = values.get(1)
+                if isinstance(url, str) and url.startswith('http'):
+                    schemas[url.rstrip('/').split('/')[-1]] = (row, url)
+            return tab_name, schemas
+    return None, {}
+
+# helper function to get the keys of the schemas the columns of the given tabs come from, from the programmatic
+# names in row 4
+def _column_schemas(workbook, tab_names):
+    keys = set()
+    for tab_name in tab_names:
+        for value in workbook.read_rows(tab_name, 4).get(4, {}).values():
+            if isinstance(value, str) and value:
+                keys.add(value.split('.')[0])
+    return keys
+
+# helper function to actually migrate the schema, returns the names of the tabs that were updated
+def _migrate_schema(workbook, latest, catalogue):
+    updated_tabs = []
+
+    if _update_tab(workbook, latest.key, latest.tab_name, catalogue):
+        updated_tabs.append(latest.tab_name)
+
+    # if there are dependent tabs (eg contact, publications etc for project), update these as well
+    for linked_tab in latest.linked_tabs:
+        linked_tab_name = linked_tab.tab_name
+        if linked_tab_name not in workbook.sheetnames:
+            print("No tab found for key " + linked_tab_name)
+            linked_tab_name = linked_tab.full_tab_name
+
+        if _update_tab(workbook, latest.key, linked_tab_name, catalogue):
+            updated_tabs.append(linked_tab_name)
+
+    return updated_tabs
+
+
+# convenience function to update a given tab in the work book, returns whether the tab was found
+def _update_tab(workbook, schema_name, tab_name, catalogue):
+    with span('migrate_tab', tab=tab_name):
+        return _migrate_tab(workbook, schema_name, tab_name, catalogue.column_headers, catalogue.migrations)
+
+def _migrate_tab(workbook, schema_name, tab_name, column_headers, migrations):
+    if tab_name not in workbook.sheetnames:
+        print("No tab found for key " + tab_name)
+        return False
+
+    # look only a programmatic names in row 4
+    programmatic_names = workbook.read_rows(tab_name, 4).get(4, {})
+    for col_idx, value in programmatic_names.items():
+
+        # if there is actually a programmatic name in the cell, process this column
+        if isinstance(value, str) and value:
+            # if the programmatic name is still in the latest schemas, update the user friendly properties as we
+            # don't know if the minor or patch schema version might have changed
+            if migrations.is_current(value):
+                _update_user_properties(value, col_idx, workbook, tab_name, schema_name, column_headers)
+                continue
+
+            # otherwise, look up what the property has been migrated to
+            new_property = migrations.lookup(value)
+            if new_property is None:
+                print("property " + value + " not found in migrations.")
+            # deleted properties are left as they are for now - only the header rows of a tab are rewritten, so
+            # the column can't be taken out of the data rows
+            elif new_property is DELETED:
+                print("property " + value + " has been deleted from the schemas.")
+            # if a new property exists for the cell value, set the cell value to the new property,
+            # then update the user friendly fields for the column
+            else:
+                workbook.set_value(tab_name, 4, col_idx, new_property)
+                _update_user_properties(new_property, col_idx, workbook, tab_name, schema_name, column_headers)
+
+    return True
+
+
+# convenience function to rewrite the user friendly header rows (name, description and guidelines/example)
+# of a column, using the precomputed header for its programmatic name
+def _update_user_properties(col_name, col_index, workbook, tab_name, tab_schema, column_headers):
+    header = column_headers.lookup(col_name)
+
+    workbook.set_value(tab_name, 1, col_index, header.title_for(tab_schema))
+    # set the description
+    workbook.set_value(tab_name, 2, col_index, header.description)
+    # write guidelines and example
+    workbook.set_value(tab_name, 3, col_index, header.guide)
+
+# the state a pool process needs to be able to migrate and generate spreadsheets, as (version, initargs) -
+# the version changes whenever the schema template, the latest schemas or the config do, so a pool can be restarted
+# with them
+def job_worker_state():
+    schema_template = SCHEMA_TEMPLATE
+    latest_schemas = list(latest_schema_urls())
+    return (catalogue_version(schema_template.metadata_schema_urls) + catalogue_version(latest_schemas)
+            + str(CONFIG.mtime),
+            (CONFIG_PATH, list(schema_template.metadata_schema_urls), schema_template.json_schemas,
+             schema_template.property_migrations, latest_schemas))
+
+# sets up a pool process with the same config and schemas as the process that started it. The catalogue and the
+# index of the latest schemas are built up front, so that the first job the process runs doesn't have to wait for them
+def init_job_worker(config_path, schema_urls, json_schemas, property_migrations, latest_schemas):
+    global CONFIG, CONFIG_FILE, CONFIG_PATH, SCHEMA_TEMPLATE
+
+    CONFIG_PATH = config_path
+    CONFIG = load_config(config_path)
+    CONFIG_FILE = CONFIG.parser
+    _set_yaml_limits()
+
+    SCHEMA_TEMPLATE = SchemaTemplate(json_schema_docs=json_schemas, property_migrations=property_migrations)
+    SCHEMA_TEMPLATE.metadata_schema_urls = schema_urls
+
+    get_catalogue()
+    get_schema_index(latest_schemas)
+
+# migrates or generates a single spreadsheet of a batch, run in a pool process. Returns the name and content of the
+# resulting spreadsheet and a report of what was done
+def process_batch_file(name, content, latest_schemas):
+    base_name = os.path.splitext(name)[0]
+
+    if name.lower().endswith(('.yaml', '.yml')):
+        yaml_json = load_yaml(content)
+        return base_name + '.xlsx', build_spreadsheet(yaml_json, latest_schemas), \
+            {'type': 'generation', 'tabs': len(yaml_json['tabs'])}
+
+    migrated = io.BytesIO()
+    report = migrate_workbook(io.BytesIO(content), migrated, latest_schemas)
+    return base_name + '_migrated.xlsx', migrated.getvalue(), dict(report, type='migration')
+
+# builds the spreadsheet and YAML file of a template preset, run in a pool process. Returns the content of both and
+# how long building them took
+def preset_job(yaml_json, latest_schemas):
+    start = time.perf_counter()
+    spreadsheet = build_spreadsheet(yaml_json, latest_schemas)
+    yaml_content = dump_yaml(yaml_json)
+    return spreadsheet, yaml_content, time.perf_counter() - start
+
+# background job to migrate the spreadsheet at input_path, run in a job pool process
+def migration_job(input_path, result_path, latest_schemas):
+    return migrate_workbook(input_path, result_path, latest_schemas)
+
+# background job to generate a spreadsheet from the YAML file at input_path, run in a job pool process
+def generation_job(input_path, result_path, latest_schemas):
+    with open(input_path) as file:
+        yaml_json = load_yaml(file)
+
+    with open(result_path, 'wb') as file:
+        file.write(build_spreadsheet(yaml_json, latest_schemas))
+    return {'tabs': len(yaml_json['tabs'])}
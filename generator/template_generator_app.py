@@ -1,23 +1,35 @@
 #!/usr/bin/env python
 import sys
 
+import io
 import os
 import tempfile
 
-import yaml
+import hashlib
+import json
 import logging
-import configparser
 import datetime
-from flask import Flask, flash, request, render_template, redirect, url_for, make_response
+import threading
+from flask import Flask, Request, Response, flash, g, request, render_template, redirect, url_for, make_response
+from markupsafe import Markup
 from flask_cors import CORS
-from openpyxl import load_workbook
-from ingest.template.schema_template import SchemaTemplate, UnknownKeySchemaException
-from ingest.template.vanilla_spreadsheet_builder import VanillaSpreadsheetBuilder
+import template_generator
+from template_generator import build_spreadsheet, get_catalogue, job_worker_state, latest_schema_urls, load_yaml, \
+    migrate_workbook
+import compression
+from compression import COMPRESSIBLE_TYPES, choose_encoding, compress, compress_chunks, encoded_etag, \
+    matching_etag
+from generator_config import ConfigWatcher
+from output_cache import OutputCache, output_key
+from presets import PresetLibrary, preset_tabs
+from schema_registry import SchemaRegistry
+from tracing import METRICS, Profile, end_trace, span, start_trace
+from jobs import DEFAULT_WORKERS, JobQueue, JobStore, job_status
+from batch import MAX_BATCH_FILE_SIZE, MAX_BATCH_MEMBERS, MAX_BATCH_SIZE, BatchException, read_batch, run_batch
+from scratch import ScratchQuotaException, ScratchStore
+from spreadsheet_migration import CHUNK_SIZE
+from yaml_io import YamlException, dump_yaml
 
-EXCLUDED_PROPERTIES = ["describedBy", "schema_version", "schema_type", "provenance"]
-EXCLUDED_SCHEMAS = []
-
-INGEST_API_URL = "http://api.ingest.{env}.archive.data.humancellatlas.org"
 
 STATUS_LABEL = {
     'Valid': 'label-success',
@@ -28,32 +40,69 @@ STATUS_LABEL = {
 }
 
 ALLOWED_EXTENSIONS = set(['yaml', 'yml', 'xls', 'xlsx'])
-UPLOAD_FOLDER = 'tmp/yaml_file'
 
 DEFAULT_STATUS_LABEL = 'label-warning'
 
+XLSX_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
 
 HTML_HELPER = {
     'status_label': STATUS_LABEL,
     'default_status_label': DEFAULT_STATUS_LABEL
 }
 
+# uploaded files are spooled into the scratch space rather than werkzeug's own temp files, so that they count
+# towards its quota and are cleaned up the same way as everything else
+class ScratchRequest(Request):
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return SCRATCH.spool()
+
+
 # Flask boiler plate
 app = Flask(__name__, static_folder='static')
+app.request_class = ScratchRequest
 app.secret_key = 'cells'
 cors = CORS(app)
 app.config['CORS_HEADERS'] = 'Content-Type'
-app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 
 logger = logging.getLogger(__name__)
 
-# dictionary of schema to tab names
-# as tab names can be hard to get hold of from the schema template library,esp for sub-tabs
-DISPLAY_NAME_MAP = {}
+# the config, schemas and schema catalogue are held by template_generator.py, which the job and batch pool
+# processes and the command line tool share with the app
+
+# cache of generated spreadsheets and YAML files, set up from the config file
+OUTPUT_CACHE = OutputCache()
+
+# scratch space for uploaded, generated and migrated files while a request is handled, set up from the config file
+SCRATCH = ScratchStore(os.path.join(tempfile.gettempdir(), 'generator-scratch'))
+
+# the schemas and references of the preselection page, rendered for the catalogue they came from, as (catalogue, html)
+REFERENCES_HTML = None
+
+# compression of HTML, JSON and YAML responses, set up from the config file
+COMPRESSION = True
+COMPRESS_MIN_SIZE = compression.MIN_SIZE
+GZIP_LEVEL = compression.GZIP_LEVEL
+BROTLI_QUALITY = compression.BROTLI_QUALITY
+
+# per-request tracing, set up from the config file. A request with an X-Profile header is profiled if a profile
+# directory is configured
+SERVER_TIMING = True
+LOG_SPANS = False
+PROFILE_DIR = None
+
+# background jobs for large migrations and generations, set up from the config file
+JOB_STORE = None
+JOB_QUEUE = None
 
-CONFIG_FILE = ''
+# limits on zip files posted to /batch, set up from the config file
+BATCH_MAX_MEMBERS = MAX_BATCH_MEMBERS
+BATCH_MAX_FILE_SIZE = MAX_BATCH_FILE_SIZE
+BATCH_MAX_SIZE = MAX_BATCH_SIZE
 
-SCHEMA_TEMPLATE = {}
+# the template presets of the config file, rebuilt in the job pool whenever the schemas or the config change
+PRESETS = PresetLibrary()
 
 # function that takes an uploaded YAML file and renders it in the context of all the latest schemas
 @app.route('/upload', methods=['POST'])
@@ -69,19 +118,21 @@ def upload_file():
         return redirect(url_for('index'))
     if file and _allowed_file(file.filename):
 
-        content = yaml.load(file.stream.read(), Loader=yaml.FullLoader)
-
-        # load all properties from latest schemas
-        all_properties = _process_schemas()
+        try:
+            with span('yaml_load'):
+                content = load_yaml(file.stream)
+        except YamlException as e:
+            flash('Warning! ' + str(e))
+            return redirect(url_for('index'))
 
         # get all the properties from the file
         selected_schemas, selected_properties = _process_uploaded_file(content['tabs'])
 
         # tag all the properties from the file as preselected in the full properties list
-        schema_properties = _preselect_properties(all_properties, selected_schemas, None, selected_properties)
+        schema_properties = _preselect_properties(get_catalogue(), selected_schemas, None, selected_properties)
 
         # return the list of pre-selected properties to be rendered
-        return render_template('schemas.html', helper=HTML_HELPER, schemas=schema_properties)
+        return _render_schemas(schema_properties)
 
 # function that takes a YAML file and
 # converts it straight to a spreadsheet without going via the property selection page
@@ -98,7 +149,12 @@ def upload_generate():
         return redirect(url_for('index'))
     if file and _allowed_file(file.filename):
 
-        yaml_json = yaml.load(file.stream.read(), Loader=yaml.FullLoader)
+        try:
+            with span('yaml_load'):
+                yaml_json = load_yaml(file.stream)
+        except YamlException as e:
+            flash('Warning! ' + str(e))
+            return redirect(url_for('index'))
         response = _generate_spreadsheet(yaml_json)
         return response
 
@@ -106,7 +162,7 @@ def upload_generate():
 # function that loads all properties for all schemas - called either from home page or schemas preselection page
 @app.route('/load_all', methods=['GET', 'POST'])
 def load_full_schemas():
-    all_properties = _process_schemas()
+    catalogue = get_catalogue()
 
     response = request.form
 
@@ -119,49 +175,162 @@ def load_full_schemas():
     selected_references = []
     if 'reference' in response:
         selected_references = response.getlist('reference')
+        schemas = set(selected_schemas)
         for ref in selected_references:
-            if ref.split(":")[1] in DISPLAY_NAME_MAP:
-                if ref.split(":")[0] in selected_schemas:
-                    selected_schemas.append(ref.split(":")[1])
+            schema, module = ref.split(":")[:2]
+            if module in catalogue.display_names and schema in schemas:
+                selected_schemas.append(module)
+                schemas.add(module)
 
     # process all schemas to tag any preselected ones for ticking
-    schema_properties = _preselect_properties(all_properties, selected_schemas, selected_references, None)
+    schema_properties = _preselect_properties(catalogue, selected_schemas, selected_references, None)
 
-    return render_template('schemas.html', helper=HTML_HELPER, schemas=schema_properties)
+    return _render_schemas(schema_properties)
 
 # function that loads schemas and modules (references) only for preselection
 @app.route('/load_select', methods=['GET'])
 def selectSchemas():
 
-    # load the tab config and go through all the schemas
-    tab_config = SCHEMA_TEMPLATE.tabs
-
-    unordered = {}
-    for schema in tab_config:
-        schema_name = list(schema.keys())[0]
-
-        if schema_name in EXCLUDED_SCHEMAS:
-            continue
-
-        properties = schema[schema_name]['columns']
-        schema_title = schema[schema_name]['display_name']
-        app.logger.info(schema_name)
-
-        schema_structure = SCHEMA_TEMPLATE.lookup_property_attributes_in_metadata(schema_name)
+    catalogue = get_catalogue()
+
+    with span('render'):
+        return render_template('schema_selector.html', helper=HTML_HELPER,
+                               references_html=_references_html(catalogue))
+
+# returns the latest version of each schema, as currently known to the generator
+@app.route('/schema_versions', methods=['GET'])
+def schema_versions():
+    registry = template_generator.SCHEMA_REGISTRY
+    return {
+        'version': registry.version,
+        'updated': registry.updated.isoformat(),
+        'schemas': registry.versions()
+    }
+
+# summaries of the schemas in the catalogue (name, title and number of properties), in page order. The offset and
+# limit query parameters page through them
+@app.route('/api/schemas', methods=['GET'])
+def api_schemas():
+    catalogue = get_catalogue()
+    summaries = catalogue.summaries()
+    offset, limit = _page(len(summaries))
+    return _api_response(catalogue, {
+        'version': catalogue.version,
+        'total': len(summaries),
+        'offset': offset,
+        'schemas': summaries[offset:offset + limit]
+    })
+
+# the properties of a schema as [property, "required" or "not required"] pairs - the schemas page fetches these
+# when a schema's section is first expanded. The offset and limit query parameters page through them
+@app.route('/api/schemas/<name>', methods=['GET'])
+def api_schema(name):
+    catalogue = get_catalogue()
+    properties = catalogue.properties(name)
+    if properties is None:
+        return {'error': 'No such schema'}, 404
+
+    offset, limit = _page(len(properties))
+    return _api_response(catalogue, {
+        'version': catalogue.version,
+        'name': name,
+        'title': catalogue.display_names.get(name, name),
+        'total': len(properties),
+        'offset': offset,
+        'properties': properties[offset:offset + limit]
+    })
+
+# timings of each stage of the request pipeline and other counters, in the Prometheus text format. The metrics are
+# per worker process
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    cache_stats = OUTPUT_CACHE.stats()
+    extra = [
+        ('generator_output_cache_hits_total', 'Generated files served from the cache', 'counter', cache_stats['hits']),
+        ('generator_output_cache_misses_total', 'Generated files not found in the cache', 'counter',
+         cache_stats['misses']),
+        ('generator_output_cache_evictions_total', 'Generated files evicted from the cache', 'counter',
+         cache_stats['evictions']),
+        ('generator_output_cache_bytes', 'Size of the generated files in the memory cache', 'gauge',
+         cache_stats['bytes'])
+    ]
+    scratch_stats = SCRATCH.stats()
+    extra += [
+        ('generator_scratch_files', 'Scratch files currently open', 'gauge', scratch_stats['files']),
+        ('generator_scratch_memory_bytes', 'Size of the scratch files kept in memory', 'gauge',
+         scratch_stats['memory_bytes']),
+        ('generator_scratch_disk_bytes', 'Size of the scratch files written to disk', 'gauge',
+         scratch_stats['disk_bytes']),
+        ('generator_scratch_quota_bytes', 'Scratch space a worker process can use at once', 'gauge',
+         scratch_stats['quota_bytes']),
+        ('generator_scratch_rollovers_total', 'Scratch files that grew too big for memory', 'counter',
+         scratch_stats['rollovers']),
+        ('generator_scratch_rejections_total', 'Writes refused for going over the scratch quota', 'counter',
+         scratch_stats['rejections']),
+        ('generator_scratch_swept_total', 'Stale scratch files removed by the sweeper', 'counter',
+         scratch_stats['swept'])
+    ]
+    response = make_response(METRICS.render(extra))
+    response.headers.set('Content-Type', 'text/plain; version=0.0.4')
+    return response
+
+# starts tracing (and if asked for, profiling) each request
+@app.before_request
+def _start_request_trace():
+    start_trace(request.endpoint or request.path)
+    if PROFILE_DIR and request.headers.get('X-Profile'):
+        g.profile = Profile(PROFILE_DIR, request.endpoint or 'request')
+
+# reports the timings of a request's stages in the Server-Timing header and the log. Files are streamed back after
+# this, so the time spent sending them isn't included
+@app.after_request
+def _end_request_trace(response):
+    trace = end_trace()
+    profile = g.pop('profile', None)
+    if profile is not None:
+        response.headers.set('X-Profile-File', os.path.basename(profile.dump()))
+
+    if trace is not None:
+        METRICS.observe_span('request_' + trace.name, trace.elapsed)
+        METRICS.count_request(trace.name, response.status_code)
+        if SERVER_TIMING:
+            response.headers.set('Server-Timing', trace.server_timing())
+        if LOG_SPANS:
+            logger.info(trace.record(method=request.method, path=request.path, status=response.status_code))
+    return response
+
+# compresses HTML pages, JSON and YAML files with brotli or gzip if the client accepts it. Pages and JSON are
+# compressed in one go and keep their Content-Length, files being streamed back are compressed chunk by chunk as
+# they are sent. This runs before the request trace is ended, so compressing a page is included in its timings
+@app.after_request
+def _compress_response(response):
+    if (not COMPRESSION or response.status_code != 200 or response.direct_passthrough
+            or 'Content-Encoding' in response.headers or response.mimetype not in COMPRESSIBLE_TYPES):
+        return response
 
-        references = _extract_references(properties, schema_name, schema_title, schema_structure)
-        unordered[references["name"]] = references
+    response.vary.add('Accept-Encoding')
+    encoding = choose_encoding(request.accept_encodings)
+    if encoding is None:
+        return response
 
-    #make sure schemas and subschemas are presented in the order defined in the config file
-    orderedReferences = []
-    if 'ordering' in CONFIG_FILE:
-        for key in CONFIG_FILE['ordering'].keys():
-            if key in unordered.keys():
-                orderedReferences.append(unordered[key])
-            else:
-                print(key + " is currently not a recorded property")
+    if response.is_streamed:
+        if response.content_length is not None and response.content_length < COMPRESS_MIN_SIZE:
+            return response
+        # the compressed size isn't known until the whole file has been sent
+        response.response = compress_chunks(response.response, encoding, GZIP_LEVEL, BROTLI_QUALITY)
+        response.headers.remove('Content-Length')
+    else:
+        body = response.get_data()
+        if len(body) < COMPRESS_MIN_SIZE:
+            return response
+        with span('compress', encoding=encoding):
+            response.set_data(compress(body, encoding, GZIP_LEVEL, BROTLI_QUALITY))
 
-    return render_template('schema_selector.html', helper=HTML_HELPER, schemas=orderedReferences)
+    response.headers.set('Content-Encoding', encoding)
+    etag, weak = response.get_etag()
+    if etag is not None:
+        response.set_etag(encoded_etag(etag, encoding), weak)
+    return response
 
 # get the index page
 @app.route('/')
@@ -173,6 +342,7 @@ def index():
 def generate_yaml():
 
     response = request.form
+    display_names = get_catalogue().display_names
 
     # get the list of selected schemas and properties from the request
     selected_schemas = []
@@ -189,8 +359,8 @@ def generate_yaml():
         entry = {}
         tab = {}
 
-        if DISPLAY_NAME_MAP[schema]:
-            tab["display_name"] = DISPLAY_NAME_MAP[schema]
+        if display_names.get(schema):
+            tab["display_name"] = display_names[schema]
         else:
             tab["display_name"] = schema
 
@@ -209,14 +379,7 @@ def generate_yaml():
 
     # to generate a yaml file, dump the data structure out to yaml format
     if request.form['submitButton'] == 'yaml':
-        yaml_data = yaml.dump(yaml_json, default_flow_style=False)
-        now = datetime.datetime.now()
-        filename = "hca_yaml-" + now.strftime("%Y-%m-%dT%H-%M-%S") + ".yaml"
-        response = make_response(yaml_data)
-        response.headers.set('Content-Type', 'application/x-yaml')
-        response.headers.set('Content-Disposition', 'attachment',
-                             filename=filename)
-        return response
+        return _generate_yaml(yaml_json)
 
     # to generate a spreadsheet, conver the yaml json format to spreadsheet
     elif request.form['submitButton'] == 'spreadsheet':
@@ -239,87 +402,287 @@ def upload_spreadsheet():
         flash('Warning! File name blank!')
         return redirect(url_for('index'))
     if file and _allowed_file(file.filename):
-        # TO DO this is a hack to get past the 'No such file or directory' error
-        # but relies on directory being present - FIX!
-        file.save(os.path.join(app.config['UPLOAD_FOLDER'], file.filename))
-        wb = load_workbook(os.path.join(app.config['UPLOAD_FOLDER'], file.filename))
-
-        # we no longer needs the schemas tab but I left this in for now
-        if 'Schemas' in wb.sheetnames:
-            schemas = wb['Schemas']
-        elif 'schemas' in wb.sheetnames:
-            schemas = wb['schemas']
-        else:
-           schemas = None
-
-        latest_schemas = SCHEMA_TEMPLATE._get_latest_submittable_schema_urls(api_url)
-
-        tab_config = SCHEMA_TEMPLATE.tabs
-        tabs = wb.sheetnames
-
-        # go through each schema in the tab config and if it's present in the old spreadsheet, migrate it
-        # this approach is slightly inefficient as it ends up migrating schemas that are already at their
-        # latest version but it means no schemas tab is required - in order to migrate only tabs that have
-        # actually changed, we'd need to know the schema version of each tab in the old spreadsheet
-        for schema in tab_config:
-            tab_name = schema[list(schema.keys())[0]]['display_name']
-
-            if tab_name in tabs:
-                schema_name = list(schema.keys())[0]
-
-                for schema in latest_schemas:
-                    if schema_name in schema:
-                        print("Migrating " + tab_name)
-                        _migrate_schema(wb, schema)
-
-        # usual slightly complicated set-up to return the output spreadsheet
-        with tempfile.NamedTemporaryFile('w+b', delete=False) as ssheet_file:
-            temp_filename = ssheet_file.name
-
-            now = datetime.datetime.now()
-            export_filename = "hca_spreadsheet-" + now.strftime("%Y-%m-%dT%H-%M-%S") + "_migrated.xlsx"
-            wb.save(temp_filename)
-            wb.close()
-
-            response = make_response(ssheet_file.read())
-            response.headers.set('Content-Type', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-            response.headers.set('Content-Disposition', 'attachment',
-                                 filename=export_filename)
-            os.remove(temp_filename)
-            return response
+        with span('schema_urls'):
+            latest_schemas = latest_schema_urls()
+
+        # the upload is read straight from the request stream - only the header rows of each tab are parsed and
+        # rewritten, all the data rows are streamed through to the migrated spreadsheet unchanged.
+        # The migrated spreadsheet is spooled in the scratch space, in memory unless it gets large
+        ssheet_file = SCRATCH.spool()
+        try:
+            report = migrate_workbook(file.stream, ssheet_file, latest_schemas)
+        except Exception:
+            ssheet_file.close()
+            raise
+
+        now = datetime.datetime.now()
+        export_filename = "hca_spreadsheet-" + now.strftime("%Y-%m-%dT%H-%M-%S") + "_migrated.xlsx"
+        response = _stream_file(ssheet_file, XLSX_CONTENT_TYPE, export_filename)
+        response.headers.set('X-Migration-Report', json.dumps(report))
+        return response
+
+# function to migrate an older spreadsheet in a background job - returns the job's status with a link to poll
+@app.route('/jobs/upload_xls', methods=['POST'])
+def submit_migration_job():
+
+    if 'xlsfile' not in request.files:
+        return {'error': 'No file provided'}, 400
+    file = request.files['xlsfile']
+
+    if file.filename == '' or not _allowed_file(file.filename):
+        return {'error': 'File name blank or not a spreadsheet'}, 400
+
+    now = datetime.datetime.now()
+    export_filename = "hca_spreadsheet-" + now.strftime("%Y-%m-%dT%H-%M-%S") + "_migrated.xlsx"
+    return _submit_job('migration', file, export_filename, XLSX_CONTENT_TYPE, template_generator.migration_job)
+
+# function to generate a spreadsheet from a YAML file in a background job - returns the job's status with a link to poll
+@app.route('/jobs/upload_yaml_to_xls', methods=['POST'])
+def submit_generation_job():
+
+    if 'yamlfile' not in request.files:
+        return {'error': 'No file provided'}, 400
+    file = request.files['yamlfile']
+
+    if file.filename == '' or not _allowed_file(file.filename):
+        return {'error': 'File name blank or not a YAML file'}, 400
+
+    now = datetime.datetime.now()
+    export_filename = "hca_spreadsheet-" + now.strftime("%Y-%m-%dT%H-%M-%S") + ".xlsx"
+    return _submit_job('generation', file, export_filename, XLSX_CONTENT_TYPE, template_generator.generation_job)
+
+# function to migrate and/or generate a batch of spreadsheets in one go. Takes a zip file of spreadsheets and YAML
+# files (as zipfile) or the files themselves (as files), and returns a zip of the results with a report.json
+@app.route('/batch', methods=['POST'])
+def batch():
+
+    if 'zipfile' in request.files and request.files['zipfile'].filename != '':
+        try:
+            batch_files = read_batch(request.files['zipfile'].stream, BATCH_MAX_MEMBERS, BATCH_MAX_FILE_SIZE,
+                                     BATCH_MAX_SIZE)
+        except BatchException as e:
+            return {'error': str(e)}, 400
+    else:
+        batch_files = [(file.filename, file.read()) for file in request.files.getlist('files')
+                       if file.filename and _allowed_file(file.filename)]
+
+    if not batch_files:
+        return {'error': 'No spreadsheets or YAML files provided'}, 400
+
+    latest_schemas = list(latest_schema_urls())
+    results = SCRATCH.spool()
+    try:
+        with span('batch', files=len(batch_files)):
+            reports = run_batch(JOB_QUEUE.executor(job_worker_state()), batch_files, results,
+                                template_generator.process_batch_file, (latest_schemas,))
+    except Exception:
+        results.close()
+        raise
+    # the batch has been read into memory, so free it up before the results are sent
+    del batch_files
+
+    now = datetime.datetime.now()
+    response = _stream_file(results, 'application/zip', "hca_batch-" + now.strftime("%Y-%m-%dT%H-%M-%S") + ".zip")
+    response.headers.set('X-Batch-Report', json.dumps({
+        'done': len([report for report in reports if report['status'] == 'done']),
+        'failed': len([report for report in reports if report['status'] != 'done'])
+    }))
+    return response
+
+# uploads and generated files that would take the worker over its scratch quota are turned away until others finish
+@app.errorhandler(ScratchQuotaException)
+def _scratch_quota_exceeded(e):
+    response = make_response({'error': str(e)}, 503)
+    response.headers.set('Retry-After', '30')
+    return response
+
+# lists the template presets with whether each one is ready, and when it was built and how long that took
+@app.route('/templates', methods=['GET'])
+def list_templates():
+    presets = PRESETS.status()
+    for preset in presets:
+        preset['url'] = url_for('get_template', name=preset['name'])
+        if 'built' in preset:
+            preset['built'] = datetime.datetime.fromtimestamp(preset['built']).isoformat()
+    return {'presets': presets}
+
+# the spreadsheet (or with format=yaml, the YAML file) of a template preset. Presets are built ahead of time for the
+# latest schemas - one that is still being rebuilt for new schemas is generated on request instead
+@app.route('/templates/<name>', methods=['GET'])
+def get_template(name):
+    kind = request.args.get('format', 'xlsx')
+    if kind not in ('xlsx', 'yaml'):
+        return {'error': 'format must be xlsx or yaml'}, 400
+    definition = PRESETS.definition(name)
+    if definition is None:
+        return {'error': 'No such template preset'}, 404
+
+    build = PRESETS.get(name, job_worker_state()[0])
+    if build is None:
+        try:
+            yaml_json = preset_tabs(definition, get_catalogue(), os.path.dirname(template_generator.CONFIG_PATH))
+        except (OSError, ValueError, YamlException) as e:
+            return {'error': 'Template preset ' + name + " can't be built: " + str(e)}, 500
+        if kind == 'yaml':
+            return _generate_yaml(yaml_json)
+        return _generate_spreadsheet(yaml_json)
+
+    etag, content = build.files[kind]
+    response = _not_modified(etag)
+    if response is not None:
+        return response
+
+    built = datetime.datetime.fromtimestamp(build.built)
+    filename = "hca_" + name + "-" + built.strftime("%Y-%m-%dT%H-%M-%S") + "." + kind
+    content_type = XLSX_CONTENT_TYPE if kind == 'xlsx' else 'application/x-yaml'
+    response = _stream_file(io.BytesIO(content), content_type, filename)
+    response.set_etag(etag)
+    response.headers.set('X-Preset-Built', built.isoformat())
+    response.headers.set('X-Preset-Build-Seconds', str(round(build.seconds, 3)))
+    return response
+
+# returns the status of a background job
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    job = JOB_STORE.get(job_id)
+    if job is None:
+        return {'error': 'No such job, or it has expired'}, 404
+    return _job_status(job)
+
+# downloads the result of a background job once it's done
+@app.route('/jobs/<job_id>/download', methods=['GET'])
+def download_job(job_id):
+    job = JOB_STORE.get(job_id)
+    if job is None:
+        return {'error': 'No such job, or it has expired'}, 404
+    if job['status'] != 'done':
+        return _job_status(job), 409
+
+    # the result may have been swept up since the job's status was read, eg by another worker process
+    try:
+        file = open(JOB_STORE.result_path(job_id), 'rb')
+    except FileNotFoundError:
+        return {'error': 'The result of this job has been removed'}, 410
+
+    response = _stream_file(file, job['content_type'], job['filename'])
+    if job['kind'] == 'migration':
+        response.headers.set('X-Migration-Report', json.dumps(job['report']))
+    return response
 
 # convenience method to generate a spreadsheet from a pre-yaml data structure
 # using the schema template library's spreadsheet generator
 def _generate_spreadsheet(yaml_json):
-
-    # I know this looks like an unused property but it somehow doesn't work if you don't declare it here first
-    # slightly complicated set-up with named temp files to pass structures around and have a persistent file object
-    # that we can actually return to the browser
-    temp_yaml_filename = ""
-    with tempfile.NamedTemporaryFile('w', delete=False) as yaml_file:
-        yaml.dump(yaml_json, yaml_file)
-        temp_yaml_filename = yaml_file.name
-
-    with tempfile.NamedTemporaryFile('w+b', delete=False) as ssheet_file:
-        temp_filename = ssheet_file.name
-        spreadsheet_builder = VanillaSpreadsheetBuilder(temp_filename, True)
-        # TO DO currently automatically building WITH schemas tab - this should be customisable
-        spreadsheet_builder.generate_spreadsheet(tabs_template=temp_yaml_filename,
-                                                 schema_urls=SCHEMA_TEMPLATE._get_latest_submittable_schema_urls(api_url),
-                                                 include_schemas_tab=True)
-        spreadsheet_builder.save_spreadsheet()
-
-        os.remove(temp_yaml_filename)
-        now = datetime.datetime.now()
-        export_filename = "hca_spreadsheet-" + now.strftime("%Y-%m-%dT%H-%M-%S") + ".xlsx"
-
-        response = make_response(ssheet_file.read())
-        response.headers.set('Content-Type', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-        response.headers.set('Content-Disposition', 'attachment',
-                             filename=export_filename)
-        os.remove(temp_filename)
+    with span('schema_urls'):
+        latest_schemas = latest_schema_urls()
+
+    now = datetime.datetime.now()
+    export_filename = "hca_spreadsheet-" + now.strftime("%Y-%m-%dT%H-%M-%S") + ".xlsx"
+    return _cached_file(yaml_json, 'xlsx', XLSX_CONTENT_TYPE, export_filename,
+                        lambda file: build_spreadsheet(yaml_json, latest_schemas, file), latest_schemas)
+
+# convenience method to generate a YAML file from a pre-yaml data structure
+def _generate_yaml(yaml_json):
+    with span('schema_urls'):
+        latest_schemas = latest_schema_urls()
+
+    now = datetime.datetime.now()
+    filename = "hca_yaml-" + now.strftime("%Y-%m-%dT%H-%M-%S") + ".yaml"
+    return _cached_file(yaml_json, 'yaml', 'application/x-yaml', filename,
+                        lambda file: file.write(_dump_yaml(yaml_json)), latest_schemas)
+
+# helper function to serve a generated file from the output cache, generating it into a scratch file with
+# generate(file) and caching it if it isn't there. The cache key doubles as the ETag, so a browser that already has
+# the file just gets a 304 back
+def _cached_file(yaml_json, kind, content_type, filename, generate, schema_urls):
+    # files generated from older schemas are no use any more once the latest schemas change
+    OUTPUT_CACHE.sync(schema_urls)
+    key = output_key(yaml_json["tabs"], schema_urls, kind)
+
+    response = _not_modified(key)
+    if response is not None:
         return response
 
+    with span('cache_lookup'):
+        data = OUTPUT_CACHE.get(key)
+    cache_status = 'HIT'
+    if data is not None:
+        file = io.BytesIO(data)
+    else:
+        cache_status = 'MISS'
+        file = SCRATCH.spool()
+        try:
+            generate(file)
+            # files too big to cache are only ever streamed from the scratch space, never read into memory whole
+            if OUTPUT_CACHE.accepts(file.size):
+                OUTPUT_CACHE.put(key, file.getvalue())
+        except Exception:
+            file.close()
+            raise
+
+    response = _stream_file(file, content_type, filename)
+    response.set_etag(key)
+    response.headers.set('X-Cache', cache_status)
+    return response
+
+# helper function to render the schemas page. Only the schema sections are rendered - their properties are fetched
+# from the API when a section is expanded, so each section just carries the properties marked as preselected
+def _render_schemas(schema_properties):
+    preselected = {}
+    for schema in schema_properties:
+        # everything written to a catalogue view is in the top layer of its properties
+        preselected[schema["name"]] = [prop for prop, status in schema["properties"].maps[0].items()
+                                       if status == "pre-selected"]
+
+    with span('render'):
+        return render_template('schemas.html', helper=HTML_HELPER, schemas=schema_properties,
+                               preselected=preselected)
+
+# helper function to get the schemas and their module references for the preselection page as HTML. It only depends
+# on the catalogue, so it is rendered once per catalogue rather than on every page view
+def _references_html(catalogue):
+    global REFERENCES_HTML
+
+    rendered = REFERENCES_HTML
+    if rendered is None or rendered[0] is not catalogue:
+        with span('render_references'):
+            rendered = (catalogue, Markup(render_template('schema_references.html', schemas=catalogue.references)))
+        REFERENCES_HTML = rendered
+    return rendered[1]
+
+# helper function to get the offset and limit query parameters of a paged API request
+def _page(total):
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    limit = request.args.get('limit', total, type=int)
+    return offset, max(limit, 0)
+
+# helper function to send back compact JSON from the API (compressed by _compress_response if the client accepts
+# it). The catalogue never changes once built, so the ETag is worked out from the catalogue version, the config it
+# was built with and the request, and a client that already has the response gets a 304 without it being built
+def _api_response(catalogue, data):
+    etag = hashlib.sha1((catalogue.version + ' ' + str(catalogue.config.mtime) + ' ' + request.full_path)
+                        .encode('utf-8')).hexdigest()
+    response = _not_modified(etag)
+    if response is None:
+        with span('json_encode'):
+            body = json.dumps(data, separators=(',', ':')).encode('utf-8')
+        response = Response(body, content_type='application/json')
+        response.set_etag(etag)
+
+    response.vary.add('Accept-Encoding')
+    # the latest schemas can change, so clients have to check the ETag is still current before using their copy
+    response.headers.set('Cache-Control', 'no-cache')
+    return response
+
+# helper function to send back a 304 if the client already has the response with this ETag, compressed or not.
+# Returns None if it doesn't
+def _not_modified(etag):
+    matched = matching_etag(etag, request.if_none_match)
+    if matched is None:
+        return None
+    response = Response(status=304)
+    response.set_etag(matched)
+    return response
+
 # convenience function that processes an uploaded YAML file to identify which properties should be preselected
 def _process_uploaded_file(file):
     selected_schemas = []
@@ -340,393 +703,170 @@ def _process_uploaded_file(file):
     return selected_schemas, selected_properties
 
 # Convenience function that given a list of preselected schemas and properties,
-# marks the appropriate schemas and properties as to be selected in the full schemas list.
-# WARNING - does not include migrations, so if an old property is present, this will be added as a separate property!
-def _preselect_properties(schema_properties, selected_schemas, selected_references, selected_properties):
-    for schema in schema_properties:
-        if schema["name"] in selected_schemas:
-            schema["pre-selected"] = True
-            properties = schema["properties"]
-
-            if selected_references:
-                for ref in selected_references:
-                    t = ref.split(':')[0]
-                    val = ref.split(':')[1]
-                    if schema["name"] == t or schema["name"] == val:
-                        for prop in properties.keys():
-                            if (val == prop.split('.')[1] or (
-                                    len(prop.split('.')) == 2 and prop.split('.')[0] != 'process')) and properties[
-                                prop] == "not required":
-                                schema["properties"][prop] = "pre-selected"
-            if selected_properties:
-                if schema["name"] in selected_properties:
-                    sel_props = selected_properties[schema["name"]]
-
-                    for prop in sel_props:
-                        # Required properties will be pre-selected anyway so don't need to be marked again
-                        if prop in list(properties.keys()) and properties[prop] == "not required":
-                                schema["properties"][prop] = "pre-selected"
-                        # This clause was intended to deal with linking properties etc but also lets through
-                        # deleted and updated properties in this schema
-                        # TO DO: implement migration lookup for this clause for properties that are in this schema
-                        elif prop not in list(properties.keys()):
-                            schema["properties"][prop] = "pre-selected"
-    return schema_properties
-
-# helper function to load the config file
-def _loadConfig(file):
-    config_file = configparser.ConfigParser(allow_no_value=True)
-    config_file.read(file)
-    return config_file
-
-# helper function to get the Ingest API URL
-def _get_ingest_api_url():
-    env = ''
-    if 'system' in CONFIG_FILE and 'environment' in CONFIG_FILE['system']:
-        env = CONFIG_FILE['system']['environment']
-
-    if env == 'prod':
-        api_url = INGEST_API_URL.replace("{env}.", '')
-    else:
-        api_url = INGEST_API_URL.replace("{env}", env)
-
-    return api_url
-
+# marks the appropriate schemas and properties as to be selected in the full schemas list (see SchemaCatalogue.preselect)
+def _preselect_properties(catalogue, selected_schemas, selected_references, selected_properties):
+    with span('preselect'):
+        return catalogue.preselect(selected_schemas, selected_references, selected_properties)
 
 # flask convenience function
 def _allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-# helper function to convert properties as presented in the schema template library
-# to a format readable by the generator UI
-def _process_schemas():
-
-    tab_config = SCHEMA_TEMPLATE.tabs
-
-    unordered = {}
-    all_properties = []
-    # go through the schemas from the tab config one by one
-    for schema in tab_config:
-        property = {}
-
-        schema_name = list(schema.keys())[0]
-        if schema_name in EXCLUDED_SCHEMAS:
-            continue
-
-        # set the schema title, name and selection status
-        property["title"] = schema[schema_name]["display_name"]
-        property["name"] = schema_name
-        property["select"] = False
-        if "properties" not in property:
-            property["properties"] = {}
-
-        # go through all the properties in the schema
-        for p in schema[schema_name]['columns']:
-            # this deals with core and module properties
-            if len(p.split(".")) > 2:
-                parent = ".".join(p.split(".")[:-1])
-
-                # special case for modules with ontology imports where the field is required if the module is used,
-                # eg donor.timecourse.unit.text
-                if len(p.split(".")) == 4:
-                    if SCHEMA_TEMPLATE.lookup_property_from_template(parent)["required"]:
-                        parent = ".".join(parent.split(".")[:-1])
-                if SCHEMA_TEMPLATE.lookup_property_from_template(parent)["required"]:
-                    if SCHEMA_TEMPLATE.lookup_property_from_template(p)["required"]:
-                        property["properties"][p] = "required"
-                    else:
-                        property["properties"][p] = "not required"
-                else:
-                    property["properties"][p] = "not required"
-            else:
-                if SCHEMA_TEMPLATE.lookup_property_from_template(p)["required"]:
-                    property["properties"][p] = "required"
-                else:
-                    property["properties"][p] = "not required"
-
-        # create a separate process object for appending to other properties below
-        if property["name"] == "process":
-            process = property["properties"]
-            for k in process.keys():
-                if process[k] == "required":
-                    process[k] = "not required"
-
-        unordered[property["name"]] = property
-
-        # add the title of the schema to the global display name map
-        DISPLAY_NAME_MAP[property["name"]] = property["title"]
-
-    # add default biomaterial linking columns
-    if 'biomaterial_linking' in CONFIG_FILE:
-        for key in CONFIG_FILE['biomaterial_linking'].keys():
-            if key in unordered.keys():
-                biomaterials = []
-                if "," in CONFIG_FILE['biomaterial_linking'][key]:
-                    biomaterials = CONFIG_FILE['biomaterial_linking'][key].split(",")
-                else:
-                    biomaterials.append(CONFIG_FILE['biomaterial_linking'][key])
-                for biomaterial in biomaterials:
-                    if biomaterial in unordered.keys():
-                        linking_field = list(unordered[biomaterial]['properties'].keys())[0]
-                        unordered[key]['properties'][linking_field] = "not required"
-
-    # add default protocol linking columns
-    if 'protocol_linking' in CONFIG_FILE:
-        for key in CONFIG_FILE['protocol_linking'].keys():
-            if key in unordered.keys():
-                protocols = []
-                if "," in CONFIG_FILE['protocol_linking'][key]:
-                    protocols = CONFIG_FILE['protocol_linking'][key].split(",")
-                else:
-                    protocols.append(CONFIG_FILE['protocol_linking'][key])
-
-                for prot in protocols:
-                    if prot in unordered.keys():
-                        linking_field = list(unordered[prot]['properties'].keys())[0]
-                        unordered[key]['properties'][linking_field] = "not required"
-
-    # schemas should be ordered as per the ordering in the config file
-    if 'ordering' in CONFIG_FILE:
-        for key in CONFIG_FILE['ordering'].keys():
-            if key in unordered.keys():
-                # if the schema should have process fields appended according to the config file, append these
-                if CONFIG_FILE['ordering'][key] == 'process' and process != '':
-                    unordered[key]["properties"].update(process)
-
-                all_properties.append(unordered[key])
-            # deal with sub-tabs
-            elif CONFIG_FILE['ordering'][key] != '':
-                parent = CONFIG_FILE['ordering'][key]
-                if parent in unordered.keys():
-                    new_property = {}
-                    new_property["title"] = SCHEMA_TEMPLATE.lookup_property_from_template(parent)[key]['user_friendly']
-
-                    # tabs can't have a name that's longer than 32 characteres
-                    if len(DISPLAY_NAME_MAP[parent] + " - " + new_property["title"]) < 32:
-                        new_property["title"] = DISPLAY_NAME_MAP[parent] + " - " + new_property["title"]
-                    new_property["name"] = key
-                    new_property["select"] = False
-                    if "properties" not in new_property:
-                        new_property["properties"] = {}
-
-                    for prop in unordered[parent]['properties']:
-                        if key in prop:
-                            new_property["properties"][prop] = unordered[parent]['properties'][prop]
-
-                    for moved_prop in new_property["properties"]:
-                        unordered[parent]['properties'].pop(moved_prop)
-
-                    DISPLAY_NAME_MAP[new_property["name"]] = new_property["title"]
-
-                    all_properties.append(new_property)
-
-                    print(key + " is a recorded sub-property")
-            else:
-                print(key + " is currently not a recorded property")
-
-    return all_properties
-
-
-# helper function to extract the $ref properties (core and module references) from a schema
-def _extract_references(properties, name, title, schema):
-
-    # direct property = properties of the schema (incl wrapper properties for imports)
-    direct_properties = []
-    for property in properties:
-        prop = property.split('.')[1]
-        direct_properties.append(prop)
-
-    structure = {}
-    structure["title"] = title
-    structure["name"] = name
-
-    references = {}
-
-    for dp in direct_properties:
-        if dp not in EXCLUDED_PROPERTIES:
-            # if the property exists and has a 'value_type' field and 'value_type' is an object and
-            # the property isn't already on the list of references
-            app.logger.info("direct property is: " + dp)
-            if schema[dp] and schema[dp]['value_type'] \
-                    and schema[dp]['value_type'] == 'object' \
-                    and dp not in references.keys():
-                if schema[dp]['required']:
-                    references[dp] = "required"
-                else:
-                    references[dp] = "not required"
-    structure["references"] = references
-    return structure
-
-# helper function to actually migrate the schema
-def _migrate_schema(workbook, schema_url):
-    schema_key = schema_url.split('/')[-1]
-    schema_version = schema_url.split('/')[-2]
-
-    linked_tabs = []
-
-    # find out from the config file if this schema has dependent sub-schemas (eg contact, publications etc for project)
-    if 'ordering' in CONFIG_FILE:
-        if 'ordering' in CONFIG_FILE:
-            for key in CONFIG_FILE['ordering'].keys():
-                if CONFIG_FILE['ordering'][key] == schema_key:
-                    linked_tabs.append(key)
-
-
-    tab_config = SCHEMA_TEMPLATE.tabs
-
-    for schema in tab_config.lookup('tabs'):
-        if schema_key == list(schema.keys())[0]:
-            tab_name = schema[schema_key]['display_name']
-
-            _update_tab(workbook, schema_key, tab_name, schema_version)
-
-            # if there are dependent tabs, update these as well
-            if linked_tabs:
-                for tab in linked_tabs:
-                    linked_tab_name = tab_config.lookup('meta_data_properties')[schema_key][tab]['user_friendly']
-                    try:
-                        workbook[linked_tab_name]
-                    except:
-                        print("No tab found for key " + linked_tab_name)
-
-                        if len(tab_name + " - " + linked_tab_name) < 32:
-                            linked_tab_name = tab_name + " - " + linked_tab_name
-                        else:
-                            linked_tab_name = linked_tab_name
-
-                    _update_tab(workbook, schema_key, linked_tab_name, schema_version)
-
-
-# convenience function to update a given tab in the work book
-def _update_tab(workbook, schema_name, tab_name, schema_version):
+# sets up the config, schema template and schema catalogue for the app. Each worker process of a multi-worker server
+# should call this once, eg with gunicorn: gunicorn -w 4 'template_generator_app:init_app()'
+def init_app(config_file='config.ini'):
+    global OUTPUT_CACHE, SCRATCH, COMPRESSION, COMPRESS_MIN_SIZE, GZIP_LEVEL, BROTLI_QUALITY, SERVER_TIMING, \
+        LOG_SPANS, PROFILE_DIR, JOB_STORE, JOB_QUEUE, BATCH_MAX_MEMBERS, BATCH_MAX_FILE_SIZE, BATCH_MAX_SIZE, PRESETS
+
+    mode = template_generator.init(config_file)
+    config = template_generator.CONFIG_FILE
+
+    job_config = config['jobs'] if 'jobs' in config else {}
+    JOB_STORE = JobStore(job_config.get('directory') or os.path.join(tempfile.gettempdir(), 'generator-jobs'),
+                         ttl=int(job_config.get('ttl') or 3600), max_jobs=int(job_config.get('max_jobs') or 100))
+    JOB_QUEUE = JobQueue(JOB_STORE, workers=int(job_config.get('workers') or DEFAULT_WORKERS),
+                         initializer=template_generator.init_job_worker)
+
+    preset_config = config['preset_build'] if 'preset_build' in config else {}
+    PRESETS = PresetLibrary(preset_config.get('directory') or None,
+                            max_parallel=int(preset_config.get('max_parallel') or 1),
+                            max_age=int(preset_config.get('max_age') or 3600))
+
+    if 'batch' in config:
+        BATCH_MAX_MEMBERS = config['batch'].getint('max_files', BATCH_MAX_MEMBERS)
+        BATCH_MAX_FILE_SIZE = config['batch'].getint('max_file_mb', BATCH_MAX_FILE_SIZE // 1024 // 1024) * 1024 * 1024
+        BATCH_MAX_SIZE = config['batch'].getint('max_total_mb', BATCH_MAX_SIZE // 1024 // 1024) * 1024 * 1024
+
+    if 'tracing' in config:
+        SERVER_TIMING = config['tracing'].getboolean('server_timing', True)
+        LOG_SPANS = config['tracing'].getboolean('log_spans', False)
+        PROFILE_DIR = config['tracing'].get('profile_dir') or None
+
+    if 'compression' in config:
+        COMPRESSION = config['compression'].getboolean('enabled', True)
+        COMPRESS_MIN_SIZE = config['compression'].getint('min_size', COMPRESS_MIN_SIZE)
+        GZIP_LEVEL = config['compression'].getint('gzip_level', GZIP_LEVEL)
+        BROTLI_QUALITY = config['compression'].getint('brotli_quality', BROTLI_QUALITY)
+
+    scratch_config = config['scratch'] if 'scratch' in config else {}
+    SCRATCH = ScratchStore(scratch_config.get('directory') or os.path.join(tempfile.gettempdir(), 'generator-scratch'),
+                           spool_max_size=int(scratch_config.get('spool_max_mb') or 8) * 1024 * 1024,
+                           quota=int(scratch_config.get('quota_mb') or 2048) * 1024 * 1024,
+                           max_age=int(scratch_config.get('max_age') or 3600),
+                           sweep_interval=int(scratch_config.get('sweep_interval') or 300)).start()
+
+    if 'cache' in config:
+        cache_config = config['cache']
+        OUTPUT_CACHE = OutputCache(max_entries=cache_config.getint('max_entries', 64),
+                                   max_bytes=cache_config.getint('max_memory_mb', 64) * 1024 * 1024,
+                                   disk_dir=cache_config.get('disk_dir') or None)
+
+    # the schema template has just loaded the latest schemas (or the snapshot's), so the registry can start off
+    # with those. Snapshot-only mode never goes to the Ingest API
+    # with refresh_schemas on, whenever the registry finds new schema versions just those schemas are loaded and
+    # swapped in, rather than the app having to be restarted
+    # either way, the template presets are rebuilt whenever the latest schemas change
+    ttl = 300
+    on_refresh = _refresh_schemas_and_presets
+    if 'schema_registry' in config:
+        ttl = config['schema_registry'].getint('ttl', ttl)
+        if not config['schema_registry'].getboolean('refresh_schemas', True):
+            on_refresh = _sync_presets
+    if mode == 'snapshot':
+        ttl = 0
+    template_generator.SCHEMA_REGISTRY = SchemaRegistry(
+        template_generator.api_url, ttl=ttl, schema_urls=template_generator.SCHEMA_TEMPLATE.metadata_schema_urls,
+        on_refresh=on_refresh).start()
+
+    # build the schema catalogue up front rather than on the first request, and start building the template presets
+    get_catalogue()
+    _sync_presets()
+
+    if mode == 'snapshot_then_refresh':
+        threading.Thread(target=_refresh_schema_template, name='schema-refresh', daemon=True).start()
+
+    # changes to the ordering, linking and blacklist in the config file can be picked up without a restart
+    if 'config' in config:
+        interval = config['config'].getint('reload_interval', 0)
+        ConfigWatcher(template_generator.CONFIG_PATH, interval, _reload_config_and_presets,
+                      mtime=template_generator.CONFIG.mtime).start()
+
+    return app
+
+# loads the latest schemas from the Ingest API and swaps them in for the ones loaded from the snapshot - only the
+# schemas that have changed since the snapshot was taken are fetched. Requests carry on being served from the
+# snapshot until this is done, or for good if it fails
+def _refresh_schema_template():
+    registry = template_generator.SCHEMA_REGISTRY
+    registry.refresh()
+    # does nothing if the registry has already had the schemas refreshed
+    template_generator.refresh_schema_template(registry.schema_urls())
+    _sync_presets()
+
+# loads any schemas that have changed in a refresh of the latest schemas, then rebuilds the template presets for them
+def _refresh_schemas_and_presets(latest_schemas=None):
+    template_generator.refresh_schema_template(latest_schemas)
+    _sync_presets()
+
+# reloads the config file, then rebuilds the template presets if it was swapped in
+def _reload_config_and_presets():
+    if template_generator.reload_config():
+        _sync_presets()
+
+# starts rebuilding the template presets in the job pool if the schemas, the latest schemas or the config have
+# changed since they were last built. The schema registry passes in the latest schemas, but they are read from it
+# anyway. If the rebuild can't be started the presets are generated on request like any other template, until the
+# next refresh tries again
+def _sync_presets(latest_schemas=None):
     try:
-        current_tab = workbook[tab_name]
-
-        # look only a programmatic names in row 4
-        for col in current_tab.iter_cols(min_row=4, max_row=4):
-            for cell in col:
-
-                # if there is actually a programmatic name in the cell, process this column
-                if cell.value is not None:
-                    # try to look up the programmatic name in the schema template - if success,
-                    # update the user friendly properties as we don't know if the minor or patch
-                    # schema version might have changed
-                    try:
-                        new_property = SCHEMA_TEMPLATE.lookup_property_from_template(cell.value)
-                        _update_user_properties(cell.value, cell.col_idx, current_tab,
-                                                SCHEMA_TEMPLATE.lookup_property_from_template(cell.value)["required"],
-                                                schema_name)
-
-                    # if the property from the spreadsheet isn't found in the lookup, try to migrate it
-                    except UnknownKeySchemaException:
-                        try:
-                            new_property = SCHEMA_TEMPLATE.lookup_absolute_latest_key_migration(cell.value)
-                            # if a new property exists for the cell value, set the cell value to the new property,
-                            # then update the user friendly fields for the column
-                            if new_property is not "":
-                                cell.value = new_property
-                                _update_user_properties(new_property, cell.col_idx, current_tab,
-                                                        SCHEMA_TEMPLATE.lookup_property_from_template(new_property)["required"],
-                                                        schema_name)
-
-                        # if the migration lookup fails but there is a version at which this property was migrated,
-                        # assume it was deleted and delete the column
-                        except UnknownKeySchemaException:
-                            print("property not found in migrations.")
-                            # Not sure how to fix this yet, the below method no longer exists
-                            # if SCHEMA_TEMPLATE._lookup_migration_version(cell.value) is not None:
-                            #     current_tab.delete_cols(cell.col_idx, 1)
-
-    except Exception:
-       print("No tab found for key " + tab_name)
-
-
-# WARNING: This code duplicates a large section of the ingest-client spreadsheet builder. Updates to the
-# relevant spreadsheet builder code should be mimicked here!
-def _update_user_properties(col_name, col_index, current_tab, required, tab_schema):
-
-    # slightly complicated set-up to deal with the fact that any .text field from an ontology module should
-    # actually use the user-friendly name/description/example/required status of its wrapper property
-    if col_name.split(".")[-1] == "text":
-        uf = _get_value_for_column(col_name.replace('.text', ''), "user_friendly").upper()
-    else:
-        uf = _get_value_for_column(col_name, "user_friendly").upper()
-    if col_name.split(".")[-1] == "text":
-        desc = _get_value_for_column(col_name.replace('.text', ''), "description")
-        if desc == "":
-            desc = _get_value_for_column(col_name, "description")
-    else:
-        desc = _get_value_for_column(col_name, "description")
-    if col_name.split(".")[-1] == "text":
-        required = bool(_get_value_for_column(col_name.replace('.text', ''), "required"))
-    else:
-        required = bool(_get_value_for_column(col_name, "required"))
-    if col_name.split(".")[-1] == "text":
-        example_text = _get_value_for_column(col_name.replace('.text', ''), "example")
-        if example_text == "":
-            example_text = _get_value_for_column(col_name, "example")
-    else:
-        example_text = _get_value_for_column(col_name, "example")
-    if col_name.split(".")[-1] == "text":
-        guidelines = _get_value_for_column(col_name.replace('.text', ''), "guidelines")
-        if guidelines == "":
-            guidelines = _get_value_for_column(col_name, "guidelines")
-    else:
-        guidelines = _get_value_for_column(col_name, "guidelines")
-
-    # alternative set-up to deal with correct labelling of barcode and kit imports
-    # (eg UMI barcode - foo vs cell barcode - foo)
-    wrapper = ".".join(col_name.split(".")[:-1])
-    if SCHEMA_TEMPLATE.lookup(wrapper)['schema']['module'] \
-            and (SCHEMA_TEMPLATE.lookup(wrapper)['schema']['module'] == 'purchased_reagents'
-                 or SCHEMA_TEMPLATE.lookup(wrapper)['schema']['module'] == 'barcode') \
-            and SCHEMA_TEMPLATE.lookup(wrapper)['multivalue'] == False:
-        uf = (SCHEMA_TEMPLATE.lookup(wrapper)['user_friendly'] + " - " + uf).upper()
-
-    # core fields like ID and name for biomaterial and protocol should be referred to by the schema name,
-    # eg donor organism id rather than biomaterial id
-    if "BIOMATERIAL " in uf:
-        schema_name = col_name.split(".")[0]
-
-        for schema in SCHEMA_TEMPLATE.tab_config.lookup('tabs'):
-            if schema_name == list(schema.keys())[0]:
-                schema_uf = schema[schema_name]['display_name']
-        uf = uf.replace("BIOMATERIAL", schema_uf.upper())
-
-        if tab_schema != schema_name:
-            uf = "INPUT " + uf
-
-    if "PROTOCOL " in uf:
-        schema_name = col_name.split(".")[0]
-
-        for schema in SCHEMA_TEMPLATE.tab_config.lookup('tabs'):
-            if schema_name == list(schema.keys())[0]:
-                schema_uf = schema[schema_name]['display_name']
-        uf = uf.replace("PROTOCOL", schema_uf.upper())
-
-    if required:
-        uf = uf + " (Required)"
-
-    current_tab.cell(row=1, column=col_index, value=uf)
-    # set the description
-    current_tab.cell(row=2, column=col_index, value=desc)
-
-    # write example
-    if example_text:
-        current_tab.cell(row=3, column=col_index, value=guidelines + ' For example: ' + example_text)
-    else:
-        current_tab.cell(row=3, column=col_index, value=guidelines)
-
-# convenience function to look up a property (user friendly name, description etc) for a column
-# from the schema template library
-def _get_value_for_column(col_name, property):
-    try:
-        uf = str(SCHEMA_TEMPLATE.lookup(col_name + "." + property)) \
-            if SCHEMA_TEMPLATE.lookup(col_name + "." + property) else ""
-        return uf
-    except Exception:
-        print("No property " + property + " for " + col_name)
-        return ""
+        state = job_worker_state()
+        config = template_generator.CONFIG_FILE
+        definitions = dict(config['presets']) if 'presets' in config else {}
+        PRESETS.sync(state[0], definitions, get_catalogue(), latest_schema_urls(),
+                     os.path.dirname(template_generator.CONFIG_PATH), JOB_QUEUE.executor(state),
+                     template_generator.preset_job)
+    except Exception as e:
+        print("Couldn't rebuild the template presets: " + str(e))
+
+
+# helper function to save an uploaded file as the input of a new background job and queue it
+def _submit_job(kind, file, filename, content_type, function):
+    latest_schemas = latest_schema_urls()
+
+    job = JOB_STORE.create(kind, filename, content_type)
+    file.save(JOB_STORE.input_path(job['id']))
+    JOB_QUEUE.submit(job['id'], function, (list(latest_schemas),), job_worker_state())
+
+    return _job_status(job), 202
+
+def _job_status(job):
+    status = job_status(job)
+    status['status_url'] = url_for('get_job', job_id=job['id'])
+    if job['status'] == 'done':
+        status['download_url'] = url_for('download_job', job_id=job['id'])
+    return status
+
+# helper function to dump a pre-yaml data structure to the content of a YAML file
+def _dump_yaml(yaml_json):
+    with span('yaml_dump'):
+        return dump_yaml(yaml_json)
+
+# helper function to stream a file back to the browser in chunks as a download, closing it once it has been sent
+def _stream_file(file, content_type, filename):
+    size = file.seek(0, os.SEEK_END)
+    file.seek(0)
+
+    def generate():
+        try:
+            for chunk in iter(lambda: file.read(CHUNK_SIZE), b''):
+                yield chunk
+        finally:
+            file.close()
+
+    response = Response(generate(), content_type=content_type)
+    response.headers.set('Content-Length', str(size))
+    response.headers.set('Content-Disposition', 'attachment', filename=filename)
+    return response
 
 
 # main launcher for running the app locally
@@ -738,21 +878,6 @@ if __name__ == '__main__':
     #     dir = dir.replace('/generator', '')
     # base_uri = dir + "/"
 
-    CONFIG_FILE = _loadConfig('config.ini')
-
-    if 'blacklist' in CONFIG_FILE and 'schema_list' in CONFIG_FILE['blacklist']:
-        EXCLUDED_SCHEMAS = CONFIG_FILE['blacklist']['schema_list'].split(',')
-
-    env = ''
-    if 'system' in CONFIG_FILE and 'environment' in CONFIG_FILE['system']:
-        env = CONFIG_FILE['system']['environment']
-
-    if env == 'prod':
-        api_url = INGEST_API_URL.replace("{env}.", '')
-    else:
-        api_url = INGEST_API_URL.replace("{env}", env)
-
-    SCHEMA_TEMPLATE = SchemaTemplate(ingest_api_url=api_url,
-                                     migrations_url='https://schema.humancellatlas.org/property_migrations')
+    init_app('config.ini')
 
-    app.run(host='0.0.0.0', port=5000)
+    app.run(host='0.0.0.0', port=5000, threaded=True)
@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+# Lightweight tracing for the request pipeline. Stages of a request are wrapped in named spans, eg
+#
+#     with span('spreadsheet_build'):
+#         ...
+#
+# Every span is recorded against the trace of the request it ran in (so it can be sent back in a Server-Timing
+# header or logged as a structured log line) and added to process-wide timing histograms that can be scraped in the
+# Prometheus text format. Spans outside of a request (eg a background schema refresh) only go to the histograms.
+import cProfile
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+# upper bounds (in seconds) of the histogram buckets
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_local = threading.local()
+
+
+class Trace:
+
+    def __init__(self, name):
+        self.name = name
+        self.start = time.perf_counter()
+        self.spans = []
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.start
+
+    # span durations totalled by name, in the order the spans first ran, as {name: (total seconds, count)}
+    def totals(self):
+        totals = OrderedDict()
+        for name, duration, _ in self.spans:
+            total, count = totals.get(name, (0.0, 0))
+            totals[name] = (total + duration, count + 1)
+        return totals
+
+    # the value of a Server-Timing header for this trace
+    def server_timing(self):
+        entries = []
+        for name, (total, count) in self.totals().items():
+            entry = name
+            if count > 1:
+                entry += ';desc="' + str(count) + ' calls"'
+            entries.append(entry + ';dur=' + '%.1f' % (total * 1000))
+        entries.append('total;dur=' + '%.1f' % (self.elapsed * 1000))
+        return ', '.join(entries)
+
+    # a structured log record for this trace, with every span and its attributes
+    def record(self, **fields):
+        record = OrderedDict()
+        record['trace'] = self.name
+        record.update(fields)
+        record['duration_ms'] = round(self.elapsed * 1000, 3)
+        record['spans'] = [dict(attributes, name=name, duration_ms=round(duration * 1000, 3))
+                           for name, duration, attributes in self.spans]
+        return json.dumps(record)
+
+
+class Histogram:
+
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                self.counts[i] += 1
+
+
+class Metrics:
+
+    def __init__(self):
+        self._spans = {}
+        self._requests = {}
+        self._lock = threading.Lock()
+
+    def observe_span(self, name, duration):
+        with self._lock:
+            histogram = self._spans.get(name)
+            if histogram is None:
+                histogram = self._spans[name] = Histogram()
+            histogram.observe(duration)
+
+    def count_request(self, endpoint, status):
+        with self._lock:
+            key = (endpoint, str(status))
+            self._requests[key] = self._requests.get(key, 0) + 1
+
+    # the metrics in the Prometheus text format. extra is a list of (name, help, type, value) for other values to
+    # export alongside the spans, eg cache counters
+    def render(self, extra=()):
+        lines = [
+            '# HELP generator_span_seconds Time spent in each stage of the request pipeline',
+            '# TYPE generator_span_seconds histogram'
+        ]
+        with self._lock:
+            for name in sorted(self._spans):
+                histogram = self._spans[name]
+                for bound, count in zip(BUCKETS, histogram.counts):
+                    lines.append('generator_span_seconds_bucket{span="%s",le="%s"} %d' % (name, bound, count))
+                lines.append('generator_span_seconds_bucket{span="%s",le="+Inf"} %d' % (name, histogram.count))
+                lines.append('generator_span_seconds_sum{span="%s"} %f' % (name, histogram.sum))
+                lines.append('generator_span_seconds_count{span="%s"} %d' % (name, histogram.count))
+
+            lines.append('# HELP generator_requests_total Requests handled, by endpoint and status')
+            lines.append('# TYPE generator_requests_total counter')
+            for (endpoint, status), count in sorted(self._requests.items()):
+                lines.append('generator_requests_total{endpoint="%s",status="%s"} %d' % (endpoint, status, count))
+
+        for name, help, metric_type, value in extra:
+            lines.append('# HELP ' + name + ' ' + help)
+            lines.append('# TYPE ' + name + ' ' + metric_type)
+            lines.append(name + ' ' + str(value))
+
+        return '\n'.join(lines) + '\n'
+
+
+METRICS = Metrics()
+
+
+# starts a trace for the current thread, eg at the start of a request
+def start_trace(name):
+    _local.trace = Trace(name)
+    return _local.trace
+
+
+# ends the current thread's trace and returns it
+def end_trace():
+    trace = getattr(_local, 'trace', None)
+    _local.trace = None
+    return trace
+
+
+def current_trace():
+    return getattr(_local, 'trace', None)
+
+
+# times the code in the with block as a named span. Any attributes (eg the tab being migrated) go in the
+# structured log record of the trace
+@contextmanager
+def span(name, **attributes):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - start
+        METRICS.observe_span(name, duration)
+        trace = current_trace()
+        if trace is not None:
+            trace.spans.append((name, duration, attributes))
+
+
+class Profile:
+
+    def __init__(self, directory, name):
+        self.directory = directory
+        self.name = name
+        self.profiler = cProfile.Profile()
+        self.profiler.enable()
+
+    # stops profiling and writes the stats to a file in the profile directory, returning its path.
+    # The file can be read with pstats or a viewer such as snakeviz
+    def dump(self):
+        self.profiler.disable()
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, '%s-%d-%d.prof' % (self.name, time.time() * 1000, os.getpid()))
+        self.profiler.dump_stats(path)
+        return path
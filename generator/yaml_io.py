@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+# Reading and writing the YAML files of tabs that the generator takes and produces, eg
+#   tabs:
+#   - donor_organism:
+#       display_name: Donor organism
+#       columns:
+#       - donor_organism.biomaterial_core.biomaterial_id
+#
+# Uploaded files can't be trusted, so they are only ever loaded with the safe loader, and checked before anything is
+# built from them: files over a size limit aren't parsed at all, and a parsed file whose nodes (counting every use of
+# an alias) go over a limit, or that isn't a list of tabs, is rejected before it is turned into Python objects. The
+# libyaml based loader and dumper are used when PyYAML was built with them, the pure Python ones otherwise.
+import yaml
+from yaml.nodes import MappingNode, ScalarNode, SequenceNode
+
+try:
+    from yaml import CSafeDumper as SafeDumper, CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeDumper, SafeLoader
+
+# a YAML file of every column of every schema is a few hundred kB with a few tens of thousands of nodes
+MAX_YAML_BYTES = 10 * 1024 * 1024
+MAX_YAML_NODES = 500000
+
+STR_TAG = 'tag:yaml.org,2002:str'
+
+
+class YamlException(Exception):
+    pass
+
+
+# loads a YAML file of tabs from its content (a string or bytes) or a file object, returning it as
+# {'tabs': [{schema: {'display_name': ..., 'columns': [...]}}]}. Raises YamlException if the file is too big, isn't
+# YAML or isn't a list of tabs
+def load_tabs(source, max_bytes=MAX_YAML_BYTES, max_nodes=MAX_YAML_NODES):
+    if hasattr(source, 'read'):
+        # only read as much as is allowed, rather than all of a huge file
+        content = source.read(max_bytes + 1)
+    else:
+        content = source
+    if len(content) > max_bytes:
+        raise YamlException("YAML file is bigger than the limit of " + str(max_bytes // 1024) + " kB")
+
+    loader = SafeLoader(content)
+    try:
+        node = loader.get_single_node()
+        if node is None:
+            raise YamlException("YAML file is empty")
+        _check_tabs(node, max_nodes)
+        return loader.construct_document(node)
+    except yaml.YAMLError as e:
+        raise YamlException("Not a valid YAML file: " + str(e))
+    finally:
+        loader.dispose()
+
+# dumps a data structure, eg a set of tabs, to the content of a YAML file
+def dump_yaml(data):
+    return yaml.dump(data, Dumper=SafeDumper, default_flow_style=False, encoding='utf-8')
+
+# helper function to check the parsed nodes of a YAML file are a list of tabs, in a single pass that also counts the
+# nodes - nodes used more than once via an alias are counted (and checked) every time, as they would be when the
+# tabs are processed
+def _check_tabs(root, max_nodes):
+    if not isinstance(root, MappingNode):
+        raise YamlException("A YAML file of tabs must be a mapping with a list of tabs")
+
+    nodes = 0
+    has_tabs = False
+    # nodes still to visit, with what each one should be
+    stack = [(root, 'root')]
+    while stack:
+        node, expected = stack.pop()
+        nodes += 1
+        if nodes > max_nodes:
+            raise YamlException("YAML file has more than the limit of " + str(max_nodes) + " nodes")
+
+        if expected == 'root':
+            for key, value in node.value:
+                nodes += 1
+                if key.value == 'tabs':
+                    has_tabs = True
+                    stack.append((value, 'tabs'))
+                else:
+                    stack.append((value, None))
+        elif expected == 'tabs':
+            _expect(node, SequenceNode, "tabs must be a list")
+            stack.extend((tab, 'tab') for tab in node.value)
+        elif expected == 'tab':
+            _expect(node, MappingNode, "each tab must be a mapping of a schema name to its display name and columns")
+            if len(node.value) != 1 or not _is_string(node.value[0][0]):
+                raise _error(node, "each tab must have exactly one schema name")
+            nodes += 1
+            stack.append((node.value[0][1], 'schema'))
+        elif expected == 'schema':
+            _expect(node, MappingNode, "a tab must have a display name and columns")
+            keys = set()
+            for key, value in node.value:
+                nodes += 1
+                keys.add(key.value)
+                if key.value == 'columns':
+                    stack.append((value, 'columns'))
+                elif key.value == 'display_name':
+                    stack.append((value, 'string'))
+                else:
+                    stack.append((value, None))
+            if 'columns' not in keys:
+                raise _error(node, "a tab must have a list of columns")
+            if 'display_name' not in keys:
+                raise _error(node, "a tab must have a display name")
+        elif expected == 'columns':
+            _expect(node, SequenceNode, "columns must be a list")
+            stack.extend((column, 'string') for column in node.value)
+        elif expected == 'string':
+            if not _is_string(node):
+                raise _error(node, "display names and columns must be strings")
+        elif isinstance(node, SequenceNode):
+            stack.extend((item, None) for item in node.value)
+        elif isinstance(node, MappingNode):
+            for key, value in node.value:
+                stack.append((key, None))
+                stack.append((value, None))
+
+    if not has_tabs:
+        raise YamlException("A YAML file of tabs must have a list of tabs")
+
+def _is_string(node):
+    return isinstance(node, ScalarNode) and node.tag == STR_TAG
+
+def _expect(node, node_type, message):
+    if not isinstance(node, node_type):
+        raise _error(node, message)
+
+def _error(node, message):
+    return YamlException("Not a valid YAML file of tabs, " + message + " (line " + str(node.start_mark.line + 1) + ")")
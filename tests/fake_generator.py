@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+# Sets up the generator for the tests with the fake schemas from benchmarks/fake_schemas.py, so that nothing needs
+# network access. Importing this puts the generator and benchmarks directories on the path.
+import os
+import sys
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+GENERATOR_DIR = os.path.join(os.path.dirname(TESTS_DIR), 'generator')
+BENCHMARK_DIR = os.path.join(os.path.dirname(TESTS_DIR), 'benchmarks')
+CONFIG_PATH = os.path.join(GENERATOR_DIR, 'config.ini')
+
+sys.path.insert(0, BENCHMARK_DIR)
+sys.path.insert(0, GENERATOR_DIR)
+
+import fake_schemas
+import template_generator
+from generator_config import load_config
+
+
+# loads a fake schema set (see fake_schemas.make_template) into the generator in place of whatever was loaded before,
+# with the config file from the generator directory. Returns the schema template
+def use_fake_schemas(schemas=fake_schemas.STANDARD_SCHEMA_COUNT, columns=10, versions=None):
+    schema_template = fake_schemas.make_template(schemas, columns, versions)
+
+    template_generator.CONFIG_PATH = CONFIG_PATH
+    template_generator.CONFIG = load_config(CONFIG_PATH)
+    template_generator.CONFIG_FILE = template_generator.CONFIG.parser
+    template_generator.api_url = 'http://ingest.invalid'
+    template_generator.SCHEMA_TEMPLATE = schema_template
+    template_generator.SCHEMA_REGISTRY = None
+    template_generator.CATALOGUE = None
+    template_generator.SCHEMA_INDEX = None
+    template_generator.SCHEMA_INDEX_VERSION = None
+    return schema_template
+
+# the form data of a POST to /generate selecting every property of every schema, submitted to generate a 'yaml' file
+# or a 'spreadsheet'
+def generate_form(schema_template, submit_button):
+    schemas = []
+    properties = []
+    for tab in schema_template.tabs:
+        for key, detail in tab.items():
+            schemas.append(key)
+            properties.extend(key + ':' + column for column in detail['columns'])
+    return {'schema': schemas, 'property': properties, 'submitButton': submit_button}
@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+# Tests of reading batches of spreadsheets and YAML files with batch.py. Run from the repo root with
+#   python -m pytest tests
+import io
+import os
+import sys
+import unittest
+import zipfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'generator'))
+
+from batch import BatchException, read_batch
+
+
+def _zip(files):
+    content = io.BytesIO()
+    with zipfile.ZipFile(content, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for name, data in files:
+            archive.writestr(name, data)
+    content.seek(0)
+    return content
+
+
+class ReadBatchTest(unittest.TestCase):
+
+    def test_reads_batch_files(self):
+        batch = _zip([('a.yaml', b'tabs: []'), ('sub/b.xlsx', b'xlsx'), ('notes.txt', b'skipped')])
+        self.assertEqual(read_batch(batch), [('a.yaml', b'tabs: []'), ('sub/b.xlsx', b'xlsx')])
+
+    def test_rejects_too_many_members(self):
+        with self.assertRaisesRegex(BatchException, "more than 2 files"):
+            read_batch(_zip([('a.yaml', b''), ('b.yaml', b''), ('c.txt', b'')]), max_members=2)
+
+    def test_rejects_file_that_uncompresses_too_big(self):
+        # a megabyte of zeros compresses down to a kilobyte or so
+        batch = _zip([('bomb.xlsx', b'\0' * 1024 * 1024)])
+        with self.assertRaisesRegex(BatchException, "bomb.xlsx is bigger than the limit"):
+            read_batch(batch, max_file_size=1024)
+
+    def test_rejects_files_that_add_up_too_big(self):
+        batch = _zip([('a.xlsx', b'\0' * 600), ('b.xlsx', b'\0' * 600)])
+        with self.assertRaisesRegex(BatchException, "can't add up to more than"):
+            read_batch(batch, max_file_size=1000, max_size=1000)
+
+
+if __name__ == '__main__':
+    unittest.main()
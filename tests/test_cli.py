@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# Tests of the command line tool in cli.py, with the schemas loaded from a snapshot of the fake schemas. Run from the
+# repo root with
+#   python -m pytest tests
+import contextlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import openpyxl
+import yaml
+
+from fake_generator import CONFIG_PATH, fake_schemas
+import cli
+from schema_snapshot import save_snapshot
+
+
+class CliTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='generator-test-')
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.snapshot = self._path('schemas.snapshot')
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.schema_template = fake_schemas.make_template(columns=3)
+        save_snapshot(self.snapshot, self.schema_template, 'http://ingest.invalid')
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    # runs the tool, returning its report
+    def _run(self, *args):
+        report = io.StringIO()
+        with contextlib.redirect_stdout(report), contextlib.redirect_stderr(io.StringIO()):
+            cli.main(['-c', CONFIG_PATH, '--snapshot', self.snapshot] + list(args))
+        return json.loads(report.getvalue())
+
+    def test_generate(self):
+        tabs = self._path('tabs.yaml')
+        with open(tabs, 'w') as file:
+            yaml.safe_dump({'tabs': [
+                {'donor_organism': {'display_name': 'Donor organism', 'columns': [
+                    'donor_organism.biomaterial_core.biomaterial_id', 'donor_organism.field_2']}},
+                {'specimen_from_organism': {'display_name': 'Specimen from organism', 'columns': [
+                    'specimen_from_organism.biomaterial_core.biomaterial_id']}}
+            ]}, file)
+
+        report = self._run('generate', '--tabs', tabs, '-o', self._path('spreadsheet.xlsx'))
+
+        self.assertEqual(report, {'type': 'generation', 'tabs': 2, 'result': self._path('spreadsheet.xlsx')})
+        workbook = openpyxl.load_workbook(self._path('spreadsheet.xlsx'))
+        self.assertIn('Donor organism', workbook.sheetnames)
+        self.assertIn('Specimen from organism', workbook.sheetnames)
+        headers = [cell.value for cell in workbook['Donor organism'][4]]
+        self.assertIn('donor_organism.field_2', headers)
+
+    def test_migrate(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            old_template = fake_schemas.make_template(columns=3, versions={'donor_organism': '9.0.0'})
+            fake_schemas.make_spreadsheet(self._path('old.xlsx'), old_template, 2)
+
+        report = self._run('migrate', self._path('old.xlsx'), '-o', self._path('migrated.xlsx'))
+
+        self.assertEqual((report['type'], report['result']), ('migration', self._path('migrated.xlsx')))
+        self.assertIn('Donor organism', report['rewritten'])
+        self.assertIn('Specimen from organism', report['skipped'])
+        workbook = openpyxl.load_workbook(self._path('migrated.xlsx'))
+        self.assertNotEqual(workbook['Donor organism']['A1'].value, 'STALE TITLE')
+        self.assertEqual(workbook['Specimen from organism']['A1'].value, 'STALE TITLE')
+        self.assertEqual(workbook['Donor organism']['A6'].value, 'value 5 0')
+
+    def test_bad_yaml(self):
+        tabs = self._path('tabs.yaml')
+        with open(tabs, 'w') as file:
+            file.write('not: [a list of tabs')
+
+        with self.assertRaises(SystemExit) as exit:
+            self._run('generate', '--tabs', tabs, '-o', self._path('spreadsheet.xlsx'))
+        self.assertIsInstance(exit.exception.code, str)
+        self.assertFalse(os.path.exists(self._path('spreadsheet.xlsx')))
+
+
+if __name__ == '__main__':
+    unittest.main()
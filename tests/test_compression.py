@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# Tests of compressing responses with compression.py, on its own and in the app. Run from the repo root with
+#   python -m pytest tests
+import contextlib
+import gzip
+import io
+import unittest
+from unittest import mock
+
+from werkzeug.datastructures import Accept, ETags
+from werkzeug.http import parse_accept_header
+
+from fake_generator import generate_form, use_fake_schemas
+
+import compression
+import template_generator_app
+
+
+class ClosingChunks:
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.closed = False
+
+    def __iter__(self):
+        return iter(self.chunks)
+
+    def close(self):
+        self.closed = True
+
+
+class CompressionTest(unittest.TestCase):
+
+    def test_compress(self):
+        data = b'tabs:\n' + b'- donor_organism:\n    columns: [donor_organism.field_0]\n' * 100
+        compressed = compression.compress(data, 'gzip')
+        self.assertLess(len(compressed), len(data))
+        self.assertEqual(gzip.decompress(compressed), data)
+
+    def test_compress_chunks(self):
+        chunks = ClosingChunks([b'a' * 5000, b'', b'b' * 10, b'c' * 70000])
+        compressed = b''.join(compression.compress_chunks(chunks, 'gzip'))
+
+        self.assertEqual(gzip.decompress(compressed), b'a' * 5000 + b'b' * 10 + b'c' * 70000)
+        self.assertTrue(chunks.closed)
+
+    def test_compress_chunks_closes_chunks_when_abandoned(self):
+        chunks = ClosingChunks([b'a' * 100000] * 10)
+        stream = compression.compress_chunks(chunks, 'gzip')
+        next(stream)
+        stream.close()
+        self.assertTrue(chunks.closed)
+
+    def test_unknown_encoding(self):
+        with self.assertRaises(ValueError):
+            compression.Compressor('compress')
+
+    def test_choose_encoding(self):
+        self.assertEqual(compression.choose_encoding(parse_accept_header('gzip, deflate', Accept)), 'gzip')
+        self.assertIsNone(compression.choose_encoding(parse_accept_header('identity', Accept)))
+        with mock.patch.object(compression, 'brotli', None):
+            self.assertEqual(compression.choose_encoding(parse_accept_header('br, gzip;q=0.5', Accept)), 'gzip')
+
+    def test_matching_etag(self):
+        self.assertEqual(compression.encoded_etag('abc', 'gzip'), 'abc-gzip')
+        self.assertEqual(compression.matching_etag('abc', ETags(['abc-gzip'])), 'abc-gzip')
+        self.assertEqual(compression.matching_etag('abc', ETags(['abc'])), 'abc')
+        self.assertIsNone(compression.matching_etag('abc', ETags(['abd-gzip'])))
+
+
+class AppCompressionTest(unittest.TestCase):
+
+    def setUp(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.schema_template = use_fake_schemas(columns=3)
+        self.client = template_generator_app.app.test_client()
+
+    def test_compresses_pages(self):
+        plain = self.client.get('/load_all')
+        compressed = self.client.get('/load_all', headers={'Accept-Encoding': 'gzip'})
+
+        self.assertIsNone(plain.headers.get('Content-Encoding'))
+        self.assertEqual(compressed.headers['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', compressed.headers['Vary'])
+        self.assertEqual(int(compressed.headers['Content-Length']), len(compressed.data))
+        self.assertEqual(gzip.decompress(compressed.data), plain.data)
+
+    def test_compresses_streamed_yaml_files(self):
+        form = generate_form(self.schema_template, 'yaml')
+        with contextlib.redirect_stdout(io.StringIO()):
+            plain = self.client.post('/generate', data=form)
+            compressed = self.client.post('/generate', data=form, headers={'Accept-Encoding': 'gzip'})
+
+        self.assertEqual(compressed.headers['Content-Encoding'], 'gzip')
+        self.assertNotIn('Content-Length', compressed.headers)
+        self.assertEqual(gzip.decompress(compressed.data), plain.data)
+        self.assertEqual(compressed.headers['ETag'], plain.headers['ETag'][:-1] + '-gzip"')
+
+        # a client with the compressed file gets a 304 however it asks
+        etag = compressed.headers['ETag']
+        not_modified = self.client.post('/generate', data=form, headers={'Accept-Encoding': 'gzip',
+                                                                         'If-None-Match': etag})
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified.headers['ETag'], etag)
+
+    def test_doesnt_compress_spreadsheets(self):
+        form = generate_form(self.schema_template, 'spreadsheet')
+        with contextlib.redirect_stdout(io.StringIO()):
+            response = self.client.post('/generate', data=form, headers={'Accept-Encoding': 'gzip'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(response.headers.get('Content-Encoding'))
+        self.assertTrue(response.data.startswith(b'PK'))
+
+    def test_doesnt_compress_small_responses(self):
+        response = self.client.get('/templates', headers={'Accept-Encoding': 'gzip'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(response.headers.get('Content-Encoding'))
+        self.assertEqual(response.json['presets'], [])
+
+    def test_compression_off(self):
+        with mock.patch.object(template_generator_app, 'COMPRESSION', False):
+            response = self.client.get('/load_all', headers={'Accept-Encoding': 'gzip'})
+        self.assertIsNone(response.headers.get('Content-Encoding'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# Concurrency test of the generator app with the fake schemas. Fires the same requests from many threads at once -
+# GET /load_all, POST /load_all with schema and reference selections, and POST /generate for both a YAML file and a
+# spreadsheet - and checks every response is the same as the one to the same request made on its own. Any difference
+# means requests are leaking state into each other, eg through the shared schema catalogue.
+#
+# Spreadsheets are compared member by member, with the creation and modification times xlsxwriter writes into
+# docProps/core.xml blanked out - everything else must be byte for byte the same. The output cache is off, so every
+# request builds its response rather than most of them getting the cached copy. Run from the repo root with
+#   python -m pytest tests
+import concurrent.futures
+import contextlib
+import hashlib
+import io
+import re
+import threading
+import unittest
+import zipfile
+from unittest import mock
+
+from fake_generator import use_fake_schemas
+from output_cache import OutputCache
+import template_generator_app
+
+REQUEST_TYPES = ['load_all', 'load_all_selected', 'generate_yaml', 'generate_xlsx']
+
+# threads per request type, and requests per thread
+THREADS = 4
+ROUNDS = 2
+
+# the timestamps in a spreadsheet's core properties, which change from one second to the next
+XLSX_TIMESTAMP = re.compile(rb'(<dcterms:(?:created|modified)[^>]*>)[^<]*(</dcterms:)')
+
+
+# the form data of each POST request, selecting some of the schemas, properties and module references
+def _forms(schema_template):
+    schemas = []
+    properties = []
+    references = []
+    for index, tab in enumerate(schema_template.tabs):
+        for key, detail in tab.items():
+            # every other schema, so that the selections aren't just "everything"
+            if index % 2:
+                continue
+            schemas.append(key)
+            for column in detail['columns']:
+                properties.append(key + ':' + column)
+                reference = key + ':' + column.split('.')[1]
+                if reference not in references:
+                    references.append(reference)
+
+    return {
+        'load_all_selected': {'schema': schemas, 'reference': references},
+        'generate_yaml': {'schema': schemas, 'property': properties, 'submitButton': 'yaml'},
+        'generate_xlsx': {'schema': schemas, 'property': properties, 'submitButton': 'spreadsheet'}
+    }
+
+# a digest of a response body to compare - spreadsheets are compared without their timestamps
+def _digest(request_type, body):
+    if request_type != 'generate_xlsx':
+        return hashlib.sha256(body).hexdigest()
+
+    digest = hashlib.sha256()
+    with zipfile.ZipFile(io.BytesIO(body)) as archive:
+        for info in sorted(archive.infolist(), key=lambda info: info.filename):
+            content = archive.read(info)
+            if info.filename == 'docProps/core.xml':
+                content = XLSX_TIMESTAMP.sub(rb'\1\2', content)
+            digest.update(info.filename.encode('utf-8') + b'\0' + content + b'\0')
+    return digest.hexdigest()
+
+
+class ConcurrencyTest(unittest.TestCase):
+
+    def setUp(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.forms = _forms(use_fake_schemas())
+        patcher = mock.patch.object(template_generator_app, 'OUTPUT_CACHE', OutputCache(max_entries=0, max_bytes=0))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    # makes one request of the given type with its own test client, returning the status and the digest of the body
+    def _request(self, request_type):
+        client = template_generator_app.app.test_client()
+        if request_type == 'load_all':
+            response = client.get('/load_all')
+        elif request_type == 'load_all_selected':
+            response = client.post('/load_all', data=self.forms[request_type])
+        else:
+            response = client.post('/generate', data=self.forms[request_type])
+        body = response.get_data()
+        return response.status_code, _digest(request_type, body) if response.status_code == 200 else body[:200]
+
+    def test_concurrent_responses_match(self):
+        # every thread waits for all the others before its first request, so they really do run at the same time -
+        # including building the schema catalogue, which the first requests race to do
+        barrier = threading.Barrier(THREADS * len(REQUEST_TYPES))
+
+        def worker(request_type):
+            barrier.wait()
+            return request_type, [self._request(request_type) for _ in range(ROUNDS)]
+
+        responses = dict((request_type, []) for request_type in REQUEST_TYPES)
+        with contextlib.redirect_stdout(io.StringIO()):
+            with concurrent.futures.ThreadPoolExecutor(max_workers=THREADS * len(REQUEST_TYPES)) as executor:
+                futures = [executor.submit(worker, request_type) for request_type in REQUEST_TYPES
+                           for _ in range(THREADS)]
+                for future in concurrent.futures.as_completed(futures):
+                    request_type, results = future.result()
+                    responses[request_type].extend(results)
+
+            # the same requests, one at a time
+            expected = dict((request_type, self._request(request_type)) for request_type in REQUEST_TYPES)
+
+        for request_type in REQUEST_TYPES:
+            self.assertEqual(expected[request_type][0], 200, request_type)
+            self.assertEqual(len(responses[request_type]), THREADS * ROUNDS)
+            for response in responses[request_type]:
+                self.assertEqual(response, expected[request_type], request_type)
+        self.assertEqual(template_generator_app.OUTPUT_CACHE.stats()['entries'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
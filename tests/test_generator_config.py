@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+# Tests of compiling, checking and reloading the config file with generator_config.py and
+# template_generator.reload_config. Run from the repo root with
+#   python -m pytest tests
+import configparser
+import contextlib
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+from fake_generator import CONFIG_PATH, template_generator, use_fake_schemas
+from generator_config import ConfigWatcher, OrderedTab, compile_config, config_mtime, load_config, validate_config
+
+CONFIG = """
+[ordering]
+project
+contributors = project
+donor_organism = process
+familial_relationships = donor_organism
+specimen_from_organism = process
+process
+
+[biomaterial_linking]
+specimen_from_organism = donor_organism, cell_line ,
+
+[system]
+environment = dev
+
+[blacklist]
+schema_list = imaging_process, , organoid
+"""
+
+
+def _compile(text):
+    parser = configparser.ConfigParser(allow_no_value=True)
+    parser.read_string(text)
+    return compile_config(parser)
+
+
+class CompileConfigTest(unittest.TestCase):
+
+    def test_compile(self):
+        config = _compile(CONFIG)
+
+        self.assertEqual(config.environment, 'dev')
+        self.assertEqual(config.ordering[:3], (OrderedTab('project', ''), OrderedTab('contributors', 'project'),
+                                               OrderedTab('donor_organism', 'process')))
+        self.assertEqual(dict(config.children), {'project': ('contributors',),
+                                                 'process': ('donor_organism', 'specimen_from_organism'),
+                                                 'donor_organism': ('familial_relationships',)})
+        self.assertEqual(dict(config.biomaterial_linking), {'specimen_from_organism': ('donor_organism', 'cell_line')})
+        self.assertEqual(dict(config.protocol_linking), {})
+        self.assertEqual(config.excluded_schemas, frozenset(['imaging_process', 'organoid']))
+
+    def test_read_only(self):
+        config = _compile(CONFIG)
+        with self.assertRaises(TypeError):
+            config.children['project'] = ()
+        with self.assertRaises(TypeError):
+            config.biomaterial_linking['cell_line'] = ('donor_organism',)
+
+    def test_empty_config(self):
+        config = _compile('')
+        self.assertEqual((config.environment, config.ordering, config.excluded_schemas), ('', (), frozenset()))
+
+    def test_bad_configs(self):
+        with self.assertRaises(ValueError):
+            _compile("[ordering]\nproject = project\n")
+        with self.assertRaises(ValueError):
+            _compile("[biomaterial_linking]\nspecimen_from_organism = ,\n")
+
+    def test_load_config(self):
+        config = load_config(CONFIG_PATH)
+
+        self.assertEqual(config.path, CONFIG_PATH)
+        self.assertEqual(config.mtime, os.stat(CONFIG_PATH).st_mtime_ns)
+        self.assertIn(OrderedTab('donor_organism', 'process'), config.ordering)
+        self.assertEqual(config.parser['config'].get('reload_interval'), '0')
+
+    def test_load_bad_config(self):
+        directory = tempfile.mkdtemp(prefix='generator-test-')
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'config.ini')
+        with open(path, 'w') as file:
+            file.write("[system]\n[system]\n")
+
+        with self.assertRaises(ValueError):
+            load_config(path)
+        self.assertIsNone(config_mtime(os.path.join(directory, 'missing.ini')))
+
+
+class ValidateConfigTest(unittest.TestCase):
+
+    def setUp(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.schema_template = use_fake_schemas(columns=2)
+
+    def test_config_file_matches_the_schemas(self):
+        self.assertEqual(validate_config(load_config(CONFIG_PATH), self.schema_template),
+                         ["blacklisted schema imaging_process isn't a schema"])
+
+    def test_problems(self):
+        config = _compile("""
+[ordering]
+donor_organism = process
+retired_organism = process
+reagents = ipsc_induction_protocol
+holidays = donor_organism
+siblings = retired_organism
+
+[protocol_linking]
+retired_organism = collection_protocol, retired_protocol
+cell_line = retired_protocol
+""")
+        self.assertEqual(validate_config(config, self.schema_template), [
+            "retired_organism in the ordering section isn't a schema",
+            "sub-tab holidays isn't a property of donor_organism",
+            "the parent of sub-tab siblings, retired_organism, isn't a schema",
+            "retired_organism in the protocol_linking section isn't a schema",
+            "retired_protocol in the protocol_linking section isn't a schema"
+        ])
+
+
+class ConfigWatcherTest(unittest.TestCase):
+
+    def test_check(self):
+        directory = tempfile.mkdtemp(prefix='generator-test-')
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'config.ini')
+        with open(path, 'w') as file:
+            file.write(CONFIG)
+
+        changes = []
+        watcher = ConfigWatcher(path, 0, lambda: changes.append(config_mtime(path)), config_mtime(path))
+        self.assertFalse(watcher.check())
+
+        mtime = os.stat(path).st_mtime + 10
+        os.utime(path, (mtime, mtime))
+        self.assertTrue(watcher.check())
+        self.assertFalse(watcher.check())
+        self.assertEqual(changes, [config_mtime(path)])
+
+        # a missing file isn't a change
+        os.remove(path)
+        self.assertFalse(watcher.check())
+
+
+class ReloadConfigTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='generator-test-')
+        self.addCleanup(shutil.rmtree, self.directory)
+        with contextlib.redirect_stdout(io.StringIO()):
+            use_fake_schemas(columns=2)
+            self.catalogue = template_generator.get_catalogue()
+
+        self.path = os.path.join(self.directory, 'config.ini')
+        shutil.copy(CONFIG_PATH, self.path)
+        template_generator.CONFIG_PATH = self.path
+
+    def _reload(self, old, new):
+        with open(self.path) as file:
+            text = file.read()
+        with open(self.path, 'w') as file:
+            file.write(text.replace(old, new))
+        with contextlib.redirect_stdout(io.StringIO()):
+            return template_generator.reload_config()
+
+    def test_reload(self):
+        self.assertIn('organoid', self.catalogue.display_names)
+
+        self.assertTrue(self._reload('schema_list = imaging_process', 'schema_list = imaging_process, organoid'))
+
+        self.assertEqual(template_generator.CONFIG.excluded_schemas, frozenset(['imaging_process', 'organoid']))
+        self.assertIs(template_generator.CONFIG_FILE, template_generator.CONFIG.parser)
+        catalogue = template_generator.get_catalogue()
+        self.assertIsNot(catalogue, self.catalogue)
+        self.assertIs(catalogue.config, template_generator.CONFIG)
+        self.assertNotIn('organoid', catalogue.display_names)
+
+    def test_bad_file_keeps_the_current_config(self):
+        config = template_generator.CONFIG
+
+        self.assertFalse(self._reload('donor_organism = process', 'donor_organism = donor_organism'))
+
+        self.assertIs(template_generator.CONFIG, config)
+        self.assertIs(template_generator.get_catalogue(), self.catalogue)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# Tests of background jobs with jobs.py, and of downloading their results from the app. Jobs are run in the test
+# process rather than a process pool. Run from the repo root with
+#   python -m pytest tests
+import contextlib
+import io
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import fake_generator  # noqa: F401 - puts the generator directory on the path
+import template_generator_app
+from jobs import DEFAULT_WORKERS, DONE, FAILED, JobQueue, JobStore, run_job
+
+
+def _copy_job(input_path, result_path, suffix):
+    with open(input_path, 'rb') as source, open(result_path, 'wb') as target:
+        target.write(source.read() + suffix)
+    return {'copied': True}
+
+def _failing_job(input_path, result_path):
+    raise ValueError("not a spreadsheet")
+
+
+class JobTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='generator-jobs-')
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.store = JobStore(self.directory, ttl=3600, max_jobs=10)
+
+    def _job(self, content=b'input'):
+        job = self.store.create('migration', 'migrated.xlsx', 'application/octet-stream')
+        with open(self.store.input_path(job['id']), 'wb') as file:
+            file.write(content)
+        return job
+
+    def test_run_job(self):
+        job = self._job()
+        run_job(self.store, job['id'], _copy_job, (b' done',))
+
+        job = self.store.get(job['id'])
+        self.assertEqual(job['status'], DONE)
+        self.assertEqual(job['report'], {'copied': True})
+        with open(self.store.result_path(job['id']), 'rb') as file:
+            self.assertEqual(file.read(), b'input done')
+        self.assertFalse(os.path.exists(self.store.input_path(job['id'])))
+
+    def test_failed_job(self):
+        job = self._job()
+        with contextlib.redirect_stdout(io.StringIO()):
+            run_job(self.store, job['id'], _failing_job, ())
+
+        job = self.store.get(job['id'])
+        self.assertEqual(job['status'], FAILED)
+        self.assertEqual(job['error'], "not a spreadsheet")
+        self.assertFalse(os.path.exists(self.store.result_path(job['id'])))
+
+    def test_default_workers(self):
+        self.assertEqual(JobQueue(self.store).workers, DEFAULT_WORKERS)
+
+    def test_download(self):
+        job = self._job()
+        run_job(self.store, job['id'], _copy_job, (b' done',))
+
+        with mock.patch.object(template_generator_app, 'JOB_STORE', self.store):
+            client = template_generator_app.app.test_client()
+            response = client.get('/jobs/' + job['id'] + '/download')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.get_data(), b'input done')
+            self.assertIn('X-Migration-Report', response.headers)
+
+            self.assertEqual(client.get('/jobs/' + 'f' * 32 + '/download').status_code, 404)
+
+    def test_download_unfinished_job(self):
+        job = self._job()
+
+        with mock.patch.object(template_generator_app, 'JOB_STORE', self.store):
+            response = template_generator_app.app.test_client().get('/jobs/' + job['id'] + '/download')
+        self.assertEqual(response.status_code, 409)
+
+    def test_download_swept_result(self):
+        job = self._job()
+        run_job(self.store, job['id'], _copy_job, (b' done',))
+        os.remove(self.store.result_path(job['id']))
+
+        with mock.patch.object(template_generator_app, 'JOB_STORE', self.store):
+            response = template_generator_app.app.test_client().get('/jobs/' + job['id'] + '/download')
+        self.assertEqual(response.status_code, 410)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# Tests of migrating spreadsheets to the latest schemas with template_generator.migrate_workbook. Run from the repo
+# root with
+#   python -m pytest tests
+import contextlib
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+import openpyxl
+
+from fake_generator import fake_schemas, template_generator, use_fake_schemas
+
+OLD_PROCESS_URL = fake_schemas.BASE_URL + "/type/process/8.0.0/process"
+
+
+class MigrateWorkbookTest(unittest.TestCase):
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp(prefix='generator-test-')
+        self.addCleanup(shutil.rmtree, self.workdir)
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.schema_template = use_fake_schemas()
+            self.latest_schemas = list(self.schema_template.metadata_schema_urls)
+
+    # a spreadsheet generated from the latest schemas, where the Cell suspension tab also has a process column and
+    # process has no tab of its own, the way the generator lays them out. edit(workbook) can make it out of date
+    def _spreadsheet(self, edit=None):
+        path = os.path.join(self.workdir, 'source.xlsx')
+        with contextlib.redirect_stdout(io.StringIO()):
+            fake_schemas.make_spreadsheet(path, self.schema_template, 2)
+
+        workbook = openpyxl.load_workbook(path)
+        del workbook['Process']
+        worksheet = workbook['Cell suspension']
+        column = worksheet.max_column + 1
+        worksheet.cell(row=1, column=column, value='STALE TITLE')
+        worksheet.cell(row=4, column=column, value='process.field_0')
+        if edit is not None:
+            edit(workbook)
+        workbook.save(path)
+        return path
+
+    def _migrate(self, source):
+        target = os.path.join(self.workdir, 'target.xlsx')
+        with contextlib.redirect_stdout(io.StringIO()):
+            report = template_generator.migrate_workbook(source, target, self.latest_schemas)
+        return report, openpyxl.load_workbook(target)
+
+    def test_skips_tabs_at_latest_versions(self):
+        report, workbook = self._migrate(self._spreadsheet())
+
+        self.assertIn('Cell suspension', report['skipped'])
+        self.assertNotIn('Cell suspension', report['rewritten'])
+        self.assertEqual(workbook['Cell suspension'].cell(row=1, column=1).value, 'STALE TITLE')
+
+    def test_migrates_tab_with_stale_process_column(self):
+        def old_process(workbook):
+            for cell in workbook['Schemas']['A']:
+                if isinstance(cell.value, str) and cell.value.endswith('/process'):
+                    cell.value = OLD_PROCESS_URL
+
+        report, workbook = self._migrate(self._spreadsheet(old_process))
+
+        self.assertIn('Cell suspension', report['rewritten'])
+        self.assertNotIn('Cell suspension', report['skipped'])
+        # tabs that don't have any process columns are still left alone
+        self.assertIn('Donor organism', report['skipped'])
+
+        worksheet = workbook['Cell suspension']
+        self.assertEqual(worksheet.cell(row=4, column=worksheet.max_column).value, 'process.field_0')
+        self.assertNotEqual(worksheet.cell(row=1, column=worksheet.max_column).value, 'STALE TITLE')
+        self.assertEqual(worksheet.cell(row=6, column=1).value, 'value 5 0')
+
+        schema_urls = [cell.value for cell in workbook['Schemas']['A']]
+        self.assertNotIn(OLD_PROCESS_URL, schema_urls)
+        self.assertIn(fake_schemas.BASE_URL + "/type/process/9.0.0/process", schema_urls)
+
+    def test_uuid_columns_are_current(self):
+        def old_donor_with_uuid(workbook):
+            for cell in workbook['Schemas']['A']:
+                if isinstance(cell.value, str) and cell.value.endswith('/donor_organism'):
+                    cell.value = cell.value.replace('/10.0.0/', '/9.0.0/')
+            worksheet = workbook['Donor organism']
+            column = worksheet.max_column + 1
+            worksheet.cell(row=1, column=column, value='STALE UUID')
+            worksheet.cell(row=4, column=column, value='donor_organism.uuid')
+
+        report, workbook = self._migrate(self._spreadsheet(old_donor_with_uuid))
+
+        self.assertIn('Donor organism', report['rewritten'])
+        worksheet = workbook['Donor organism']
+        self.assertEqual(worksheet.cell(row=4, column=worksheet.max_column).value, 'donor_organism.uuid')
+        self.assertNotEqual(worksheet.cell(row=1, column=worksheet.max_column).value, 'STALE UUID')
+
+    def test_migrates_tab_with_process_missing_from_schemas_tab(self):
+        def no_process(workbook):
+            for cell in workbook['Schemas']['A']:
+                if isinstance(cell.value, str) and cell.value.endswith('/process'):
+                    cell.value = None
+
+        report, workbook = self._migrate(self._spreadsheet(no_process))
+
+        self.assertIn('Cell suspension', report['rewritten'])
+
+
+if __name__ == '__main__':
+    unittest.main()
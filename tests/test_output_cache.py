@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+# Tests of the cache of generated spreadsheets and YAML files in output_cache.py, on its own and in the app. Run from
+# the repo root with
+#   python -m pytest tests
+import contextlib
+import io
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from fake_generator import generate_form, template_generator, use_fake_schemas
+from output_cache import OutputCache, output_key, output_version
+import template_generator_app
+
+OLD_SCHEMAS = ['https://schema.humancellatlas.org/type/biomaterial/9.0.0/donor_organism']
+NEW_SCHEMAS = ['https://schema.humancellatlas.org/type/biomaterial/10.0.0/donor_organism']
+
+TABS = [{'donor_organism': {'display_name': 'Donor organism', 'columns': ['donor_organism.field_0']}}]
+
+
+class OutputKeyTest(unittest.TestCase):
+
+    def test_output_key(self):
+        key = output_key(TABS, NEW_SCHEMAS, 'xlsx')
+
+        self.assertTrue(key.startswith(output_version(NEW_SCHEMAS) + '-'))
+        self.assertEqual(output_key(TABS, list(reversed(NEW_SCHEMAS * 2)), 'xlsx'), key)
+        self.assertNotEqual(output_key(TABS, NEW_SCHEMAS, 'yaml'), key)
+        self.assertEqual(output_key(TABS, OLD_SCHEMAS, 'xlsx'), output_version(OLD_SCHEMAS) + key[16:])
+        # only the tab keys, display names and columns end up in the file
+        extra = [{'donor_organism': dict(TABS[0]['donor_organism'], description='Not in the file')}]
+        self.assertEqual(output_key(extra, NEW_SCHEMAS, 'xlsx'), key)
+
+
+class OutputCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.disk_dir = tempfile.mkdtemp(prefix='generator-test-')
+        self.addCleanup(shutil.rmtree, self.disk_dir)
+
+    def _key(self, schema_urls, column):
+        return output_key([{'donor_organism': {'columns': ['donor_organism.' + column]}}], schema_urls, 'xlsx')
+
+    def _disk_keys(self):
+        return sorted(name[:-len('.cache')] for name in os.listdir(self.disk_dir) if name.endswith('.cache'))
+
+    def test_memory_tier(self):
+        cache = OutputCache(max_entries=2, max_bytes=100)
+        cache.put('a', b'1' * 10)
+        cache.put('b', b'2' * 10)
+        self.assertEqual(cache.get('a'), b'1' * 10)
+        cache.put('c', b'3' * 10)
+
+        # the least recently used entry goes first
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('c'), b'3' * 10)
+        # files that would take up most of the memory tier aren't kept in memory at all
+        self.assertFalse(cache.accepts(60))
+        cache.put('d', b'4' * 60)
+        self.assertIsNone(cache.get('d'))
+        self.assertEqual(cache.stats(), {'hits': 2, 'misses': 2, 'evictions': 1, 'entries': 2, 'bytes': 20})
+
+    def test_disk_tier_is_shared(self):
+        first = OutputCache(max_bytes=100, disk_dir=self.disk_dir)
+        second = OutputCache(max_bytes=100, disk_dir=self.disk_dir)
+        key = self._key(NEW_SCHEMAS, 'field_0')
+
+        self.assertTrue(first.accepts(1000))
+        first.put(key, b'x' * 1000)
+        self.assertEqual(second.get(key), b'x' * 1000)
+        self.assertEqual(self._disk_keys(), [key])
+
+    def test_sync_only_removes_other_versions(self):
+        old_key = self._key(OLD_SCHEMAS, 'field_0')
+        new_key = self._key(NEW_SCHEMAS, 'field_0')
+
+        old_worker = OutputCache(disk_dir=self.disk_dir)
+        old_worker.sync(OLD_SCHEMAS)
+        old_worker.put(old_key, b'old')
+
+        # another worker picks up the new schemas first - and starting up doesn't wipe the shared disk tier either
+        new_worker = OutputCache(disk_dir=self.disk_dir)
+        new_worker.sync(NEW_SCHEMAS)
+        new_worker.put(new_key, b'new')
+        self.assertEqual(self._disk_keys(), [new_key])
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            old_worker.sync(NEW_SCHEMAS)
+        self.assertIsNone(old_worker.get(old_key))
+        self.assertEqual(old_worker.get(new_key), b'new')
+        self.assertEqual(self._disk_keys(), [new_key])
+
+        # syncing to the same schemas again doesn't remove anything
+        new_worker.sync(NEW_SCHEMAS)
+        self.assertEqual(new_worker.get(new_key), b'new')
+
+    def test_sync_removes_old_entries_from_memory(self):
+        cache = OutputCache()
+        cache.sync(OLD_SCHEMAS)
+        cache.put(self._key(OLD_SCHEMAS, 'field_0'), b'old')
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            cache.sync(NEW_SCHEMAS)
+        self.assertEqual((cache.stats()['entries'], cache.stats()['bytes']), (0, 0))
+
+
+class AppOutputCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.disk_dir = tempfile.mkdtemp(prefix='generator-test-')
+        self.addCleanup(shutil.rmtree, self.disk_dir)
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.schema_template = use_fake_schemas(columns=3)
+        patcher = mock.patch.object(template_generator_app, 'OUTPUT_CACHE', OutputCache(disk_dir=self.disk_dir))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client = template_generator_app.app.test_client()
+
+    def _generate(self, submit_button):
+        with contextlib.redirect_stdout(io.StringIO()):
+            return self.client.post('/generate', data=generate_form(self.schema_template, submit_button))
+
+    def test_cached(self):
+        for submit_button in ('yaml', 'spreadsheet'):
+            first = self._generate(submit_button)
+            second = self._generate(submit_button)
+
+            self.assertEqual((first.headers['X-Cache'], second.headers['X-Cache']), ('MISS', 'HIT'))
+            self.assertEqual(second.data, first.data)
+            self.assertEqual(second.headers['ETag'], first.headers['ETag'])
+
+    def test_keyed_on_the_latest_schemas(self):
+        latest_schemas = list(self.schema_template.metadata_schema_urls)
+        versions = {}
+        for submit_button in ('yaml', 'spreadsheet'):
+            versions[submit_button] = self._generate(submit_button).headers['ETag'].strip('"')[:16]
+        self.assertEqual(versions, {'yaml': output_version(latest_schemas),
+                                    'spreadsheet': output_version(latest_schemas)})
+
+        # the registry has found a new version of a schema that hasn't been loaded yet - a YAML file doesn't need
+        # the schema itself, but it is still cached under the latest schemas
+        newer_schemas = [url.replace('/10.0.0/donor_organism', '/11.0.0/donor_organism') for url in latest_schemas]
+        registry = mock.Mock(schema_urls=lambda: tuple(newer_schemas))
+        with mock.patch.object(template_generator, 'SCHEMA_REGISTRY', registry):
+            response = self._generate('yaml')
+        self.assertEqual(response.headers['X-Cache'], 'MISS')
+        self.assertEqual(response.headers['ETag'].strip('"')[:16], output_version(newer_schemas))
+
+        # the files generated from the older schemas are gone
+        self.assertTrue(all(name.startswith(output_version(newer_schemas)) for name in os.listdir(self.disk_dir)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+# Tests of preselecting schemas and properties with SchemaCatalogue.preselect, and of the /load_all and /upload pages
+# that use it. Run from the repo root with
+#   python -m pytest tests
+import contextlib
+import io
+import json
+import re
+import unittest
+
+import yaml
+
+from fake_generator import template_generator, use_fake_schemas
+from schema_catalogue import build_catalogue
+import template_generator_app
+
+# the properties marked as preselected in each schema section of the schemas page
+PRESELECTED = re.compile(r'id="(\w+)" data-url="[^"]*" data-preselected=\'([^\']*)\'')
+
+
+def _preselected(html):
+    return dict((name, set(json.loads(properties))) for name, properties in PRESELECTED.findall(html))
+
+def _marked(schema):
+    return set(prop for prop, status in schema["properties"].items() if status == "pre-selected")
+
+
+class PreselectTest(unittest.TestCase):
+
+    def setUp(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            schema_template = use_fake_schemas(columns=2)
+            self.catalogue = build_catalogue(schema_template, template_generator.CONFIG)
+
+    def _schema(self, schema_properties, name):
+        return [schema for schema in schema_properties if schema["name"] == name][0]
+
+    def test_selected_schemas(self):
+        schema_properties = self.catalogue.preselect(['donor_organism'], None, None)
+
+        donor = self._schema(schema_properties, 'donor_organism')
+        self.assertTrue(donor["pre-selected"])
+        self.assertEqual(_marked(donor), set())
+        self.assertFalse(self._schema(schema_properties, 'specimen_from_organism').get("pre-selected"))
+
+    def test_selected_references(self):
+        schema_properties = self.catalogue.preselect(['donor_organism', 'specimen_from_organism'],
+                                                     ['donor_organism:genus_species'], None)
+
+        # the schema's own top level optional properties and the optional properties of the module, but not its
+        # required ones
+        donor = self._schema(schema_properties, 'donor_organism')
+        self.assertEqual(_marked(donor), {
+            'donor_organism.field_0', 'donor_organism.field_1',
+            'donor_organism.genus_species.text', 'donor_organism.genus_species.ontology',
+            'donor_organism.genus_species.ontology_label',
+            'process.genus_species.text', 'process.genus_species.ontology', 'process.genus_species.ontology_label'})
+        self.assertEqual(donor["properties"]['donor_organism.biomaterial_core.biomaterial_id'], 'required')
+        # a selected schema without any selected references of its own
+        self.assertEqual(_marked(self._schema(schema_properties, 'specimen_from_organism')), set())
+
+    def test_selected_properties(self):
+        schema_properties = self.catalogue.preselect(['donor_organism'], None, {'donor_organism': [
+            'donor_organism.field_1',
+            'donor_organism.biomaterial_core.biomaterial_id',
+            'donor_organism.old_field',
+            'donor_organism.linked_field'
+        ]})
+
+        donor = self._schema(schema_properties, 'donor_organism')
+        # required properties are selected anyway, renamed ones are migrated to the latest schemas and ones that
+        # aren't in the schema at all are added to it
+        self.assertEqual(_marked(donor), {'donor_organism.field_1', 'donor_organism.field_0',
+                                          'donor_organism.linked_field'})
+        self.assertEqual(donor["properties"]['donor_organism.biomaterial_core.biomaterial_id'], 'required')
+        self.assertNotIn('donor_organism.old_field', donor["properties"])
+
+    def test_shared_catalogue_is_untouched(self):
+        self.catalogue.preselect(['donor_organism'], ['donor_organism:genus_species'],
+                                 {'donor_organism': ['donor_organism.linked_field']})
+
+        for schema in self.catalogue.view():
+            self.assertNotIn("pre-selected", schema)
+            self.assertEqual(_marked(schema), set())
+        self.assertNotIn('donor_organism.linked_field', self.catalogue.properties('donor_organism'))
+
+
+class AppPreselectTest(unittest.TestCase):
+
+    def setUp(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            use_fake_schemas(columns=2)
+            template_generator.get_catalogue()
+        self.client = template_generator_app.app.test_client()
+
+    def test_load_all(self):
+        response = self.client.get('/load_all')
+
+        self.assertEqual(response.status_code, 200)
+        preselected = _preselected(response.get_data(as_text=True))
+        self.assertIn('donor_organism', preselected)
+        self.assertEqual(set().union(*preselected.values()), set())
+
+    def test_load_all_with_selections(self):
+        response = self.client.post('/load_all', data={'schema': ['donor_organism'],
+                                                       'reference': ['donor_organism:familial_relationships']})
+
+        html = response.get_data(as_text=True)
+        self.assertIn('value="donor_organism" checked', html)
+        # the module of a selected reference that has its own tab is selected too
+        self.assertIn('value="familial_relationships" checked', html)
+        self.assertNotIn('value="specimen_from_organism" checked', html)
+
+        preselected = _preselected(html)
+        self.assertEqual(preselected['donor_organism'], {'donor_organism.field_0', 'donor_organism.field_1'})
+        self.assertEqual(preselected['familial_relationships'], {
+            'donor_organism.familial_relationships.familial_relationships_name',
+            'donor_organism.familial_relationships.familial_relationships_value'})
+
+    def test_upload(self):
+        content = yaml.safe_dump({'tabs': [{'donor_organism': {'display_name': 'Donor organism', 'columns': [
+            'donor_organism.biomaterial_core.biomaterial_id', 'donor_organism.old_field',
+            'donor_organism.genus_species.text']}}]})
+        response = self.client.post('/upload', data={'yamlfile': (io.BytesIO(content.encode('utf-8')), 'old.yaml')},
+                                    content_type='multipart/form-data')
+
+        html = response.get_data(as_text=True)
+        self.assertIn('value="donor_organism" checked', html)
+        self.assertEqual(_preselected(html)['donor_organism'], {'donor_organism.field_0',
+                                                                'donor_organism.genus_species.text'})
+
+
+if __name__ == '__main__':
+    unittest.main()
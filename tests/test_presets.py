@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+# Tests of building template presets with presets.py. Two preset libraries sharing a directory stand in for two
+# worker processes of the app, and the presets are "built" in a thread pool. Run from the repo root with
+#   python -m pytest tests
+import concurrent.futures
+import contextlib
+import fcntl
+import io
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from fake_generator import template_generator, use_fake_schemas
+from presets import LOCK_FILE, PresetLibrary
+
+DEFINITIONS = {'sequencing': 'project, donor_organism, sequence_file', 'imaging': 'project, image_file',
+               'organoid': 'project, organoid', 'broken': 'project, not_a_schema'}
+VERSION = 'version-1'
+
+
+class PresetLibraryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='generator-presets-')
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.executor = concurrent.futures.ThreadPoolExecutor(4)
+        self.addCleanup(self.executor.shutdown)
+        with contextlib.redirect_stdout(io.StringIO()):
+            use_fake_schemas()
+            self.catalogue = template_generator.get_catalogue()
+
+        self.builds = []
+        self.running = 0
+        self.most_running = 0
+        self.release = threading.Event()
+        self.release.set()
+        self.lock = threading.Lock()
+
+    # stands in for template_generator.preset_job
+    def _build(self, tabs, latest_schemas):
+        with self.lock:
+            self.builds.append(tabs)
+            self.running += 1
+            self.most_running = max(self.most_running, self.running)
+        self.release.wait(10)
+        time.sleep(0.01)
+        with self.lock:
+            self.running -= 1
+        return b'xlsx ' + str(len(tabs['tabs'])).encode('utf-8'), b'yaml', 0.01
+
+    def _library(self, max_parallel=1):
+        return PresetLibrary(self.directory, max_parallel=max_parallel)
+
+    def _sync(self, library, version=VERSION):
+        with contextlib.redirect_stdout(io.StringIO()):
+            return library.sync(version, DEFINITIONS, self.catalogue, ['https://schema/type/project/1.0.0/project'],
+                                '.', self.executor, self._build)
+
+    def _wait_until_built(self, library, version=VERSION):
+        for _ in range(500):
+            with contextlib.redirect_stdout(io.StringIO()):
+                status = library.status()
+            if all(preset['status'] != 'building' for preset in status):
+                return dict((preset['name'], preset) for preset in status)
+            time.sleep(0.01)
+        self.fail("presets weren't built")
+
+    def test_builds_presets(self):
+        library = self._library()
+        self.assertTrue(self._sync(library))
+        status = self._wait_until_built(library)
+
+        self.assertEqual(status['sequencing']['status'], 'ready')
+        self.assertEqual(status['sequencing']['tabs'], 3)
+        self.assertEqual(status['broken']['status'], 'failed')
+        self.assertIn('not_a_schema', status['broken']['error'])
+
+        build = library.get('sequencing', VERSION)
+        self.assertEqual(build.files['xlsx'][1], b'xlsx 3')
+        self.assertIsNone(library.get('sequencing', 'another-version'))
+        # nothing to do for the same version
+        self.assertFalse(self._sync(library))
+
+    def test_presets_are_built_once_across_workers(self):
+        self.release.clear()
+        first = self._library()
+        second = self._library()
+        self._sync(first)
+        self._sync(second)
+        self.release.set()
+
+        status = self._wait_until_built(second)
+        self._wait_until_built(first)
+
+        self.assertEqual(len(self.builds), 3)
+        self.assertEqual(status['imaging']['status'], 'ready')
+        self.assertEqual(status['broken']['status'], 'failed')
+        self.assertEqual(second.get('imaging', VERSION).files, first.get('imaging', VERSION).files)
+
+        # a worker that only gets round to the same version after the presets are built doesn't build them again
+        third = self._library()
+        self._sync(third)
+        self.assertEqual(third.get('organoid', VERSION).files['xlsx'][1], b'xlsx 2')
+        self.assertEqual(len(self.builds), 3)
+
+    def test_takes_over_from_a_worker_that_went_away(self):
+        library = self._library()
+        # another worker holds the lock, as if it was building the presets
+        os.makedirs(library._version_dir(VERSION))
+        other_worker = open(os.path.join(library._version_dir(VERSION), LOCK_FILE), 'a')
+        fcntl.flock(other_worker, fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+        self._sync(library)
+        time.sleep(0.05)
+        self.assertEqual(self.builds, [])
+        self.assertIsNone(library.get('imaging', VERSION))
+
+        # the other worker goes away without finishing them
+        other_worker.close()
+        self.assertIsNone(library.get('imaging', VERSION))
+        status = self._wait_until_built(library)
+        self.assertEqual(status['imaging']['status'], 'ready')
+        self.assertEqual(len(self.builds), 3)
+
+    def test_limits_presets_built_at_once(self):
+        library = self._library(max_parallel=2)
+        self._sync(library)
+        self._wait_until_built(library)
+
+        self.assertEqual(len(self.builds), 3)
+        self.assertLessEqual(self.most_running, 2)
+
+        self.most_running = 0
+        library = self._library()
+        self._sync(library, 'version-2')
+        self._wait_until_built(library, 'version-2')
+        self.assertEqual(len(self.builds), 6)
+        self.assertEqual(self.most_running, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
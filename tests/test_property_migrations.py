@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# Tests of looking up property migrations with property_migrations.py. Run from the repo root with
+#   python -m pytest tests
+import contextlib
+import io
+import unittest
+
+from fake_generator import fake_schemas
+from property_migrations import DELETED, PropertyMigrations
+
+
+def _migration(schema, prop, replaced_by=None, target_schema=None):
+    migration = {'source_schema': schema, 'property': prop, 'effective_from': '2.0.0', 'reason': 'test'}
+    if replaced_by is not None:
+        migration.update({'target_schema': target_schema or schema, 'replaced_by': replaced_by})
+    return migration
+
+def _attributes(**properties):
+    attributes = {'user_friendly': 'A property', 'required': False, 'schema': {'module': 'a_module'}}
+    attributes.update(properties)
+    return attributes
+
+# the metadata and custom properties of a schema template with a project schema
+PROPERTIES = {'project': {
+    'project_core': _attributes(project_short_name=_attributes(), project_title=_attributes()),
+    'INSDC_project_accessions': _attributes(),
+    'contributors': _attributes(name=_attributes(), email=_attributes()),
+    'schema': {'module': 'project'}
+}}
+CUSTOM_PROPERTIES = {'project': {'uuid': _attributes()}}
+
+MIGRATIONS = [
+    _migration('project', 'project_core.project_shortname', 'project_core.short_name'),
+    _migration('project', 'project_core.short_name', 'project_core.project_short_name'),
+    _migration('project', 'insdc_accessions', 'INSDC_project_accessions'),
+    _migration('project', 'contacts', 'contributors'),
+    _migration('project', 'supplementary_links'),
+    _migration('project', 'loop_a', 'loop_b'),
+    _migration('project', 'loop_b', 'loop_a')
+]
+
+
+class PropertyMigrationsTest(unittest.TestCase):
+
+    def setUp(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.migrations = PropertyMigrations(MIGRATIONS, PROPERTIES, CUSTOM_PROPERTIES)
+
+    def test_current_properties(self):
+        for key in ('project.project_core', 'project.project_core.project_short_name', 'project.contributors.email',
+                    'project.INSDC_project_accessions', 'project.uuid'):
+            self.assertTrue(self.migrations.is_current(key), key)
+
+    def test_current_properties_keep_their_case(self):
+        self.assertFalse(self.migrations.is_current('project.insdc_project_accessions'))
+
+    def test_not_current_properties(self):
+        for key in ('project.project_core.project_shortname', 'project.supplementary_links', 'project.schema',
+                    'project.schema.module', 'project.contributors.user_friendly', 'donor_organism.uuid'):
+            self.assertFalse(self.migrations.is_current(key), key)
+
+    def test_renamed_properties(self):
+        # a chain of renames is followed to its end
+        self.assertEqual(self.migrations.lookup('project.project_core.project_shortname'),
+                         'project.project_core.project_short_name')
+        self.assertEqual(self.migrations.lookup('project.project_core.short_name'),
+                         'project.project_core.project_short_name')
+        self.assertEqual(self.migrations.lookup('project.insdc_accessions'), 'project.INSDC_project_accessions')
+        # properties under a renamed property move with it
+        self.assertEqual(self.migrations.lookup('project.contacts.email'), 'project.contributors.email')
+
+    def test_removed_properties(self):
+        self.assertIs(self.migrations.lookup('project.supplementary_links'), DELETED)
+        self.assertIs(self.migrations.lookup('project.supplementary_links.url'), DELETED)
+
+    def test_unknown_and_circular_properties(self):
+        self.assertIsNone(self.migrations.lookup('project.never_existed'))
+        self.assertIsNone(self.migrations.lookup('project.loop_a'))
+        self.assertIsNone(self.migrations.lookup('project.loop_b'))
+        self.assertEqual(len(self.migrations), 5)
+
+    def test_schema_template_properties(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            schema_template = fake_schemas.make_template(columns=2)
+        migrations = PropertyMigrations(schema_template.property_migrations, schema_template.meta_data_properties,
+                                        schema_template.custom_properties)
+
+        labels = set(path for paths in schema_template.labels.values() for path in paths)
+        self.assertTrue(labels <= migrations.current)
+        self.assertTrue(migrations.is_current('donor_organism.uuid'))
+        self.assertTrue(migrations.is_current('donor_organism.genus_species.text'))
+        self.assertEqual(migrations.lookup('donor_organism.old_field'), 'donor_organism.field_0')
+
+
+if __name__ == '__main__':
+    unittest.main()
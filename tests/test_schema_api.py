@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# Tests of the paged JSON API of the schema catalogue, /api/schemas and /api/schemas/<name>. Run from the repo root
+# with
+#   python -m pytest tests
+import contextlib
+import gzip
+import io
+import json
+import unittest
+
+from fake_generator import template_generator, use_fake_schemas
+import template_generator_app
+
+
+class SchemaApiTest(unittest.TestCase):
+
+    def setUp(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            use_fake_schemas(columns=3)
+            self.catalogue = template_generator.get_catalogue()
+        self.client = template_generator_app.app.test_client()
+
+    def test_schemas(self):
+        response = self.client.get('/api/schemas')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['Cache-Control'], 'no-cache')
+        # compact JSON
+        self.assertNotIn(b', ', response.data)
+        body = response.json
+        self.assertEqual(body['version'], self.catalogue.version)
+        self.assertEqual(body['offset'], 0)
+        self.assertEqual(body['total'], len(self.catalogue.schemas))
+        self.assertEqual([schema['name'] for schema in body['schemas']],
+                         [schema['name'] for schema in self.catalogue.schemas])
+        donor = [schema for schema in body['schemas'] if schema['name'] == 'donor_organism'][0]
+        self.assertEqual(donor, {'name': 'donor_organism', 'title': self.catalogue.display_names['donor_organism'],
+                                 'properties': len(self.catalogue.properties('donor_organism'))})
+
+    def test_schemas_paging(self):
+        everything = self.client.get('/api/schemas').json['schemas']
+
+        page = self.client.get('/api/schemas?offset=2&limit=3').json
+        self.assertEqual((page['offset'], page['total']), (2, len(everything)))
+        self.assertEqual(page['schemas'], everything[2:5])
+
+        # out of range offsets and limits give empty or whole pages rather than errors
+        self.assertEqual(self.client.get('/api/schemas?offset=1000').json['schemas'], [])
+        self.assertEqual(self.client.get('/api/schemas?limit=-1').json['schemas'], [])
+        self.assertEqual(self.client.get('/api/schemas?offset=-5').json['schemas'], everything)
+
+    def test_schema_properties(self):
+        body = self.client.get('/api/schemas/donor_organism').json
+
+        self.assertEqual(body['name'], 'donor_organism')
+        self.assertEqual(body['title'], self.catalogue.display_names['donor_organism'])
+        self.assertEqual(body['properties'], self.catalogue.properties('donor_organism'))
+        self.assertIn(['donor_organism.biomaterial_core.biomaterial_id', 'required'], body['properties'])
+        self.assertIn(['donor_organism.field_2', 'not required'], body['properties'])
+
+        page = self.client.get('/api/schemas/donor_organism?offset=1&limit=2').json
+        self.assertEqual(page['total'], len(body['properties']))
+        self.assertEqual(page['properties'], body['properties'][1:3])
+
+    def test_unknown_schema(self):
+        response = self.client.get('/api/schemas/no_such_schema')
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.json, {'error': 'No such schema'})
+
+    def test_not_modified(self):
+        response = self.client.get('/api/schemas/donor_organism')
+        etag = response.headers['ETag']
+
+        not_modified = self.client.get('/api/schemas/donor_organism', headers={'If-None-Match': etag})
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified.data, b'')
+
+        # another page, or another schema, is another response
+        other_page = self.client.get('/api/schemas/donor_organism?limit=1', headers={'If-None-Match': etag})
+        self.assertEqual(other_page.status_code, 200)
+        other_schema = self.client.get('/api/schemas/specimen_from_organism', headers={'If-None-Match': etag})
+        self.assertEqual(other_schema.status_code, 200)
+
+    def test_new_schemas_change_the_etag(self):
+        etag = self.client.get('/api/schemas').headers['ETag']
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            use_fake_schemas(columns=3, versions={'donor_organism': '11.0.0'})
+        response = self.client.get('/api/schemas', headers={'If-None-Match': etag})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+        self.assertNotEqual(response.json['version'], self.catalogue.version)
+
+    def test_compressed(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            use_fake_schemas(columns=100)
+        plain = self.client.get('/api/schemas/donor_organism')
+        compressed = self.client.get('/api/schemas/donor_organism', headers={'Accept-Encoding': 'gzip'})
+
+        self.assertEqual(compressed.headers['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', compressed.headers['Vary'])
+        self.assertEqual(json.loads(gzip.decompress(compressed.data)), plain.json)
+
+        not_modified = self.client.get('/api/schemas/donor_organism', headers={
+            'Accept-Encoding': 'gzip', 'If-None-Match': compressed.headers['ETag']})
+        self.assertEqual(not_modified.status_code, 304)
+
+
+if __name__ == '__main__':
+    unittest.main()
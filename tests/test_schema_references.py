@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# Tests of the module references of each schema shown on the preselection page, built with the schema catalogue and
+# rendered once per catalogue by /load_select. Run from the repo root with
+#   python -m pytest tests
+import contextlib
+import io
+import unittest
+from unittest import mock
+
+from fake_generator import fake_schemas, template_generator, use_fake_schemas
+from schema_catalogue import build_catalogue
+import template_generator_app
+
+
+def _references(catalogue):
+    return dict((schema["name"], schema) for schema in catalogue.references)
+
+
+class ReferencesTest(unittest.TestCase):
+
+    def setUp(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            use_fake_schemas(columns=2)
+            self.catalogue = template_generator.get_catalogue()
+
+    def test_references(self):
+        references = _references(self.catalogue)
+
+        # in the order of the config file, without the sub-tabs
+        ordered = [tab.key for tab in template_generator.CONFIG.ordering if tab.key in references]
+        self.assertEqual([schema["name"] for schema in self.catalogue.references], ordered)
+        self.assertNotIn('familial_relationships', references)
+
+        donor = references['donor_organism']
+        self.assertEqual(donor["title"], self.catalogue.display_names['donor_organism'])
+        self.assertEqual(dict(donor["references"]), {'biomaterial_core': 'required', 'genus_species': 'not required',
+                                                     'familial_relationships': 'not required'})
+        self.assertEqual(dict(references['project']["references"]), {
+            'project_core': 'required', 'contributors': 'not required', 'publications': 'not required',
+            'funders': 'not required'})
+
+    def test_read_only(self):
+        donor = _references(self.catalogue)['donor_organism']
+        with self.assertRaises(TypeError):
+            donor["title"] = 'Changed'
+        with self.assertRaises(TypeError):
+            donor["references"]['field_0'] = 'not required'
+
+    def test_unchanged_schemas_keep_their_references(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            schema_template = fake_schemas.make_template(columns=2, versions={'donor_organism': '11.0.0'})
+            catalogue = build_catalogue(schema_template, self.catalogue.config, previous=self.catalogue)
+
+        previous = _references(self.catalogue)
+        references = _references(catalogue)
+        self.assertIs(references['specimen_from_organism'], previous['specimen_from_organism'])
+        self.assertIsNot(references['donor_organism'], previous['donor_organism'])
+        self.assertEqual(references['donor_organism'], previous['donor_organism'])
+
+
+class LoadSelectTest(unittest.TestCase):
+
+    def setUp(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            use_fake_schemas(columns=2)
+            template_generator.get_catalogue()
+        self.client = template_generator_app.app.test_client()
+
+    # the templates rendered while getting the preselection page, and the page
+    def _load_select(self):
+        with mock.patch.object(template_generator_app, 'render_template',
+                               wraps=template_generator_app.render_template) as render_template:
+            with contextlib.redirect_stdout(io.StringIO()):
+                response = self.client.get('/load_select')
+        self.assertEqual(response.status_code, 200)
+        return [call[0][0] for call in render_template.call_args_list], response.get_data(as_text=True)
+
+    def test_load_select(self):
+        _, html = self._load_select()
+
+        self.assertIn('<input type="checkbox" name="schema" class="schema" value="donor_organism">', html)
+        self.assertIn('value="donor_organism:biomaterial_core" checked', html)
+        self.assertIn('<input type="checkbox" name="reference" class="reference" '
+                      'value="donor_organism:genus_species">genus_species', html)
+        # the schema and references are HTML, not escaped text
+        self.assertNotIn('&lt;input', html)
+
+    def test_references_rendered_once_per_catalogue(self):
+        rendered, first = self._load_select()
+        self.assertIn('schema_references.html', rendered)
+
+        rendered, second = self._load_select()
+        self.assertEqual(rendered, ['schema_selector.html'])
+        self.assertEqual(second, first)
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            use_fake_schemas(columns=2, versions={'donor_organism': '11.0.0'})
+        rendered, third = self._load_select()
+        self.assertIn('schema_references.html', rendered)
+        self.assertIs(template_generator_app.REFERENCES_HTML[0], template_generator.get_catalogue())
+        self.assertEqual(third, first)
+
+
+if __name__ == '__main__':
+    unittest.main()
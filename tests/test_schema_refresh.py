@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# Tests of swapping in the latest schemas with template_generator.refresh_schema_template, and of the app carrying on
+# when a refresh fails. The changed schemas are served from the fake schema set rather than fetched. Run from the
+# repo root with
+#   python -m pytest tests
+import contextlib
+import io
+import unittest
+from unittest import mock
+
+from fake_generator import fake_schemas, template_generator, use_fake_schemas
+
+import template_generator_app
+
+OLD_VERSIONS = {'donor_organism': '9.0.0', 'project': '13.0.0'}
+
+
+class SchemaRefreshTest(unittest.TestCase):
+
+    def setUp(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.old_template = use_fake_schemas(versions=OLD_VERSIONS)
+            self.old_catalogue = template_generator.get_catalogue()
+
+        # the latest schemas, fetched from the fake schema set instead of the schema server
+        latest_docs = dict((doc['$id'], doc) for doc in fake_schemas.make_schemas())
+        self.latest_schemas = list(latest_docs)
+
+        def fetch_json(url):
+            if url == template_generator.MIGRATIONS_URL:
+                return {'migrations': fake_schemas.MIGRATIONS}
+            return latest_docs[url]
+
+        patcher = mock.patch.object(template_generator, '_fetch_json', side_effect=fetch_json)
+        self.fetch_json = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _refresh(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            return template_generator.refresh_schema_template(self.latest_schemas)
+
+    def test_refresh_swaps_in_latest_schemas(self):
+        self.assertTrue(self._refresh())
+
+        self.assertEqual(set(template_generator.SCHEMA_TEMPLATE.metadata_schema_urls), set(self.latest_schemas))
+        self.assertIsNot(template_generator.get_catalogue(), self.old_catalogue)
+        # only the schemas that changed and the migrations are fetched
+        self.assertEqual(self.fetch_json.call_count, len(OLD_VERSIONS) + 1)
+        # nothing to do the second time
+        self.assertFalse(self._refresh())
+
+    def test_failed_catalogue_build_keeps_current_schemas(self):
+        with mock.patch.object(template_generator, 'build_catalogue', side_effect=RuntimeError("broken config")):
+            self.assertFalse(self._refresh())
+
+        self.assertIs(template_generator.SCHEMA_TEMPLATE, self.old_template)
+        self.assertIs(template_generator.get_catalogue(), self.old_catalogue)
+
+        # the next refresh still runs
+        self.assertTrue(self._refresh())
+        self.assertEqual(set(template_generator.SCHEMA_TEMPLATE.metadata_schema_urls), set(self.latest_schemas))
+
+    def test_failed_fetch_keeps_current_schemas(self):
+        self.fetch_json.side_effect = RuntimeError("schema server down")
+
+        self.assertFalse(self._refresh())
+        self.assertIs(template_generator.SCHEMA_TEMPLATE, self.old_template)
+        self.assertIs(template_generator.get_catalogue(), self.old_catalogue)
+
+    def test_failed_preset_rebuild_doesnt_stop_refresh(self):
+        with mock.patch.object(template_generator_app, 'JOB_QUEUE'), \
+                mock.patch.object(template_generator_app.PRESETS, 'sync', side_effect=RuntimeError("pool broken")), \
+                contextlib.redirect_stdout(io.StringIO()):
+            template_generator_app._refresh_schemas_and_presets(self.latest_schemas)
+
+        self.assertEqual(set(template_generator.SCHEMA_TEMPLATE.metadata_schema_urls), set(self.latest_schemas))
+
+
+if __name__ == '__main__':
+    unittest.main()
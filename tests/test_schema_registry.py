@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+# Tests of refreshing the latest schemas with schema_registry.py, against a stub of the Ingest API's schema endpoints
+# served locally. Run from the repo root with
+#   python -m pytest tests
+import contextlib
+import io
+import json
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import fake_generator  # noqa: F401 - puts the generator directory on the path
+from schema_registry import SchemaRegistry
+
+OLD_URLS = ["https://schema.humancellatlas.org/type/project/13.0.0/project",
+            "https://schema.humancellatlas.org/type/biomaterial/9.0.0/donor_organism"]
+NEW_URLS = ["https://schema.humancellatlas.org/type/project/14.0.0/project",
+            "https://schema.humancellatlas.org/type/biomaterial/10.0.0/donor_organism"]
+
+
+# serves the links the Ingest API client follows to get to the latest schemas, then the server's schema_urls as the
+# latest schemas. If the server's status isn't 200 every request gets that status instead
+class IngestApiStub(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        base = 'http://%s:%d' % self.server.server_address
+        if self.server.status != 200:
+            self._send(self.server.status, {'error': 'stub error'})
+        elif self.path == '/':
+            self._send(200, {'_links': {'schemas': {'href': base + '/schemas{?page,size,sort}'}}})
+        elif self.path == '/schemas':
+            self._send(200, {'_links': {'search': {'href': base + '/schemas/search'}}})
+        elif self.path == '/schemas/search':
+            self._send(200, {'_links': {'latestSchemas': {'href': base + '/schemas/search/latestSchemas'}}})
+        elif self.path == '/schemas/search/latestSchemas':
+            schemas = [{'highLevelEntity': 'type', '_links': {'json-schema': {'href': url}}}
+                       for url in self.server.schema_urls]
+            self._send(200, {'_embedded': {'schemas': schemas}, '_links': {}} if schemas else {'_links': {}})
+        else:
+            self._send(404, {'error': 'not found'})
+
+    def _send(self, status, body):
+        content = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class SchemaRegistryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), IngestApiStub)
+        self.server.status = 200
+        self.server.schema_urls = NEW_URLS
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.api_url = 'http://%s:%d' % self.server.server_address
+
+    def _refresh(self, registry):
+        with contextlib.redirect_stdout(io.StringIO()):
+            return registry.refresh()
+
+    def test_refresh(self):
+        refreshed = []
+        registry = SchemaRegistry(self.api_url, ttl=0, schema_urls=OLD_URLS, on_refresh=refreshed.append)
+
+        self.assertTrue(self._refresh(registry))
+        self.assertEqual(registry.schema_urls(), tuple(NEW_URLS))
+        self.assertEqual(registry.versions(), {'project': '14.0.0', 'donor_organism': '10.0.0'})
+        self.assertEqual(refreshed, [tuple(NEW_URLS)])
+        self.assertIsNone(registry.last_error)
+
+        # the same schemas again aren't a change
+        self.assertFalse(self._refresh(registry))
+
+    def test_http_error_keeps_current_schemas(self):
+        self.server.status = 500
+        refreshed = []
+        registry = SchemaRegistry(self.api_url, ttl=0, schema_urls=OLD_URLS, on_refresh=refreshed.append)
+
+        self.assertFalse(self._refresh(registry))
+        self.assertEqual(registry.schema_urls(), tuple(OLD_URLS))
+        self.assertEqual(refreshed, [])
+        self.assertIn('500', registry.last_error)
+
+    def test_empty_response_keeps_current_schemas(self):
+        self.server.schema_urls = []
+        registry = SchemaRegistry(self.api_url, ttl=0, schema_urls=OLD_URLS)
+
+        self.assertFalse(self._refresh(registry))
+        self.assertEqual(registry.schema_urls(), tuple(OLD_URLS))
+        self.assertEqual(registry.last_error, "No schemas returned")
+
+    def test_on_refresh_error_is_recorded(self):
+        def on_refresh(schema_urls):
+            raise RuntimeError("schemas couldn't be loaded")
+
+        registry = SchemaRegistry(self.api_url, ttl=0, schema_urls=OLD_URLS, on_refresh=on_refresh)
+
+        self.assertTrue(self._refresh(registry))
+        self.assertEqual(registry.schema_urls(), tuple(NEW_URLS))
+        self.assertEqual(registry.last_error, "schemas couldn't be loaded")
+
+    def test_background_refresh_survives_errors(self):
+        calls = []
+        called_again = threading.Event()
+
+        def on_refresh(schema_urls):
+            calls.append(schema_urls)
+            if len(calls) == 1:
+                raise RuntimeError("schemas couldn't be loaded")
+            called_again.set()
+
+        registry = SchemaRegistry(self.api_url, ttl=0.05, schema_urls=OLD_URLS, on_refresh=on_refresh)
+        with contextlib.redirect_stdout(io.StringIO()):
+            registry.start()
+            try:
+                self.assertTrue(called_again.wait(10))
+            finally:
+                registry.stop()
+        self.assertGreaterEqual(len(calls), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# Tests of writing and loading schema snapshots with schema_snapshot.py. Run from the repo root with
+#   python -m pytest tests
+import contextlib
+import io
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+import zlib
+
+from fake_generator import fake_schemas
+from schema_snapshot import SNAPSHOT_MAGIC, SnapshotException, load_snapshot, read_snapshot_header, save_snapshot
+
+
+class SchemaSnapshotTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='generator-snapshot-')
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.path = os.path.join(self.directory, 'schemas.snapshot')
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.schema_template = fake_schemas.make_template(columns=3)
+
+    def _load(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            return load_snapshot(self.path)
+
+    def test_round_trip(self):
+        header = save_snapshot(self.path, self.schema_template, 'http://ingest.invalid')
+
+        self.assertEqual(read_snapshot_header(self.path), header)
+        self.assertEqual(header['schemas'], fake_schemas.STANDARD_SCHEMA_COUNT)
+        self.assertEqual(header['api_url'], 'http://ingest.invalid')
+
+        schema_template = self._load()
+        self.assertEqual(list(schema_template.metadata_schema_urls), list(self.schema_template.metadata_schema_urls))
+        self.assertEqual(schema_template.json_schemas, self.schema_template.json_schemas)
+        self.assertEqual(schema_template.property_migrations, self.schema_template.property_migrations)
+        self.assertEqual(schema_template.labels, self.schema_template.labels)
+
+    def test_snapshot_is_json(self):
+        save_snapshot(self.path, self.schema_template)
+
+        with open(self.path, 'rb') as file:
+            file.readline()
+            file.readline()
+            content = zlib.decompress(file.read())
+        self.assertTrue(content.startswith(b'{'))
+
+    def test_rejects_pickled_snapshots(self):
+        with open(self.path, 'wb') as file:
+            file.write(SNAPSHOT_MAGIC + b' 1\n{}\n')
+            file.write(zlib.compress(pickle.dumps({'schema_urls': []})))
+
+        with self.assertRaisesRegex(SnapshotException, 'Unsupported schema snapshot format 1'):
+            self._load()
+
+    def test_rejects_corrupt_snapshots(self):
+        save_snapshot(self.path, self.schema_template)
+        with open(self.path, 'r+b') as file:
+            file.truncate(os.path.getsize(self.path) - 100)
+
+        with self.assertRaisesRegex(SnapshotException, 'corrupt'):
+            self._load()
+
+    def test_rejects_other_files(self):
+        with open(self.path, 'wb') as file:
+            file.write(b'tabs: []\n')
+
+        with self.assertRaisesRegex(SnapshotException, 'Not a schema snapshot file'):
+            self._load()
+
+
+if __name__ == '__main__':
+    unittest.main()
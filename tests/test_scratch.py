@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+# Tests of the scratch space for uploads and generated files in scratch.py, on its own and in the app. Run from the
+# repo root with
+#   python -m pytest tests
+import contextlib
+import io
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+import fake_generator  # noqa: F401 - puts the generator directory on the path
+import template_generator_app
+from scratch import SCRATCH_PREFIX, ScratchQuotaException, ScratchStore
+
+
+class ScratchStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='generator-test-')
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.store = ScratchStore(self.directory, spool_max_size=100, quota=1000, max_age=60, sweep_interval=0)
+
+    def _scratch_files(self):
+        return [name for name in os.listdir(self.directory) if name.startswith(SCRATCH_PREFIX)]
+
+    def test_small_files_stay_in_memory(self):
+        with self.store.spool() as file:
+            file.write(b'a' * 50)
+            file.seek(0)
+            self.assertEqual(file.read(), b'a' * 50)
+            self.assertIsNone(file.path)
+            self.assertEqual(self._scratch_files(), [])
+            self.assertEqual(self.store.stats()['memory_bytes'], 50)
+
+        stats = self.store.stats()
+        self.assertEqual((stats['files'], stats['memory_bytes'], stats['disk_bytes']), (0, 0, 0))
+
+    def test_large_files_roll_over_to_disk(self):
+        file = self.store.spool()
+        file.write(b'a' * 80)
+        file.write(b'b' * 80)
+
+        self.assertIsNotNone(file.path)
+        self.assertEqual(self._scratch_files(), [os.path.basename(file.path)])
+        self.assertEqual(file.getvalue(), b'a' * 80 + b'b' * 80)
+        self.assertEqual(file.tell(), 160)
+        stats = self.store.stats()
+        self.assertEqual((stats['memory_bytes'], stats['disk_bytes'], stats['rollovers']), (0, 160, 1))
+
+        file.close()
+        self.assertEqual(self._scratch_files(), [])
+        self.assertEqual(self.store.stats()['disk_bytes'], 0)
+
+    def test_overwriting_doesnt_take_more_of_the_quota(self):
+        with self.store.spool() as file:
+            file.write(b'a' * 60)
+            file.seek(0)
+            file.write(b'b' * 60)
+            self.assertEqual(file.size, 60)
+            self.assertEqual(self.store.stats()['memory_bytes'], 60)
+
+    def test_quota(self):
+        first = self.store.spool()
+        first.write(b'a' * 900)
+
+        second = self.store.spool()
+        with self.assertRaises(ScratchQuotaException):
+            second.write(b'b' * 200)
+        self.assertEqual(self.store.stats()['rejections'], 1)
+        second.close()
+
+        # the space is given back once the first file is closed
+        first.close()
+        with self.store.spool() as third:
+            third.write(b'c' * 900)
+
+    def test_sweep_removes_only_stale_scratch_files(self):
+        stale = os.path.join(self.directory, SCRATCH_PREFIX + 'stale')
+        fresh = os.path.join(self.directory, SCRATCH_PREFIX + 'fresh')
+        other = os.path.join(self.directory, 'not-scratch')
+        for path in (stale, fresh, other):
+            with open(path, 'wb') as file:
+                file.write(b'x')
+        old = time.time() - 120
+        os.utime(stale, (old, old))
+        os.utime(other, (old, old))
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertEqual(self.store.sweep(), 1)
+        self.assertEqual(sorted(os.listdir(self.directory)), sorted([SCRATCH_PREFIX + 'fresh', 'not-scratch']))
+        self.assertEqual(self.store.stats()['swept'], 1)
+
+    def test_closing_a_swept_file(self):
+        file = self.store.spool()
+        file.write(b'a' * 200)
+        os.remove(file.path)
+        file.close()
+        self.assertEqual(self.store.stats()['disk_bytes'], 0)
+
+
+class AppScratchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='generator-test-')
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.client = template_generator_app.app.test_client()
+
+    def test_upload_over_the_quota(self):
+        store = ScratchStore(self.directory, spool_max_size=100, quota=1000, sweep_interval=0)
+        upload = (io.BytesIO(b'x' * 5000), 'big.yaml')
+        with mock.patch.object(template_generator_app, 'SCRATCH', store):
+            response = self.client.post('/upload', data={'yamlfile': upload}, content_type='multipart/form-data')
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.headers['Retry-After'], '30')
+        self.assertIn('scratch space', response.json['error'])
+        self.assertEqual(store.stats()['rejections'], 1)
+        self.assertEqual(os.listdir(self.directory), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
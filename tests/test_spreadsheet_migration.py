@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+# Tests of reading and rewriting the header rows of xlsx files with spreadsheet_migration.py. Every rewritten
+# workbook is opened again with openpyxl to check it is still a valid spreadsheet with its data rows intact. Run from
+# the repo root with
+#   python -m pytest tests
+import io
+import unittest
+import zipfile
+
+import openpyxl
+
+import fake_generator  # noqa: F401 - puts the generator directory on the path
+from spreadsheet_migration import StreamingWorkbook, column_letter
+
+DATA_ROWS = 500
+
+# a minimal workbook as Excel and other tools write it with inline strings rather than a shared strings table
+INLINE_PARTS = {
+    '[Content_Types].xml':
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>',
+    '_rels/.rels':
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+        'Target="xl/workbook.xml"/>'
+        '</Relationships>',
+    'xl/workbook.xml':
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="Donor organism" sheetId="1" r:id="rId1"/></sheets>'
+        '</workbook>',
+    'xl/_rels/workbook.xml.rels':
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+        'Target="worksheets/sheet1.xml"/>'
+        '</Relationships>',
+    'xl/worksheets/sheet1.xml':
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+        '<row r="1" spans="1:2"><c r="A1" t="inlineStr"><is><t>DONOR ID</t></is></c>'
+        '<c r="B1" t="inlineStr"><is><r><t>Old </t></r><r><t>name</t></r></is></c></row>'
+        '<row r="4"><c r="A4" t="inlineStr"><is><t>donor_organism.biomaterial_core.biomaterial_id</t></is></c>'
+        '<c r="B4" t="inlineStr"><is><t>donor_organism.old_field</t></is></c></row>'
+        '<row r="6"><c r="A6" t="inlineStr"><is><t>donor_1</t></is></c><c r="B6"><v>42</v></c></row>'
+        '<row r="7"><c r="A7" t="inlineStr"><is><t>donor_2 &amp; co</t></is></c><c r="B7" t="b"><v>1</v></c></row>'
+        '</sheetData></worksheet>'
+}
+
+
+# a workbook written by openpyxl, which keeps its strings in a shared strings table - four header rows and
+# DATA_ROWS data rows in the Donor organism tab, and an Empty tab without any cells
+def _shared_strings_workbook():
+    workbook = openpyxl.Workbook()
+    worksheet = workbook.active
+    worksheet.title = 'Donor organism'
+    worksheet.append(['DONOR ID', 'OLD NAME'])
+    worksheet.append(['An ID for the donor', 'A field that has been renamed'])
+    worksheet.append(['eg donor_1', 'Tom & Jerry <friends>'])
+    worksheet.append(['donor_organism.biomaterial_core.biomaterial_id', 'donor_organism.old_field'])
+    worksheet.append([])
+    for row in range(DATA_ROWS):
+        worksheet.append(['donor_' + str(row), row, row % 2 == 0, 'shared & <escaped>'])
+    workbook.create_sheet('Empty')
+
+    content = io.BytesIO()
+    workbook.save(content)
+    content.seek(0)
+    return content
+
+def _inline_strings_workbook():
+    content = io.BytesIO()
+    with zipfile.ZipFile(content, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for name, xml in INLINE_PARTS.items():
+            archive.writestr(name, xml)
+    content.seek(0)
+    return content
+
+# saves a streaming workbook and opens the result with openpyxl
+def _save_and_reopen(workbook):
+    content = io.BytesIO()
+    workbook.save(content)
+    workbook.close()
+    content.seek(0)
+    return openpyxl.load_workbook(content)
+
+def _values(worksheet, row):
+    return [cell.value for cell in worksheet[row]]
+
+
+class StreamingWorkbookTest(unittest.TestCase):
+
+    def test_reads_shared_strings(self):
+        workbook = StreamingWorkbook(_shared_strings_workbook())
+
+        self.assertEqual(workbook.sheetnames, ['Donor organism', 'Empty'])
+        rows = workbook.read_rows('Donor organism', 4)
+        self.assertEqual(sorted(rows), [1, 2, 3, 4])
+        self.assertEqual(rows[1], {1: 'DONOR ID', 2: 'OLD NAME'})
+        self.assertEqual(rows[3][2], 'Tom & Jerry <friends>')
+        self.assertEqual(rows[4][2], 'donor_organism.old_field')
+        workbook.close()
+
+    def test_rewrites_shared_strings_workbook(self):
+        workbook = StreamingWorkbook(_shared_strings_workbook())
+        workbook.set_value('Donor organism', 4, 2, 'donor_organism.field_0')
+        workbook.set_value('Donor organism', 1, 2, 'FIELD 0')
+        workbook.set_value('Donor organism', 2, 2, None)
+
+        reopened = _save_and_reopen(workbook)
+        worksheet = reopened['Donor organism']
+        self.assertEqual(_values(worksheet, 1), ['DONOR ID', 'FIELD 0', None, None])
+        self.assertEqual(_values(worksheet, 2), ['An ID for the donor', None, None, None])
+        self.assertEqual(_values(worksheet, 3), ['eg donor_1', 'Tom & Jerry <friends>', None, None])
+        self.assertEqual(_values(worksheet, 4), ['donor_organism.biomaterial_core.biomaterial_id',
+                                                 'donor_organism.field_0', None, None])
+        # the data rows come through untouched
+        self.assertEqual(worksheet.max_row, 5 + DATA_ROWS)
+        for row in range(DATA_ROWS):
+            self.assertEqual(_values(worksheet, 6 + row), ['donor_' + str(row), row, row % 2 == 0,
+                                                           'shared & <escaped>'])
+
+    def test_reads_inline_strings(self):
+        workbook = StreamingWorkbook(_inline_strings_workbook())
+
+        rows = workbook.read_rows('Donor organism', 4)
+        self.assertEqual(rows, {1: {1: 'DONOR ID', 2: 'Old name'},
+                                4: {1: 'donor_organism.biomaterial_core.biomaterial_id',
+                                    2: 'donor_organism.old_field'}})
+        # only the rows asked for are read
+        self.assertEqual(sorted(workbook.read_rows('Donor organism', 6)), [1, 4, 6])
+        workbook.close()
+
+    def test_rewrites_inline_strings_workbook(self):
+        workbook = StreamingWorkbook(_inline_strings_workbook())
+        workbook.set_value('Donor organism', 4, 2, 'donor_organism.field_0')
+        workbook.set_value('Donor organism', 1, 2, 'FIELD 0')
+        # rows 2 and 3 aren't in the worksheet yet
+        workbook.set_value('Donor organism', 2, 2, 'A description')
+
+        reopened = _save_and_reopen(workbook)
+        worksheet = reopened['Donor organism']
+        self.assertEqual(_values(worksheet, 1), ['DONOR ID', 'FIELD 0'])
+        self.assertEqual(_values(worksheet, 2), [None, 'A description'])
+        self.assertEqual(_values(worksheet, 4), ['donor_organism.biomaterial_core.biomaterial_id',
+                                                 'donor_organism.field_0'])
+        self.assertEqual(_values(worksheet, 6), ['donor_1', 42])
+        self.assertEqual(_values(worksheet, 7), ['donor_2 & co', True])
+
+    def test_escapes_new_values(self):
+        value = 'Tom & Jerry <friends> "quoted" \'single\' ]]> éè'
+        workbook = StreamingWorkbook(_inline_strings_workbook())
+        workbook.set_value('Donor organism', 1, 1, value)
+
+        content = io.BytesIO()
+        workbook.save(content)
+        workbook.close()
+
+        self.assertEqual(StreamingWorkbook(content).read_rows('Donor organism', 1)[1][1], value)
+        content.seek(0)
+        self.assertEqual(openpyxl.load_workbook(content)['Donor organism']['A1'].value, value)
+
+    def test_rewrites_empty_sheet(self):
+        workbook = StreamingWorkbook(_shared_strings_workbook())
+        self.assertEqual(workbook.read_rows('Empty', 4), {})
+        workbook.set_value('Empty', 1, 1, 'DONOR ID')
+        workbook.set_value('Empty', 4, 1, 'donor_organism.biomaterial_core.biomaterial_id')
+
+        reopened = _save_and_reopen(workbook)
+        worksheet = reopened['Empty']
+        self.assertEqual(worksheet['A1'].value, 'DONOR ID')
+        self.assertEqual(worksheet['A4'].value, 'donor_organism.biomaterial_core.biomaterial_id')
+        self.assertEqual(worksheet.max_row, 4)
+        self.assertEqual(reopened['Donor organism'].max_row, 5 + DATA_ROWS)
+
+    def test_adds_columns(self):
+        workbook = StreamingWorkbook(_shared_strings_workbook())
+        # past the last column of the header rows, and past column Z
+        workbook.set_value('Donor organism', 4, 3, 'donor_organism.field_1')
+        workbook.set_value('Donor organism', 4, 28, 'donor_organism.field_2')
+        workbook.set_value('Donor organism', 1, 28, 'FIELD 2')
+
+        reopened = _save_and_reopen(workbook)
+        worksheet = reopened['Donor organism']
+        self.assertEqual(worksheet['C4'].value, 'donor_organism.field_1')
+        self.assertEqual(worksheet[column_letter(28) + '4'].value, 'donor_organism.field_2')
+        self.assertEqual(worksheet['AB1'].value, 'FIELD 2')
+        self.assertEqual(worksheet['B4'].value, 'donor_organism.old_field')
+        self.assertEqual(_values(worksheet, 6)[:4], ['donor_0', 0, True, 'shared & <escaped>'])
+        self.assertEqual(worksheet.max_row, 5 + DATA_ROWS)
+
+    def test_column_letter(self):
+        self.assertEqual([column_letter(column) for column in (1, 26, 27, 28, 52, 703)],
+                         ['A', 'Z', 'AA', 'AB', 'AZ', 'AAA'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+# Tests of loading YAML files of tabs with yaml_io.py. Run from the repo root with
+#   python -m pytest tests
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'generator'))
+
+from yaml_io import YamlException, dump_yaml, load_tabs
+
+TABS = b"""tabs:
+- donor_organism:
+    display_name: Donor organism
+    columns:
+    - donor_organism.biomaterial_core.biomaterial_id
+"""
+
+
+class LoadTabsTest(unittest.TestCase):
+
+    def test_loads_tabs(self):
+        tabs = load_tabs(TABS)
+        self.assertEqual(tabs, {'tabs': [{'donor_organism': {
+            'display_name': 'Donor organism', 'columns': ['donor_organism.biomaterial_core.biomaterial_id']}}]})
+        self.assertEqual(load_tabs(dump_yaml(tabs)), tabs)
+
+    def test_rejects_tab_without_display_name(self):
+        content = b"tabs:\n- donor_organism:\n    columns:\n    - donor_organism.biomaterial_core.biomaterial_id\n"
+        with self.assertRaisesRegex(YamlException, "a tab must have a display name"):
+            load_tabs(content)
+
+    def test_rejects_tab_without_columns(self):
+        with self.assertRaisesRegex(YamlException, "a tab must have a list of columns"):
+            load_tabs(b"tabs:\n- donor_organism:\n    display_name: Donor organism\n")
+
+    def test_rejects_non_string_column(self):
+        with self.assertRaisesRegex(YamlException, "must be strings"):
+            load_tabs(TABS + b"    - [1, 2]\n")
+
+    def test_rejects_file_over_size_limit(self):
+        with self.assertRaisesRegex(YamlException, "bigger than the limit"):
+            load_tabs(TABS, max_bytes=10)
+
+    def test_rejects_alias_expansion_over_node_limit(self):
+        content = b"a: &a [x, x, x, x, x, x, x, x]\nb: &b [*a, *a, *a, *a, *a, *a, *a, *a]\n" \
+                  b"c: [*b, *b, *b, *b, *b, *b, *b, *b]\n" + TABS
+        with self.assertRaisesRegex(YamlException, "more than the limit"):
+            load_tabs(content, max_nodes=500)
+
+
+if __name__ == '__main__':
+    unittest.main()